@@ -5,7 +5,11 @@ import sys
 import platform
 import logging
 
-from anypytools.abcutils import AnyPyProcess, execute_anybodycon
+from anypytools.abcutils import (
+    AnyPyProcess,
+    execute_anybodycon,
+    execute_anybodycon_async,
+)
 from anypytools.macroutils import AnyMacro
 from anypytools import macro_commands
 from anypytools.tools import (
@@ -28,6 +32,7 @@ __all__ = [
     "macro_commands",
     "print_versions",
     "execute_anybodycon",
+    "execute_anybodycon_async",
     "ABOVE_NORMAL_PRIORITY_CLASS",
     "BELOW_NORMAL_PRIORITY_CLASS",
     "IDLE_PRIORITY_CLASS",
@@ -8,19 +8,28 @@ Created on Fri Oct 19 21:14:59 2012
 
 import os
 import io
+import re
 import sys
+import json
 import time
-import copy
+import hashlib
+import functools
+import datetime
 import types
 import ctypes
+import heapq
+import select
+import asyncio
 import shelve
+import uuid
 import atexit
+import weakref
 import logging
-import collections
-from subprocess import Popen
-from tempfile import NamedTemporaryFile
-from threading import Thread, RLock
-from queue import Queue
+import collections.abc
+from subprocess import Popen, PIPE, STDOUT, TimeoutExpired
+from tempfile import NamedTemporaryFile, mkstemp
+from threading import Thread, Timer, Event, RLock, get_ident, local
+from queue import Queue, Empty
 
 import numpy as np
 
@@ -28,6 +37,7 @@ from .tools import (
     make_hash,
     AnyPyProcessOutputList,
     parse_anybodycon_output,
+    AnyBodyConOutputParser,
     getsubdirs,
     get_anybodycon_path,
     BELOW_NORMAL_PRIORITY_CLASS,
@@ -37,6 +47,11 @@ from .tools import (
     silentremove,
 )
 from .macroutils import AnyMacro, MacroCommand
+from .tracing import TraceEvent
+from .cache import ResultCache
+from .journal import TaskJournal
+from .storage import ResultStore
+from .h5columnar import save_columnar
 
 try:
     from IPython.display import HTML, display
@@ -54,6 +69,17 @@ logger = logging.getLogger("abt.anypytools")
 _thread_lock = RLock()
 _KILLED_BY_ANYPYTOOLS = 10
 _NO_LICENSES_AVAILABLE = -22
+_NOT_RUN_MSG = (
+    "ERROR: AnyPyTools : Not run. The batch was stopped after {} failed tasks"
+)
+_ABORTED_MSG = (
+    "ERROR: AnyPyTools : Aborted. The batch was stopped after {} failed tasks"
+)
+# Resources used by a console, which are recorded for each task
+_USAGE_KEYS = ("user_time", "system_time", "peak_memory", "read_bytes", "write_bytes")
+_NOT_COMPLETED_MSG = (
+    "\nERROR: AnyPyTools : The console exited before the task was completed"
+)
 
 
 class _SubProcessContainer(object):
@@ -73,24 +99,57 @@ class _SubProcessContainer(object):
     remove(pid):
         Remove process id from the record
 
+    run_in_group(group, func, *args):
+        Call a function and add the processes it starts to a process group
+
+    stop_group(group):
+        Kill the processes of a group
+
     """
 
     def __init__(self):
         self._pids = set()
         self._stop_all = False
+        # The process group of the batch, which the current thread works on
+        self._local = local()
 
     def add(self, pid):
+        group = getattr(self._local, "group", None)
         with _thread_lock:
             self._pids.add(pid)
+            if group is not None:
+                group.pids.add(pid)
         if self.stop_all:
             self._kill_running_processes()
+        elif group is not None and group.stopped:
+            self.stop_group(group)
 
     def remove(self, pid):
+        group = getattr(self._local, "group", None)
         with _thread_lock:
-            try:
-                self._pids.remove(pid)
-            except KeyError:
-                pass
+            self._pids.discard(pid)
+            if group is not None:
+                group.pids.discard(pid)
+
+    def run_in_group(self, group, func, *args):
+        """Call `func` with the processes started by it added to `group`."""
+        self._local.group = group
+        try:
+            return func(*args)
+        finally:
+            self._local.group = None
+
+    def stop_group(self, group):
+        """Kill the running processes of `group` and those started later."""
+        with _thread_lock:
+            group.stopped = True
+            for pid in group.pids & self._pids:
+                try:
+                    os.kill(pid, _KILLED_BY_ANYPYTOOLS)
+                except Exception:
+                    pass
+                self._pids.discard(pid)
+            group.pids.clear()
 
     @property
     def stop_all(self):
@@ -119,6 +178,14 @@ class _SubProcessContainer(object):
             self._pids.clear()
 
 
+class _ProcessGroup(object):
+    """The pids of the consoles started for one batch."""
+
+    def __init__(self):
+        self.pids = set()
+        self.stopped = False
+
+
 _subprocess_container = _SubProcessContainer()
 atexit.register(_subprocess_container._kill_running_processes)
 
@@ -130,6 +197,343 @@ def _display(line, *args, **kwargs):
         print(line, *args, **kwargs)
 
 
+def _wait_for_process(proc, timeout, usage=None):
+    """Block until the process exits or the timeout expires.
+
+    The wait is event driven: On Linux the process is watched through a pidfd,
+    otherwise ``Popen.wait()`` is used, which blocks on the process handle on
+    Windows. If `usage` is given it is updated with the resources used by the
+    process (see :func:`_reap_process`).
+
+    Returns
+    -------
+    bool
+        True if the process exited before the timeout.
+    """
+    timeout = max(timeout, 0)
+    if hasattr(os, "pidfd_open"):
+        try:
+            pidfd = os.pidfd_open(proc.pid)
+        except OSError:
+            # Kernel without pidfd support. Use the fallback below.
+            pass
+        else:
+            try:
+                poller = select.poll()
+                poller.register(pidfd, select.POLLIN)
+                if not poller.poll(timeout * 1000):
+                    return False
+            finally:
+                os.close(pidfd)
+            _reap_process(proc, usage)
+            return True
+    if usage is not None and hasattr(os, "wait4"):
+        # Poll like Popen.wait() does, but reap the process with wait4()
+        deadline = time.monotonic() + timeout
+        delay = 0.0005
+        while proc.returncode is None:
+            _reap_process(proc, usage, block=False)
+            remaining = deadline - time.monotonic()
+            if proc.returncode is None and remaining <= 0:
+                return False
+            time.sleep(min(delay, max(remaining, 0), 0.05))
+            delay *= 2
+        return True
+    try:
+        proc.wait(timeout=timeout)
+    except TimeoutExpired:
+        return False
+    _reap_process(proc, usage)
+    return True
+
+
+def _reap_process(proc, usage=None, block=True):
+    """Wait for the process and record the resources it used in `usage`.
+
+    On POSIX the process is reaped with ``os.wait4()``, which returns the CPU
+    time, peak memory and block I/O of the process. On Windows the figures
+    are read from the process handle. Nothing is recorded if `usage` is None
+    or the process was already reaped.
+    """
+    if usage is None or not hasattr(os, "wait4"):
+        if block:
+            proc.wait()
+        elif proc.poll() is None:
+            return
+        if usage is not None:
+            # The process handle stays open after the wait on Windows
+            usage.update(_process_usage(proc))
+        return
+    if proc.returncode is not None:
+        return
+    try:
+        pid, status, rusage = os.wait4(proc.pid, 0 if block else os.WNOHANG)
+    except ChildProcessError:
+        # Reaped somewhere else
+        proc.wait()
+        return
+    if pid == 0:
+        return
+    if os.WIFSIGNALED(status):
+        proc.returncode = -os.WTERMSIG(status)
+    else:
+        proc.returncode = os.WEXITSTATUS(status)
+    usage.update(_rusage_to_dict(rusage))
+
+
+def _rusage_to_dict(rusage):
+    # ru_maxrss is in kilobytes, except on macOS where it is in bytes. On
+    # Linux it also covers the memory of this process when the console was
+    # forked, so small consoles may show the size of the Python process. The
+    # block counts are in units of 512 bytes and only count real disk I/O.
+    peak_memory = rusage.ru_maxrss
+    if sys.platform != "darwin":
+        peak_memory *= 1024
+    return dict(
+        user_time=rusage.ru_utime,
+        system_time=rusage.ru_stime,
+        peak_memory=peak_memory,
+        read_bytes=rusage.ru_inblock * 512,
+        write_bytes=rusage.ru_oublock * 512,
+    )
+
+
+def _process_usage(proc):
+    """Return the resources used so far by a process which is not reaped.
+
+    The figures are read from ``/proc`` on Linux and from the process handle
+    on Windows. An empty dict is returned on other platforms.
+    """
+    if sys.platform.startswith("win"):
+        return _windows_process_usage(proc._handle)
+    try:
+        with open("/proc/{}/stat".format(proc.pid)) as f:
+            # The command name may contain spaces, so split after it
+            stat = f.read().rsplit(")", 1)[1].split()
+        with open("/proc/{}/status".format(proc.pid)) as f:
+            status = dict(line.split(":", 1) for line in f if ":" in line)
+        with open("/proc/{}/io".format(proc.pid)) as f:
+            io_counters = dict(line.split(":", 1) for line in f if ":" in line)
+    except (OSError, IndexError, ValueError):
+        return {}
+    ticks = os.sysconf("SC_CLK_TCK")
+    usage = dict(
+        user_time=int(stat[11]) / ticks,
+        system_time=int(stat[12]) / ticks,
+        read_bytes=int(io_counters["read_bytes"]),
+        write_bytes=int(io_counters["write_bytes"]),
+    )
+    if "VmHWM" in status:
+        usage["peak_memory"] = int(status["VmHWM"].split()[0]) * 1024
+    return usage
+
+
+def _windows_process_usage(handle):
+    class IO_COUNTERS(ctypes.Structure):
+        _fields_ = [
+            (name, ctypes.c_ulonglong)
+            for name in (
+                "ReadOperationCount",
+                "WriteOperationCount",
+                "OtherOperationCount",
+                "ReadTransferCount",
+                "WriteTransferCount",
+                "OtherTransferCount",
+            )
+        ]
+
+    class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+        _fields_ = [("cb", ctypes.c_ulong), ("PageFaultCount", ctypes.c_ulong)] + [
+            (name, ctypes.c_size_t)
+            for name in (
+                "PeakWorkingSetSize",
+                "WorkingSetSize",
+                "QuotaPeakPagedPoolUsage",
+                "QuotaPagedPoolUsage",
+                "QuotaPeakNonPagedPoolUsage",
+                "QuotaNonPagedPoolUsage",
+                "PagefileUsage",
+                "PeakPagefileUsage",
+            )
+        ]
+
+    handle = ctypes.c_void_p(int(handle))
+    # FILETIME values count 100 nanosecond intervals
+    times = [ctypes.c_ulonglong() for _ in range(4)]
+    io_counters = IO_COUNTERS()
+    memory = PROCESS_MEMORY_COUNTERS()
+    memory.cb = ctypes.sizeof(memory)
+    if not (
+        ctypes.windll.kernel32.GetProcessTimes(
+            handle, *(ctypes.byref(t) for t in times)
+        )
+        and ctypes.windll.kernel32.GetProcessIoCounters(
+            handle, ctypes.byref(io_counters)
+        )
+        and ctypes.windll.psapi.GetProcessMemoryInfo(
+            handle, ctypes.byref(memory), memory.cb
+        )
+    ):
+        return {}
+    return dict(
+        user_time=times[3].value * 1e-7,
+        system_time=times[2].value * 1e-7,
+        peak_memory=memory.PeakWorkingSetSize,
+        read_bytes=io_counters.ReadTransferCount,
+        write_bytes=io_counters.WriteTransferCount,
+    )
+
+
+def _usage_difference(before, after):
+    """Resources used between two readings of :func:`_process_usage`.
+
+    The peak memory is the peak of the process so far.
+    """
+    usage = {}
+    for key, value in after.items():
+        if key == "peak_memory":
+            usage[key] = value
+        elif key in before:
+            usage[key] = value - before[key]
+    return usage
+
+
+def _prepare_anybodycon_launch(
+    macro, logfile, anybodycon_path, priority, macro_filename=None
+):
+    """Write the macro file and assemble the command line for AnyBodyCon.
+
+    Returns
+    -------
+    tuple
+        The command line, the name of the macro file and the subprocess
+        creation flags.
+    """
+    if macro_filename is None:
+        try:
+            macro_filename = os.path.splitext(logfile.name)[0] + ".anymcr"
+        except AttributeError:
+            macro_filename = "macrofile.anymcr"
+
+    if anybodycon_path is None:
+        anybodycon_path = get_anybodycon_path()
+
+    if macro and macro[-1] != "exit":
+        macro.append("exit")
+
+    if not os.path.isfile(anybodycon_path):
+        raise IOError("Can not find anybodycon.exe: " + anybodycon_path)
+
+    with open(macro_filename, "w+b") as macro_file:
+        macro_file.write("\n".join(macro).encode("UTF-8"))
+        macro_file.flush()
+    anybodycmd = _anybodycon_command(anybodycon_path) + [
+        "--macro=",
+        macro_file.name,
+        "/ni",
+    ]
+    return anybodycmd, macro_file.name, _subprocess_flags(priority)
+
+
+def _anybodycon_command(anybodycon_path):
+    """Return the command which starts the console.
+
+    Python scripts (like :mod:`anypytools.fake_anybodycon`) are started with
+    the running Python interpreter.
+    """
+    if anybodycon_path.endswith(".py"):
+        return [sys.executable, os.path.realpath(anybodycon_path)]
+    return [os.path.realpath(anybodycon_path)]
+
+
+def _subprocess_flags(priority):
+    """Return the process creation flags for the console."""
+    if sys.platform.startswith("win"):
+        # Don't display the Windows GPF dialog if the invoked program dies.
+        # See comp.os.ms-windows.programmer.win32
+        # How to suppress crash notification dialog?, Jan 14,2004 -
+        # Raymond Chen's response [1]
+        SEM_NOGPFAULTERRORBOX = 0x0002  # From MSDN
+        ctypes.windll.kernel32.SetErrorMode(SEM_NOGPFAULTERRORBOX)
+        subprocess_flags = 0x8000000  # win32con.CREATE_NO_WINDOW?
+        subprocess_flags |= priority
+    else:
+        # Process priority classes and creation flags are Windows only
+        subprocess_flags = 0
+    return subprocess_flags
+
+
+class _LineTee(object):
+    """File like object which passes the written text on line by line.
+
+    Every complete line is given to `line_callback` and the text is
+    copied to `logfile` if one is given.
+    """
+
+    def __init__(self, line_callback, logfile=None):
+        self.line_callback = line_callback
+        self.logfile = logfile
+        self.stop_requested = False
+        self._partial_line = ""
+
+    @property
+    def name(self):
+        return self.logfile.name
+
+    def flush(self):
+        if self.logfile is not None:
+            self.logfile.flush()
+
+    def seek(self, *args):
+        if self.logfile is None:
+            raise io.UnsupportedOperation("seek")
+        return self.logfile.seek(*args)
+
+    def write(self, text):
+        if self.logfile is not None:
+            self.logfile.write(text)
+        lines = (self._partial_line + text).split("\n")
+        self._partial_line = lines.pop()
+        for line in lines:
+            if self.line_callback(line):
+                self.stop_requested = True
+
+    def close(self):
+        """Pass on any remaining text which did not end with a newline."""
+        if self._partial_line:
+            self.line_callback(self._partial_line)
+            self._partial_line = ""
+
+
+def _write_timeout_message(logfile, timeout):
+    try:
+        logfile.seek(0, os.SEEK_END)
+    except io.UnsupportedOperation:
+        pass
+    logfile.write("\nERROR: AnyPyTools : Timeout after {:d} sec.".format(int(timeout)))
+
+
+def _write_returncode_message(logfile, returncode):
+    """Convert the return code and report abnormal exits in the log."""
+    retcode = ctypes.c_int32(returncode).value
+    if not sys.platform.startswith("win") and retcode == _NO_LICENSES_AVAILABLE & 0xFF:
+        # Exit codes are 8 bit on POSIX, where the console's -22 is seen as 234
+        retcode = _NO_LICENSES_AVAILABLE
+    if retcode == _KILLED_BY_ANYPYTOOLS:
+        logfile.write("\nAnybodycon.exe was interrupted by AnyPyTools")
+    elif retcode == _NO_LICENSES_AVAILABLE:
+        logfile.write(
+            "\nERROR: anybodycon.exe existed unexpectedly. "
+            "Return code: " + str(_NO_LICENSES_AVAILABLE) + " : No license available."
+        )
+    elif retcode:
+        logfile.write(
+            "\nERROR: AnyPyTools : anybodycon.exe exited unexpectedly."
+            " Return code: " + str(retcode)
+        )
+    return retcode
+
+
 def execute_anybodycon(
     macro,
     logfile=None,
@@ -138,6 +542,10 @@ def execute_anybodycon(
     keep_macrofile=False,
     env=None,
     priority=BELOW_NORMAL_PRIORITY_CLASS,
+    line_callback=None,
+    macro_filename=None,
+    usage=None,
+    trace=None,
 ):
     """Launch a single AnyBodyConsole applicaiton.
 
@@ -169,6 +577,23 @@ def execute_anybodycon(
         ``anypytools.IDLE_PRIORITY_CLASS``, ``anypytools.BELOW_NORMAL_PRIORITY_CLASS``,
         ``anypytools.NORMAL_PRIORITY_CLASS``, ``anypytools.HIGH_PRIORITY_CLASS``
         Default is BELOW_NORMAL_PRIORITY_CLASS.
+    line_callback : callable, optional
+        Function which is called with each line of output while the console
+        runs. The output is then read through a pipe and only written to
+        `logfile` if one is given. If the function returns True the console
+        is terminated. (Defaults to None)
+    macro_filename : str, optional
+        Name of the temporary macro file. Defaults to the name of the
+        logfile with the extension ``.anymcr``.
+    usage : dict, optional
+        Dictionary which is updated with the resources used by the console:
+        ``user_time`` and ``system_time`` (CPU seconds), ``peak_memory``
+        (peak resident memory in bytes), ``read_bytes`` and ``write_bytes``.
+        The figures are not available on all platforms.
+    trace : callable, optional
+        Function which is called with the name of each phase of the launch:
+        ``"macro_written"``, ``"spawned"``, ``"first_output"`` (only with
+        `line_callback`) and ``"exited"``.
 
     Returns
     -------
@@ -176,41 +601,30 @@ def execute_anybodycon(
         The return code from the AnyBody Console application.
 
     """
+    if line_callback is not None:
+        return _execute_anybodycon_piped(
+            macro,
+            _LineTee(line_callback, logfile),
+            anybodycon_path,
+            timeout,
+            keep_macrofile,
+            env,
+            priority,
+            macro_filename,
+            usage,
+            trace,
+        )
     if logfile is None:
         logfile = sys.stdout
 
-    try:
-        macro_filename = os.path.splitext(logfile.name)[0] + ".anymcr"
-    except AttributeError:
-        macro_filename = "macrofile.anymcr"
-
-    if anybodycon_path is None:
-        anybodycon_path = get_anybodycon_path()
-
-    if macro and macro[-1] != "exit":
-        macro.append("exit")
-
-    if not os.path.isfile(anybodycon_path):
-        raise IOError("Can not find anybodycon.exe: " + anybodycon_path)
-
-    with open(macro_filename, "w+b") as macro_file:
-        macro_file.write("\n".join(macro).encode("UTF-8"))
-        macro_file.flush()
-    anybodycmd = [os.path.realpath(anybodycon_path), "--macro=", macro_file.name, "/ni"]
-    if sys.platform.startswith("win"):
-        # Don't display the Windows GPF dialog if the invoked program dies.
-        # See comp.os.ms-windows.programmer.win32
-        # How to suppress crash notification dialog?, Jan 14,2004 -
-        # Raymond Chen's response [1]
-        SEM_NOGPFAULTERRORBOX = 0x0002  # From MSDN
-        ctypes.windll.kernel32.SetErrorMode(SEM_NOGPFAULTERRORBOX)
-        subprocess_flags = 0x8000000  # win32con.CREATE_NO_WINDOW?
-    else:
-        subprocess_flags = 0
-    subprocess_flags |= priority
+    anybodycmd, macro_filename, subprocess_flags = _prepare_anybodycon_launch(
+        macro, logfile, anybodycon_path, priority, macro_filename
+    )
+    if trace is not None:
+        trace("macro_written")
     # Check global module flag to avoid starting processes after
     # the user cancelled the processes
-    timeout_time = time.clock() + timeout
+    deadline = time.monotonic() + timeout
     proc = Popen(
         anybodycmd,
         stdout=logfile,
@@ -219,37 +633,650 @@ def execute_anybodycon(
         env=env,
     )
     _subprocess_container.add(proc.pid)
-    while proc.poll() is None:
-        if time.clock() > timeout_time:
-            proc.terminate()
-            proc.communicate()
+    if trace is not None:
+        trace("spawned")
+    if not _wait_for_process(proc, deadline - time.monotonic(), usage):
+        proc.terminate()
+        _reap_process(proc, usage)
+        _write_timeout_message(logfile, timeout)
+        proc.returncode = 0
+    _subprocess_container.remove(proc.pid)
+    if trace is not None:
+        trace("exited")
+    retcode = _write_returncode_message(logfile, proc.returncode)
+    if not keep_macrofile:
+        silentremove(macro_filename)
+    return retcode
+
+
+def _execute_anybodycon_piped(
+    macro,
+    tee,
+    anybodycon_path,
+    timeout,
+    keep_macrofile,
+    env,
+    priority,
+    macro_filename,
+    usage=None,
+    trace=None,
+):
+    """Run the console with the output read line by line through a pipe."""
+    anybodycmd, macro_filename, subprocess_flags = _prepare_anybodycon_launch(
+        macro, tee, anybodycon_path, priority, macro_filename
+    )
+    if trace is not None:
+        trace("macro_written")
+    proc = Popen(
+        anybodycmd,
+        stdout=PIPE,
+        stderr=STDOUT,
+        creationflags=subprocess_flags,
+        env=env,
+    )
+    _subprocess_container.add(proc.pid)
+    if trace is not None:
+        trace("spawned")
+    timed_out = Event()
+
+    def _terminate():
+        timed_out.set()
+        proc.terminate()
+
+    # Reading the pipe blocks, so the timeout is handled by a timer
+    timer = Timer(timeout, _terminate)
+    timer.daemon = True
+    timer.start()
+    stopped = False
+    first_line = True
+    try:
+        with io.TextIOWrapper(proc.stdout, errors="replace") as stdout:
+            for line in stdout:
+                if first_line and trace is not None:
+                    trace("first_output")
+                first_line = False
+                tee.write(line)
+                if tee.stop_requested and not stopped:
+                    stopped = True
+                    proc.terminate()
+        _reap_process(proc, usage)
+    finally:
+        timer.cancel()
+        _subprocess_container.remove(proc.pid)
+    if trace is not None:
+        trace("exited")
+    if timed_out.is_set():
+        _write_timeout_message(tee, timeout)
+        proc.returncode = 0
+    elif stopped:
+        tee.write("\nAnybodycon.exe was stopped by AnyPyTools after an error")
+        proc.returncode = 0
+    retcode = _write_returncode_message(tee, proc.returncode)
+    tee.close()
+    if not keep_macrofile:
+        silentremove(macro_filename)
+    return retcode
+
+
+async def execute_anybodycon_async(
+    macro,
+    logfile=None,
+    anybodycon_path=None,
+    timeout=3600,
+    keep_macrofile=False,
+    env=None,
+    priority=BELOW_NORMAL_PRIORITY_CLASS,
+    semaphore=None,
+):
+    """Launch a single AnyBodyConsole applicaiton from asyncio.
+
+    Coroutine version of :func:`execute_anybodycon`. The console is started
+    with ``asyncio.create_subprocess_exec`` so many simulations can be
+    awaited concurrently from a single event loop.
+
+    Parameters
+    ----------
+    macro : list of str
+        List of macros strings to pass to the AnyBody Console Application
+    logfile : file like object, optional
+        An open file like object to write to pipe the output of AnyBody
+        into. (Defaults to None, in which case it will use sys.stdout)
+    anybodycon_path : str, optional
+        Path to the AnyBodyConsole application. Default to None, in which
+        case the default installed AnyBody installation will be looked up
+        in the Windows registry.
+    timeout : int, optional
+        Timeout before the process is killed autmotically. Defaults to
+        3600 seconds (1 hour).
+    keep_macrofile : bool, optional
+        Set to True to prevent the temporary macro file from beeing deleted.
+        (Defaults to False)
+    env: dict
+        Environment varaibles which are passed to the started AnyBody console
+        application.
+    priority : int, optional
+        The priority of the subprocesses. Default is BELOW_NORMAL_PRIORITY_CLASS.
+    semaphore : asyncio.Semaphore, optional
+        Semaphore which is held while the console runs. Share one semaphore
+        between calls to limit the number of concurrent consoles.
+        (Defaults to None, which means no limit)
+
+    Returns
+    -------
+    int
+        The return code from the AnyBody Console application.
+
+    """
+    if semaphore is not None:
+        async with semaphore:
+            return await execute_anybodycon_async(
+                macro, logfile, anybodycon_path, timeout, keep_macrofile, env, priority
+            )
+
+    if logfile is None:
+        logfile = sys.stdout
+
+    anybodycmd, macro_filename, subprocess_flags = _prepare_anybodycon_launch(
+        macro, logfile, anybodycon_path, priority
+    )
+    proc = await asyncio.create_subprocess_exec(
+        *anybodycmd,
+        stdout=logfile,
+        stderr=logfile,
+        creationflags=subprocess_flags,
+        env=env
+    )
+    _subprocess_container.add(proc.pid)
+    try:
+        returncode = await asyncio.wait_for(proc.wait(), timeout)
+    except asyncio.TimeoutError:
+        proc.terminate()
+        await proc.wait()
+        _write_timeout_message(logfile, timeout)
+        returncode = 0
+    finally:
+        if proc.returncode is None:
+            # The coroutine was cancelled. Do not leave the console running.
+            try:
+                proc.terminate()
+            except ProcessLookupError:
+                pass
+            await proc.wait()
+        _subprocess_container.remove(proc.pid)
+        if not keep_macrofile:
+            silentremove(macro_filename)
+    return _write_returncode_message(logfile, returncode)
+
+
+def _popleft_all(queue):
+    """Consume a deque from the left."""
+    while queue:
+        yield queue.popleft()
+
+
+def _wait_for_task(task_queue, timeout=None):
+    """Block until a worker reports a finished task.
+
+    Returns None if no task finished within `timeout` seconds.
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        wait = 1
+        if deadline is not None:
+            wait = min(wait, max(deadline - time.monotonic(), 0))
+        try:
+            # The timeout keeps the wait interruptible with ctrl-c on Windows
+            return task_queue.get(timeout=wait)
+        except Empty:
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+
+
+class _LaunchThrottle(object):
+    """Space out the start of consoles by at least `interval` seconds.
+
+    This avoids that many consoles ask the license server for a license at
+    the same time when a batch starts.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._next_launch = 0
+        self._lock = RLock()
+
+    def reserve(self):
+        """Reserve the next launch slot and return the delay until it."""
+        with self._lock:
+            now = time.monotonic()
+            launch = max(now, self._next_launch)
+            self._next_launch = launch + self.interval
+        return launch - now
+
+    def wait(self):
+        time.sleep(self.reserve())
+
+
+class _LicenseBackoff(object):
+    """Retry tasks which failed because no license was available.
+
+    Tasks are retried with exponential backoff. The number of consoles
+    which were running when a license was refused is taken as the license
+    ceiling, and limits the number of consoles started. After as many
+    tasks as the ceiling have got a license, it is raised by one to probe if
+    more licenses have become available.
+    """
+
+    def __init__(self, max_consoles, retries, base_delay=1.0, max_delay=60.0):
+        self.max_consoles = max_consoles
+        self.limit = max_consoles
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._attempts = {}
+        self._pending = []
+        self._counter = 0
+        self._n_granted = 0
+
+    @property
+    def pending(self):
+        return len(self._pending)
+
+    def retry(self, task, n_running):
+        """Schedule `task` for a retry. Returns False if it has no retries left."""
+        attempt = self._attempts.get(id(task), 0)
+        if attempt >= self.retries:
+            self._attempts.pop(id(task), None)
+            return False
+        self._attempts[id(task)] = attempt + 1
+        self.limit = max(1, min(self.limit, n_running))
+        self._n_granted = 0
+        delay = min(self.base_delay * 2 ** attempt, self.max_delay)
+        self._counter += 1
+        heapq.heappush(self._pending, (time.monotonic() + delay, self._counter, task))
+        logger.debug(
+            "No license for task %s. Retry in %.1f sec with at most %d consoles",
+            task.number,
+            delay,
+            self.limit,
+        )
+        return True
+
+    def granted(self, task):
+        """Register that `task` got a license."""
+        self._attempts.pop(id(task), None)
+        self._n_granted += 1
+        if self.limit < self.max_consoles and self._n_granted >= self.limit:
+            self.limit += 1
+            self._n_granted = 0
+
+    def pop_ready(self, force=False):
+        """Return a task which is ready for a retry, or None."""
+        if self._pending and (force or self._pending[0][0] <= time.monotonic()):
+            return heapq.heappop(self._pending)[2]
+        return None
+
+    def time_to_next(self):
+        """Seconds until the next retry, or None if there are no retries."""
+        if not self._pending:
+            return None
+        return max(self._pending[0][0] - time.monotonic(), 0)
+
+
+class _WorkerPool(object):
+    """Pool of persistent worker threads.
+
+    The threads are started once and then fed with jobs through a queue,
+    so no thread is created per task. The pool can be resized between
+    batches, and :meth:`close` stops all the threads.
+    """
+
+    def __init__(self, num_workers):
+        self._jobs = Queue()
+        self.num_workers = 0
+        self.resize(num_workers)
+
+    def resize(self, num_workers):
+        """Start or stop worker threads to match `num_workers`."""
+        with _thread_lock:
+            for _ in range(self.num_workers, num_workers):
+                thread = Thread(target=self._run)
+                thread.daemon = True
+                thread.start()
+            for _ in range(num_workers, self.num_workers):
+                # Idle threads exit when they receive None
+                self._jobs.put(None)
+            self.num_workers = num_workers
+
+    def submit(self, func, *args):
+        """Run ``func(*args)`` on the first idle worker."""
+        self._jobs.put((func, args))
+
+    def close(self):
+        """Stop the worker threads once they have finished their jobs."""
+        self.resize(0)
+
+    def _run(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            func, args = job
+            try:
+                func(*args)
+            except Exception:
+                logger.exception("Unhandled exception in AnyPyTools worker")
+            # Do not keep the last job (and its AnyPyProcess) alive while idle
+            job = func = args = None
+
+
+# The console echoes every macro command it reads, so a comment with a
+# unique token marks where the output of a block of commands ends.
+_MACRO_MARKER = "// AnyPyTools marker "
+
+
+def _split_load_macro(macro):
+    """Split a macro into the commands which load the model and the rest.
+
+    Returns
+    -------
+    tuple or None
+        The load commands and the remaining commands (without ``exit``), or
+        None if the macro does not load a model.
+    """
+    n_load = 0
+    for i, cmd in enumerate(macro):
+        if cmd.strip().lower().startswith("load "):
+            n_load = i + 1
+    if not n_load:
+        return None
+    task_macro = [cmd for cmd in macro[n_load:] if cmd.strip().lower() != "exit"]
+    return tuple(macro[:n_load]), task_macro
+
+
+def _split_fused_log(log, tokens):
+    """Split the output of a fused macro at the marker lines.
+
+    Returns
+    -------
+    tuple
+        A list with the output before each marker, where the text after the
+        last marker is added to the last element, and the number of markers
+        which were found.
+    """
+    parts = [[] for _ in tokens]
+    n_found = 0
+    for line in log.splitlines(True):
+        if n_found < len(tokens) and tokens[n_found] in line:
+            n_found += 1
+            continue
+        parts[min(n_found, len(tokens) - 1)].append(line)
+    return ["".join(part) for part in parts], n_found
+
+
+class _AnyBodyConSession(object):
+    """AnyBody console which reads macro commands from stdin.
+
+    The model is loaded once when the session starts. The output from the
+    load is kept and replayed in the log of every task run in the session.
+    """
+
+    def __init__(self, key, env=None, priority=BELOW_NORMAL_PRIORITY_CLASS):
+        self.key = key
+        anybodycon_path, folder, load_macro = key
+        self.proc = Popen(
+            _anybodycon_command(anybodycon_path) + ["/ni"],
+            stdin=PIPE,
+            stdout=PIPE,
+            stderr=STDOUT,
+            cwd=folder,
+            creationflags=_subprocess_flags(priority),
+            env=env,
+        )
+        _subprocess_container.add(self.proc.pid)
+        self._stdin = io.TextIOWrapper(self.proc.stdin, encoding="UTF-8")
+        self._stdout = io.TextIOWrapper(self.proc.stdout, errors="replace")
+        self.load_log = []
+        self.load_macro = load_macro
+        self.timed_out = False
+
+    def is_alive(self):
+        return self.proc.poll() is None
+
+    def load(self, timeout):
+        """Load the model and store the output."""
+        self._run(self.load_macro, self.load_log.append, timeout)
+
+    def run_task(self, macro, tee, timeout, usage=None):
+        """Run the macro commands of a task and write the output to `tee`.
+
+        If `usage` is given it is updated with the resources the console used
+        while running the commands. The model load is not included.
+
+        Returns
+        -------
+        int
+            0 if the commands completed, otherwise the return code of the
+            console which exited.
+        """
+        for line in self.load_log:
+            tee.write(line)
+        if not self.is_alive():
+            return _write_returncode_message(tee, self.proc.returncode)
+        before = _process_usage(self.proc) if usage is not None else None
+        try:
+            if self._run(macro, tee.write, timeout, tee):
+                return 0
+        finally:
+            if usage is not None:
+                usage.update(_usage_difference(before, _process_usage(self.proc)))
+        if self.timed_out:
+            _write_timeout_message(tee, timeout)
+            return 0
+        if tee.stop_requested:
+            tee.write("\nAnybodycon.exe was stopped by AnyPyTools after an error")
+            return 0
+        return _write_returncode_message(tee, self.proc.returncode)
+
+    def _run(self, macro, write, timeout, tee=None):
+        """Send the commands and pass on output until the marker is echoed.
+
+        Returns True if the marker was found, and False if the console exited.
+        """
+        token = uuid.uuid4().hex
+        self.timed_out = False
+        try:
+            self._stdin.write("\n".join(list(macro) + [_MACRO_MARKER + token]))
+            self._stdin.write("\n")
+            self._stdin.flush()
+        except OSError:
+            # The console has exited. Collect the remaining output below.
+            pass
+        # Reading the pipe blocks, so the timeout is handled by a timer
+        timer = Timer(timeout, self._timeout)
+        timer.daemon = True
+        timer.start()
+        try:
+            for line in self._stdout:
+                if token in line:
+                    return True
+                write(line)
+                if tee is not None and tee.stop_requested:
+                    self.kill()
+        finally:
+            timer.cancel()
+        self.close()
+        return False
+
+    def _timeout(self):
+        self.timed_out = True
+        self.kill()
+
+    def kill(self):
+        try:
+            self.proc.terminate()
+        except OSError:
+            pass
+
+    def close(self, timeout=5):
+        """Exit the console."""
+        if self._stdout.closed:
+            return
+        try:
+            self._stdin.write("exit\n")
+            self._stdin.close()
+        except OSError:
+            pass
+        if not _wait_for_process(self.proc, timeout):
+            self.kill()
+            self.proc.wait()
+        self._stdout.close()
+        _subprocess_container.remove(self.proc.pid)
+
+
+class _SessionPool(object):
+    """Pool of AnyBody consoles which are kept alive with a model loaded.
+
+    Sessions are identified by the console, the working folder and the load
+    commands. An idle session is reused for the next task with the same key.
+    When the pool is full the least recently used idle session is closed to
+    make room for a new one.
+    """
+
+    def __init__(
+        self,
+        max_sessions,
+        env=None,
+        priority=BELOW_NORMAL_PRIORITY_CLASS,
+        launch_throttle=None,
+    ):
+        self.max_sessions = max_sessions
+        self.launch_throttle = launch_throttle
+        self.env = env
+        self.priority = priority
+        self.n_sessions = 0
+        self.n_loads = 0
+        self._idle = collections.deque()
+
+    def acquire(self, key, timeout):
+        """Return an idle session for `key` or start a new one."""
+        to_close = []
+        session = None
+        with _thread_lock:
+            for idle in list(self._idle):
+                if not idle.is_alive():
+                    # Killed while idle, e.g. when a batch was stopped
+                    self._idle.remove(idle)
+                    to_close.append(idle)
+                elif session is None and idle.key == key:
+                    self._idle.remove(idle)
+                    session = idle
+            self.n_sessions -= len(to_close)
+            if session is None:
+                if self.n_sessions >= self.max_sessions and self._idle:
+                    to_close.append(self._idle.popleft())
+                    self.n_sessions -= 1
+                self.n_sessions += 1
+                self.n_loads += 1
+        for old in to_close:
+            old.close()
+        if session is None:
+            if self.launch_throttle is not None:
+                self.launch_throttle.wait()
             try:
-                logfile.seek(0, os.SEEK_END)
-            except io.UnsupportedOperation:
-                pass
-            logfile.write(
-                "\nERROR: AnyPyTools : Timeout after {:d} sec.".format(int(timeout))
-            )
-            proc.returncode = 0
-            break
-        time.sleep(0.05)
-    _subprocess_container.remove(proc.pid)
-    retcode = ctypes.c_int32(proc.returncode).value
-    if retcode == _KILLED_BY_ANYPYTOOLS:
-        logfile.write("\nAnybodycon.exe was interrupted by AnyPyTools")
-    elif retcode == _NO_LICENSES_AVAILABLE:
-        logfile.write(
-            "\nERROR: anybodycon.exe existed unexpectedly. "
-            "Return code: " + str(_NO_LICENSES_AVAILABLE) + " : No license available."
-        )
-    elif retcode:
-        logfile.write(
-            "\nERROR: AnyPyTools : anybodycon.exe exited unexpectedly."
-            " Return code: " + str(retcode)
-        )
-    if not keep_macrofile:
-        silentremove(macro_file.name)
-    return retcode
+                session = _AnyBodyConSession(key, self.env, self.priority)
+            except Exception:
+                with _thread_lock:
+                    self.n_sessions -= 1
+                raise
+            session.load(timeout)
+        return session
+
+    def release(self, session, reuse=True):
+        """Return a session to the pool, or close it if `reuse` is False."""
+        with _thread_lock:
+            if reuse and session.is_alive():
+                self._idle.append(session)
+                return
+            self.n_sessions -= 1
+        session.close()
+
+    def close(self):
+        """Close all idle sessions."""
+        with _thread_lock:
+            sessions = list(self._idle)
+            self._idle.clear()
+            self.n_sessions -= len(sessions)
+        for session in sessions:
+            session.close()
+
+
+_LOAD_PATH_PATTERN = re.compile(r'^\s*load\s+"([^"]*)"', flags=re.IGNORECASE)
+
+
+def _stable_hash(obj):
+    """Hash which, unlike ``hash()``, is the same in every Python session."""
+    return hashlib.sha1(json.dumps(obj).encode("UTF-8")).hexdigest()
+
+
+class _DurationHistory(object):
+    """Persistent record of how long tasks take to run.
+
+    Durations are stored for the exact macro and folder, for the load
+    commands (model and defines) and for the model file. Tasks which have
+    not run before then get an estimate from similar tasks. Each entry is a
+    running mean over the most recent runs.
+    """
+
+    max_count = 20
+
+    def __init__(self, filename):
+        self.filename = filename
+        with shelve.open(filename) as db:
+            self._data = dict(db)
+        self._changed = set()
+
+    @staticmethod
+    def _keys(task):
+        """Keys from the most to the least specific."""
+        macro = [str(cmd) for cmd in task.macro]
+        if macro and macro[-1] == "exit":
+            # Added to the macro when the console is launched
+            macro.pop()
+        keys = [_stable_hash(["task", task.folder, macro])]
+        load_macro = _split_load_macro(macro)
+        if load_macro is not None:
+            keys.append(_stable_hash(["load", task.folder, load_macro[0]]))
+            match = _LOAD_PATH_PATTERN.match(load_macro[0][-1])
+            if match:
+                model = os.path.normpath(os.path.join(task.folder, match.group(1)))
+                keys.append(_stable_hash(["model", model]))
+        return keys
+
+    def estimate(self, task):
+        """Return the expected duration of the task, or None if unknown."""
+        for key in self._keys(task):
+            if key in self._data:
+                return self._data[key][0]
+        return None
+
+    def record(self, task):
+        """Add the duration of a task which finished without errors."""
+        if task.has_error() or task.processtime <= 0:
+            return
+        for key in self._keys(task):
+            mean, count = self._data.get(key, (0.0, 0))
+            count = min(count + 1, self.max_count)
+            self._data[key] = (mean + (task.processtime - mean) / count, count)
+            self._changed.add(key)
+
+    def save(self):
+        """Write the new durations to the file."""
+        if not self._changed:
+            return
+        with shelve.open(self.filename) as db:
+            for key in self._changed:
+                db[key] = self._data[key]
+        self._changed.clear()
 
 
 class _Task(object):
@@ -276,7 +1303,9 @@ class _Task(object):
         self.number = number
         self.logfile = ""
         self.processtime = 0
+        self.usage = {}
         self.retcode = None
+        self.cache_key = None
         self.name = taskname
         if not taskname:
             head, folder = os.path.split(folder)
@@ -286,6 +1315,10 @@ class _Task(object):
     def has_error(self):
         return "ERROR" in self.output
 
+    def is_finished(self):
+        """Return True if the task has already been processed without errors."""
+        return bool(self.output) and not self.has_error() and self.processtime > 0
+
     def add_error(self, error_msg):
         try:
             self.output["ERROR"].append(error_msg)
@@ -300,6 +1333,9 @@ class _Task(object):
             out["task_work_dir"] = self.folder
             out["task_name"] = self.name
             out["task_processtime"] = self.processtime
+            for key in _USAGE_KEYS:
+                if key in self.usage:
+                    out["task_" + key] = self.usage[key]
             out["task_macro"] = self.macro
             out["task_logfile"] = self.logfile
         return out
@@ -318,6 +1354,11 @@ class _Task(object):
             number=task_output["task_id"],
         )
         task.processtime = task_output["task_processtime"]
+        task.usage = {
+            key: task_output["task_" + key]
+            for key in _USAGE_KEYS
+            if "task_" + key in task_output
+        }
         task.output = task_output
         return task
 
@@ -444,6 +1485,10 @@ class AnyPyProcess(object):
         by ``warnings_to_include`` argument.
     return_task_info : bool, optional
         Return the task status information when running macros. Defaults to False.
+        The information includes the wall time (``task_processtime``) and,
+        where the platform supports it, the resources used by the console:
+        ``task_user_time``, ``task_system_time``, ``task_peak_memory``,
+        ``task_read_bytes`` and ``task_write_bytes``.
     keep_logfiles : bool, optional
         If True logfile will never be removed. Even if a simulations successeds
         without error. (Defautls to False)
@@ -461,6 +1506,85 @@ class AnyPyProcess(object):
         ``anypytools.IDLE_PRIORITY_CLASS``, ``anypytools.BELOW_NORMAL_PRIORITY_CLASS``,
         ``anypytools.NORMAL_PRIORITY_CLASS``, ``anypytools.HIGH_PRIORITY_CLASS``
         Default is BELOW_NORMAL_PRIORITY_CLASS.
+    stream_output : bool, optional
+        Read the console output through a pipe and parse it line by line while
+        the model runs, instead of reading the whole log file afterwards. This
+        keeps memory use low for models which dump large amounts of data.
+        Only used by ``start_macro`` and ``imap_macro``. (Defaults to False)
+    write_logfiles : bool, optional
+        Set to False to not write log files when ``stream_output`` is used.
+        The output is then only parsed in memory. (Defaults to True)
+    max_errors : int, optional
+        Stop the batch when this number of tasks have failed. Queued tasks are
+        not started and running consoles are terminated. These tasks are
+        returned with an error saying they were not run or aborted, and are
+        rerun if the batch is restarted. (Defaults to None, no limit)
+    fail_fast : bool, optional
+        Stop the batch at the first failed task (same as ``max_errors=1``
+        unless ``max_errors`` is given). With ``stream_output`` a console is
+        also terminated as soon as an error appears in its output.
+        (Defaults to False)
+    executor : anypytools.executors.Executor, optional
+        Executor which launches the consoles, e.g. a
+        :class:`~anypytools.executors.RemoteExecutor` to run the models on
+        another computer. It is not used by ``use_sessions`` and
+        ``start_macro_async``, which always start local consoles.
+        (Defaults to None, which starts the console in ``anybodycon_path``
+        on this computer)
+    license_retries : int, optional
+        Number of times a task is retried when the console exits because no
+        license is available. The retries are delayed with exponential
+        backoff, and the number of consoles started in parallel is limited
+        to the number of licenses which appear to be available. Set it to
+        e.g. 10 when the batch shares a limited pool of network licenses.
+        Not supported by ``start_macro_async``. (Defaults to 0, which
+        reports the missing license as an error)
+    launch_interval : float, optional
+        Minimum time in seconds between the start of two consoles. A small
+        value like 0.1 spreads out the license requests when a large batch
+        starts. (Defaults to 0, which starts the consoles right away)
+    fuse_tasks : int, optional
+        Run up to this number of consecutive tasks, which have the same load
+        commands and folder, as one macro in a single console. The model is
+        then only loaded once for the group, and the log is split into
+        the output of each task afterwards. The model is not reloaded between
+        the tasks, so all tasks should set the same values. The timeout
+        applies to each task in the group. Not used together with
+        ``stream_output`` or ``use_sessions``. (Defaults to None, no fusion)
+    use_sessions : bool, optional
+        Keep the AnyBody consoles running with the model loaded and reuse
+        them for later tasks with the same load commands in the same folder.
+        Only the macro commands after the ``load`` command are then run for
+        each task, which saves the load time. The model is not reloaded
+        between tasks, so all tasks should set the same values. A console is
+        restarted after a task fails. Use :meth:`close_sessions` to shut down
+        the consoles. (Defaults to False)
+    tracers : list of callable, optional
+        Functions which are called with a :class:`~anypytools.tracing.TraceEvent`
+        at each phase of the tasks, e.g. a
+        :class:`~anypytools.tracing.ChromeTraceWriter`. The tracers are
+        called from the worker threads. (Defaults to None)
+    duration_history : str, optional
+        File where the duration of each task is recorded. With a history
+        ``start_macro`` runs the tasks which are expected to take the longest
+        first, which shortens batches with a mix of short and long models.
+        Tasks which have not run before are estimated from tasks with the
+        same model and defines. The estimates are also used for the time
+        left shown in the progress bar. (Defaults to None)
+    result_cache : str or ResultCache, optional
+        Folder or :class:`~anypytools.cache.ResultCache` where the results of
+        tasks without errors are stored. A task whose macro, folder, console
+        and model files are unchanged then gets the stored result without
+        running the console. (Defaults to None)
+    journal : str or TaskJournal, optional
+        File or :class:`~anypytools.journal.TaskJournal` where each task is
+        appended as soon as it finishes. If a batch is interrupted, starting
+        it again with the same journal restores the finished tasks and only
+        runs the missing ones. (Defaults to None)
+    lazy_parsing : bool, optional
+        Only decode the dumped values of the console output when they are
+        accessed in the results. Saves time and memory when a macro dumps
+        many variables, and only a few are used. (Defaults to False)
 
 
     Returns
@@ -496,6 +1620,20 @@ class AnyPyProcess(object):
         logfile_prefix=None,
         python_env=None,
         priority=BELOW_NORMAL_PRIORITY_CLASS,
+        stream_output=False,
+        write_logfiles=True,
+        max_errors=None,
+        fail_fast=False,
+        executor=None,
+        license_retries=0,
+        launch_interval=0,
+        fuse_tasks=None,
+        use_sessions=False,
+        tracers=None,
+        duration_history=None,
+        result_cache=None,
+        journal=None,
+        lazy_parsing=False,
     ):
         if not isinstance(ignore_errors, (list, type(None))):
             raise ValueError("ignore_errors must be a list of strings")
@@ -503,12 +1641,7 @@ class AnyPyProcess(object):
         if not isinstance(warnings_to_include, (list, type(None))):
             raise ValueError("warnings_to_include must be a list of strings")
 
-        if anybodycon_path is None:
-            self.anybodycon_path = get_anybodycon_path()
-        elif os.path.exists(anybodycon_path):
-            self.anybodycon_path = anybodycon_path
-        else:
-            raise IOError("Can't find " + anybodycon_path)
+        self.anybodycon_path = self._find_anybodycon(anybodycon_path)
         self.num_processes = num_processes
         self.priority = priority
         self.silent = silent
@@ -519,12 +1652,36 @@ class AnyPyProcess(object):
         self.ignore_errors = ignore_errors
         self.warnings_to_include = warnings_to_include
         self.keep_logfiles = keep_logfiles
+        self.stream_output = stream_output
+        self.write_logfiles = write_logfiles
+        self.fail_fast = fail_fast
+        if fail_fast and max_errors is None:
+            max_errors = 1
+        self.max_errors = max_errors
+        self.executor = executor
+        self.license_retries = license_retries
+        self._launch_throttle = _LaunchThrottle(launch_interval)
+        self.fuse_tasks = fuse_tasks
+        self.use_sessions = use_sessions
+        self.tracers = list(tracers or [])
+        self.duration_history = None
+        if duration_history is not None:
+            self.duration_history = _DurationHistory(duration_history)
+        if isinstance(result_cache, str):
+            result_cache = ResultCache(result_cache)
+        self.result_cache = result_cache
+        if isinstance(journal, str):
+            journal = TaskJournal(journal)
+        self.journal = journal
+        self.lazy_parsing = lazy_parsing
         if logfile_prefix is not None:
             self.logfile_prefix = logfile_prefix + "_"
         else:
             self.logfile_prefix = logfile_prefix
         self.cached_arg_hash = None
         self.cached_tasklist = None
+        self._worker_pool = None
+        self._session_pool = None
         if python_env is not None:
             if not os.path.isdir(python_env):
                 raise IOError("Python environment does not exist:" + python_env)
@@ -536,12 +1693,26 @@ class AnyPyProcess(object):
             self.env = None
         logging.debug("\nAnyPyProcess initialized")
 
+    def _find_anybodycon(self, anybodycon_path):
+        """Return the path to the console, which is looked up if not given."""
+        if anybodycon_path is None:
+            return get_anybodycon_path()
+        if not os.path.exists(anybodycon_path):
+            raise IOError("Can't find " + anybodycon_path)
+        return anybodycon_path
+
     def save_results(self, filename, append=False):
         """Save resently processed results.
 
         Save results for later reloading or to continue processing unfished
         results at a later time.
 
+        The tasks are stored in an SQLite database (see
+        :class:`~anypytools.storage.ResultStore`), where appending only
+        writes the new tasks, and where tasks can be loaded selectively.
+        Files saved with the shelve format of earlier versions are still
+        written in that format.
+
         Parameters
         ----------
         filename : str
@@ -561,18 +1732,20 @@ class AnyPyProcess(object):
         >>> app.save_results('saved_data.db')
 
         """
-        if self.cached_tasklist:
-            savekey = "processed_tasks"
-            db = shelve.open(filename, writeback=True)
-            if not append or savekey not in db:
-                db[savekey] = self.cached_tasklist
-            else:
-                db[savekey].extend(self.cached_tasklist)
-            db.close()
-        else:
+        if not self.cached_tasklist:
             raise ValueError("Noting to save")
+        if not _is_shelve(filename):
+            ResultStore(filename).save(self.cached_tasklist, append)
+            return
+        savekey = "processed_tasks"
+        db = shelve.open(filename, writeback=True)
+        if not append or savekey not in db:
+            db[savekey] = self.cached_tasklist
+        else:
+            db[savekey].extend(self.cached_tasklist)
+        db.close()
 
-    def save_to_hdf5(self, filename, batch_name=None):
+    def save_to_hdf5(self, filename, batch_name=None, layout="groups"):
         """Save cached results to hdf5 file.
 
         Parameters
@@ -584,7 +1757,14 @@ class AnyPyProcess(object):
             Name of the group in the HDF5 file to
             save the data within. If not specified
             the group hash value of the macro will
-            be used.
+            be used, or "results" with the columnar
+            layout.
+
+        layout : str
+            "groups" (default) writes a new file with a group for each task.
+            "columnar" stacks each output variable of all tasks in one
+            compressed dataset, and appends to the results already in the
+            file. See :mod:`anypytools.h5columnar`.
 
         Returns
         -------
@@ -596,6 +1776,16 @@ class AnyPyProcess(object):
         if not self.cached_tasklist:
             raise ValueError("No data available for saving")
 
+        if layout == "columnar":
+            save_columnar(
+                filename,
+                [task.get_output() for task in self.cached_tasklist],
+                group=batch_name or "results",
+            )
+            return
+        if layout != "groups":
+            raise ValueError("Unknown layout: " + str(layout))
+
         if batch_name is None:
             batch_name = str(self.cached_arg_hash)
 
@@ -619,7 +1809,7 @@ class AnyPyProcess(object):
                     elif isinstance(v, np.ndarray):
                         h5_task_group.create_dataset(k, data=v)
 
-    def load_results(self, filename):
+    def load_results(self, filename, task_ids=None, names=None, where=None):
         """Load previously saved results.
 
         Besides reloading results the function can be used to continue
@@ -628,7 +1818,16 @@ class AnyPyProcess(object):
         Parameters
         ----------
         filename : str
-            filename of the file where processing was stored.
+            filename of the file where processing was stored. This may also
+            be a journal file written with the `journal` option, in which case
+            the tasks in the journal are loaded.
+        task_ids : list of int, optional
+            Only load the tasks with these task ids.
+        names : list of str, optional
+            Only load the tasks with these names.
+        where : callable, optional
+            Only load the tasks where ``where(output)`` is true. The output
+            includes the task information.
 
         Returns
         -------
@@ -648,19 +1847,50 @@ class AnyPyProcess(object):
         >>> app.load_results('unfinished_results.db')
         >>> results = app.start_macro() # rerun unfinished
 
+        Load only the failed tasks:
+
+        >>> failed = app.load_results('saved_results.db',
+        ...                           where=lambda out: 'ERROR' in out)
+
         """
-        loadkey = "processed_tasks"
-        db = shelve.open(filename)
-        loaded_data = db[loadkey]
-        db.close()
+        if ResultStore.is_store(filename):
+            loaded_data = ResultStore(filename).load(task_ids, names, where)
+        else:
+            if TaskJournal.is_journal(filename):
+                loaded_data = self._read_journal(filename)
+            else:
+                loadkey = "processed_tasks"
+                db = shelve.open(filename)
+                loaded_data = db[loadkey]
+                db.close()
+            loaded_data = _select_tasks(loaded_data, task_ids, names, where)
         # Hack to help Enrico convert data to the new structured
-        if not isinstance(loaded_data[0].output, AnyPyProcessOutput):
+        if loaded_data and not isinstance(loaded_data[0].output, AnyPyProcessOutput):
             for task in loaded_data:
                 task.output = AnyPyProcessOutput(task.output)
         self.cached_tasklist = loaded_data
         results = [task.get_output(True) for task in loaded_data]
         return AnyPyProcessOutputList(results)
 
+    def _read_journal(self, filename):
+        """Return the last record of each task in a journal file as tasks."""
+        tasks = collections.OrderedDict()
+        for record in TaskJournal(filename).read():
+            task = _Task(
+                folder=record["folder"],
+                macro=record["macro"],
+                taskname=record["name"],
+                number=record["number"],
+            )
+            task.output = record["output"]
+            task.processtime = record["processtime"]
+            task.usage = record["usage"]
+            task.retcode = record["retcode"]
+            tasks[record["key"]] = task
+        if not tasks:
+            raise ValueError("No tasks in the journal " + filename)
+        return sorted(tasks.values(), key=lambda task: task.number)
+
     def start_macro(
         self, macrolist=None, folderlist=None, search_subdirs=None, **kwargs
     ):
@@ -701,6 +1931,177 @@ class AnyPyProcess(object):
         >>> app.start_macro(macro, folderlist, search_subdirs = "*.main.any")
 
         """
+        tasklist = self._create_tasklist(macrolist, folderlist, search_subdirs)
+        self._init_batch(tasklist)
+        # Start the scheduler
+        process_time = self._schedule_processes(tasklist, self._worker)
+        return self._finish_batch(tasklist, process_time)
+
+    async def start_macro_async(
+        self, macrolist=None, folderlist=None, search_subdirs=None, semaphore=None
+    ):
+        """Start a batch processing job from asyncio.
+
+        Coroutine version of :meth:`start_macro`. The AnyBody consoles are
+        launched with ``asyncio.create_subprocess_exec`` and awaited on the
+        running event loop, so no threads are used.
+
+        ``max_errors`` and ``fail_fast`` stop the batch like in
+        :meth:`start_macro`, but the output is not streamed, so a console is
+        not stopped at its first error. ``license_retries`` is not supported,
+        and raises a ValueError. If the coroutine is cancelled the running
+        consoles are terminated.
+
+        Parameters
+        ----------
+        macrolist : list of macrocommands, optional
+            List of anyscript macro commands. This may also be obmitted in
+            which case the previous macros will be re-run.
+        folderlist : list of str, optional
+            List of folders in which to excute the macro commands. If `None` the
+            current working directory is used.
+        search_subdirs : str, optional
+            Regular expression used to extend the folderlist with all the
+            subdirectories that match the regular expression.
+            Defaults to None: No subdirectories are included.
+        semaphore : asyncio.Semaphore, optional
+            Semaphore limiting the number of concurrent consoles. Pass the same
+            semaphore to several calls to share the limit between them.
+            Defaults to a new semaphore with ``num_processes`` slots.
+
+        Returns
+        -------
+        AnyPyProcessOutputList
+            A list with the output from each macro executed.
+
+        Examples
+        --------
+        >>> app = AnyPyProcess(num_processes=4)
+        >>> results = await app.start_macro_async(macro)
+
+        """
+        if self.license_retries:
+            raise ValueError("license_retries is not supported by start_macro_async")
+        tasklist = self._create_tasklist(macrolist, folderlist, search_subdirs)
+        self._init_batch(tasklist)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.num_processes)
+        starttime = time.perf_counter()
+        pbar = _ProgressBar(len(tasklist), self.silent)
+        pbar.animate(0)
+        n_errors = 0
+        n_failed = 0
+        abort = asyncio.Event()
+        jobs = [
+            asyncio.ensure_future(self._async_worker(task, semaphore, abort))
+            for task in tasklist
+        ]
+        try:
+            for n_done, job in enumerate(asyncio.as_completed(jobs), 1):
+                task = await job
+                if abort.is_set() and task.retcode is None and not task.has_error():
+                    # Cancelled when the batch was stopped
+                    msg = _ABORTED_MSG if task.processtime else _NOT_RUN_MSG
+                    task.add_error(msg.format(n_errors))
+                elif task.has_error() and not abort.is_set():
+                    n_errors += 1
+                    if self.max_errors and n_errors >= self.max_errors:
+                        # Cancel the queued tasks and terminate the consoles
+                        abort.set()
+                        for other_job in jobs:
+                            other_job.cancel()
+                if task.has_error():
+                    n_failed += 1
+                    self._trace("failed", task)
+                self._trace("finished", task)
+                self._record_finished(task)
+                self.summery.task_summery(task)
+                pbar.animate(n_done, n_failed)
+        finally:
+            # Stop the consoles if the batch itself is cancelled
+            for job in jobs:
+                job.cancel()
+            await asyncio.gather(*jobs, return_exceptions=True)
+        self._save_batch_state()
+        process_time = time.perf_counter() - starttime
+        return self._finish_batch(tasklist, process_time)
+
+    def imap_macro(
+        self, macrolist=None, folderlist=None, search_subdirs=None, ordered=True
+    ):
+        """Start a batch processing job and yield the results as they finish.
+
+        This is the streaming version of :meth:`start_macro`. The output of
+        each macro is yielded as soon as it is available, so results can be
+        post processed or saved while the remaining simulations are running.
+        The finished results are not cached on the AnyPyProcess object, so
+        memory use does not grow with the size of the batch. Results cached by
+        an earlier call to :meth:`start_macro` are dropped.
+
+        Parameters
+        ----------
+        macrolist : list of macrocommands, optional
+            List of anyscript macro commands. This may also be obmitted in
+            which case the previous macros will be re-run.
+        folderlist : list of str, optional
+            List of folders in which to excute the macro commands. If `None` the
+            current working directory is used.
+        search_subdirs : str, optional
+            Regular expression used to extend the folderlist with all the
+            subdirectories that match the regular expression.
+            Defaults to None: No subdirectories are included.
+        ordered : bool, optional
+            If True (default) the results are yielded in the same order as the
+            macros. If False they are yielded in the order the simulations
+            complete.
+
+        Yields
+        ------
+        AnyPyProcessOutput
+            The output from each macro executed.
+
+        Examples
+        --------
+        >>> for result in app.imap_macro(macrolist, ordered=False):
+        ...     store(result)
+
+        """
+        tasklist = self._create_tasklist(macrolist, folderlist, search_subdirs)
+        self._init_batch(tasklist)
+        # The cache must not keep a hash of these macros with older results
+        self.cached_arg_hash = None
+        self.cached_tasklist = None
+        _subprocess_container.stop_all = False
+        starttime = time.perf_counter()
+        pbar = _ProgressBar(len(tasklist), self.silent)
+        pbar.animate(0)
+        # Only keep a reference to the tasks until they are processed
+        pending = collections.deque(tasklist)
+        del tasklist
+        finished_tasks = self._iter_processes(
+            _popleft_all(pending), self._worker, self.num_processes > 1, ordered
+        )
+        failed_tasks = []
+        try:
+            for n_processed, task in enumerate(finished_tasks, 1):
+                self.cleanup_logfiles([task])
+                if task.has_error():
+                    failed_tasks.append(task)
+                self.summery.task_summery(task)
+                pbar.animate(n_processed, len(failed_tasks))
+                yield task.get_output(include_task_info=self.return_task_info)
+        except KeyboardInterrupt:
+            _display("Processing interrupted")
+            _subprocess_container.stop_all = True
+            raise
+        finally:
+            self._save_batch_state()
+        process_time = time.perf_counter() - starttime
+        self.summery.final_summery(process_time, failed_tasks)
+        self._trace("batch_finished")
+
+    def _create_tasklist(self, macrolist, folderlist, search_subdirs):
+        """Create the list of tasks from the arguments to `start_macro`."""
         # Handle different input types
         if isinstance(macrolist, types.GeneratorType):
             macrolist = list(macrolist)
@@ -744,7 +2145,7 @@ class AnyPyProcess(object):
                     "the AnyPyProcess object has cached output "
                     "to process"
                 )
-        elif isinstance(macrolist[0], collections.Mapping):
+        elif isinstance(macrolist[0], collections.abc.Mapping):
             tasklist = list(_Task.from_output_list(macrolist))
         elif isinstance(macrolist[0], list):
             arg_hash = make_hash([macrolist, folderlist, search_subdirs])
@@ -755,15 +2156,29 @@ class AnyPyProcess(object):
                 tasklist = list(_Task.from_macrofolderlist(macrolist, folderlist))
         else:
             raise ValueError("Nothing to process for " + str(macrolist))
-
+        return tasklist
+
+    def _init_batch(self, tasklist):
+        self._trace("batch_started")
+        if self.result_cache is not None:
+            self.result_cache.new_batch()
+        if self.journal is not None:
+            n_restored = self.journal.resume(tasklist)
+            if n_restored:
+                logger.debug("Restored {} tasks from the journal".format(n_restored))
+        if self.tracers:
+            # All tasks wait for a worker from the start of the batch
+            for task in tasklist:
+                self._trace("queued", task)
         self.summery = _Summery(have_ipython=run_from_ipython(), silent=self.silent)
 
         if self.logfile_prefix is None:
             self.logfile_prefix = str(self.cached_arg_hash)[:4] + "_"
 
-        # Start the scheduler
-        process_time = self._schedule_processes(tasklist, self._worker)
+    def _finish_batch(self, tasklist, process_time):
+        self._trace("cleanup_logfiles_started")
         self.cleanup_logfiles(tasklist)
+        self._trace("cleanup_logfiles_finished")
         # Cache the processed tasklist for restarting later
         self.cached_tasklist = tasklist
         self.summery.final_summery(process_time, tasklist)
@@ -771,126 +2186,467 @@ class AnyPyProcess(object):
             task.get_output(include_task_info=self.return_task_info)
             for task in tasklist
         ]
+        self._trace("batch_finished")
         return AnyPyProcessOutputList(task_output)
 
-    def _worker(self, task, task_queue):
-        """Handle processing of the tasks."""
+    def _start_task(self, task):
+        """Number the task and check if it must be (re)processed."""
         with _thread_lock:
             task.process_number = self.counter
             self.counter += 1
-        if task.output:
-            if not task.has_error() and task.processtime > 0:
-                if not os.path.isfile(task.logfile):
-                    task.logfile = ""
-                task_queue.put(task)
-                return
+        if task.is_finished():
+            if not os.path.isfile(task.logfile):
+                task.logfile = ""
+            return False
+        if self.result_cache is not None and self._load_cached_result(task):
+            return False
+        self._trace("started", task)
+        return True
+
+    def _load_cached_result(self, task):
+        """Look up the task in the result cache. Returns True on a hit."""
+        try:
+            key = self.result_cache.key(
+                task.macro,
+                task.folder,
+                self.anybodycon_path,
+                self._cache_parse_options(),
+            )
+        except Exception as e:
+            logger.debug("Could not compute the cache key: " + str(e))
+            return False
+        entry = self.result_cache.get(key)
+        if entry is None:
+            task.cache_key = key
+            return False
+        task.cache_key = None
+        task.output = entry["output"]
+        task.processtime = entry["processtime"]
+        task.retcode = 0
+        task.logfile = ""
+        return True
+
+    def _cache_parse_options(self):
+        """The options which change the parsed output, for the cache key."""
+        return dict(
+            ignore_errors=sorted(self.ignore_errors or []),
+            warnings_to_include=sorted(self.warnings_to_include or []),
+            fatal_warnings=bool(self.fatal_warnings),
+        )
+
+    def _record_finished(self, task):
+        """Add a finished task to the history, result cache and journal."""
+        if self.duration_history is not None:
+            self.duration_history.record(task)
+        if self.journal is not None:
+            try:
+                self.journal.append(task)
+            except (OSError, ValueError) as e:
+                # A broken journal must not stop the running batch
+                logger.warning("Could not write %s to the journal: %s", task.name, e)
+        if (
+            self.result_cache is not None
+            and task.cache_key is not None
+            and not task.has_error()
+            and task.processtime > 0
+        ):
+            try:
+                self.result_cache.put(task.cache_key, task.output, task.processtime)
+            except OSError as e:
+                logger.debug("Could not store the result: " + str(e))
+            task.cache_key = None
+
+    def _save_batch_state(self):
+        """Save the duration history, trim the result cache and close the journal."""
+        if self.duration_history is not None:
+            self.duration_history.save()
+        if self.result_cache is not None:
+            self.result_cache.trim()
+        if self.journal is not None:
+            self.journal.close()
+
+    def invalidate_cache(self, macrolist, folderlist=None):
+        """Remove the stored results of macros from the result cache.
+
+        Parameters
+        ----------
+        macrolist : list of macrocommands
+            A macro or a list of macros.
+        folderlist : list of str, optional
+            Folders the macros are run in. Defaults to the current working
+            directory.
+
+        Returns
+        -------
+        int
+            The number of results which were removed.
+        """
+        if self.result_cache is None:
+            return 0
+        if macrolist and not isinstance(macrolist[0], list):
+            macrolist = [macrolist]
+        n_removed = 0
+        for folder in folderlist or [os.getcwd()]:
+            for macro in macrolist:
+                if self.result_cache.invalidate(
+                    macro, folder, self.anybodycon_path, self._cache_parse_options()
+                ):
+                    n_removed += 1
+        return n_removed
+
+    def _trace(self, name, task=None):
+        """Send an event to the tracers."""
+        if not self.tracers:
+            return
+        if task is None:
+            event = TraceEvent(name, time.perf_counter(), None, None, get_ident())
+        else:
+            event = TraceEvent(
+                name, time.perf_counter(), task.number, task.name, get_ident()
+            )
+        for tracer in self.tracers:
+            tracer(event)
+
+    def _task_tracer(self, tasks):
+        """Return a function which traces the console phases of `tasks`."""
+        if not self.tracers:
+            return None
+
+        def trace(name):
+            for task in tasks:
+                self._trace(name, task)
+
+        return trace
+
+    def _create_logfile(self, task):
+        """Open the task logfile and write the macro header to it."""
+        tmp_kwargs = dict(
+            mode="a+",
+            prefix=self.logfile_prefix,
+            suffix=".log",
+            dir=task.folder,
+            delete=False,
+        )
+        logfile = NamedTemporaryFile(**tmp_kwargs)
+        logfile.write("########### MACRO #############\n")
+        logfile.write("\n".join(task.macro))
+        logfile.write("\n\n######### OUTPUT LOG ##########")
+        logfile.flush()
+        task.logfile = logfile.name
+        return logfile
+
+    def _execute_args(self, task, logfile):
+        return dict(
+            macro=task.macro,
+            logfile=logfile,
+            anybodycon_path=self.anybodycon_path,
+            timeout=self.timeout,
+            keep_macrofile=self.keep_logfiles,
+            env=self.env,
+            priority=self.priority,
+        )
+
+    def _parse_logfile(self, task, logfile):
+        logfile.seek(0)
+        task.output = parse_anybodycon_output(
+            logfile.read(),
+            self.ignore_errors,
+            self.warnings_to_include,
+            fatal_warnings=self.fatal_warnings,
+            lazy=self.lazy_parsing,
+        )
+        self._trace("parsed", task)
+
+    def _add_exception_to_task(self, task, e):
+        exc_type, exc_obj, exc_tb = sys.exc_info()
+        fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
+        task.add_error(str(exc_type) + "\n" + str(fname) + "\n" + str(exc_tb.tb_lineno))
+        logger.debug(str(e))
+
+    def _remove_task_logfile(self, task):
+        if not self.keep_logfiles and not task.has_error():
+            try:
+                silentremove(task.logfile)
+                task.logfile = ""
+            except OSError:
+                pass  # Ignore if AnyBody has not released the log file.
+        self._trace("cleaned", task)
+
+    def _worker(self, task, task_queue):
+        """Handle processing of the tasks."""
+        if not self._start_task(task):
+            task_queue.put(task)
+            return
+        try:
+            self._run_task(task)
+        except Exception as e:
+            self._add_exception_to_task(task, e)
+        finally:
+            self._remove_task_logfile(task)
+            task_queue.put(task)
+
+    def _fused_worker(self, tasks, task_queue):
+        """Handle processing of a group of tasks in one console."""
+        tasks_to_run = [task for task in tasks if self._start_task(task)]
+        try:
+            if len(tasks_to_run) == 1:
+                self._run_task(tasks_to_run[0])
+            elif tasks_to_run:
+                self._run_fused_tasks(tasks_to_run)
+        except Exception as e:
+            for task in tasks_to_run:
+                self._add_exception_to_task(task, e)
+        finally:
+            for task in tasks_to_run:
+                self._remove_task_logfile(task)
+            task_queue.put(tasks)
+
+    def _run_task(self, task):
+        """Run a single task in the way selected by the options."""
+        task.usage = {}
+        session_macro = None
+        if self.use_sessions:
+            session_macro = _split_load_macro(task.macro)
+        if not os.path.exists(task.folder):
+            task.add_error("Could not find folder: {}".format(task.folder))
+            task.logfile = ""
+        elif session_macro is not None:
+            self._run_task_in_session(task, *session_macro)
+        elif self.stream_output:
+            self._launch_throttle.wait()
+            self._run_task_streaming(task)
+        else:
+            self._launch_throttle.wait()
+            with self._create_logfile(task) as logfile:
+                starttime = time.perf_counter()
+                try:
+                    task.retcode = self._get_executor().execute(
+                        task.macro,
+                        logfile,
+                        self.timeout,
+                        folder=task.folder,
+                        usage=task.usage,
+                        trace=self._task_tracer([task]),
+                    )
+                finally:
+                    task.processtime = time.perf_counter() - starttime
+                self._parse_logfile(task, logfile)
+
+    def _run_fused_tasks(self, tasks):
+        """Run tasks, which load the same model, as one macro.
+
+        A marker comment is added after the load commands and after the
+        commands of each task. The log is split at the markers, and each task
+        gets a log file with the load output and its own output.
+        """
+        folder = tasks[0].folder
+        if not os.path.exists(folder):
+            for task in tasks:
+                task.add_error("Could not find folder: {}".format(folder))
+                task.logfile = ""
+            return
+        tokens = [uuid.uuid4().hex for _ in range(len(tasks) + 1)]
+        load_macro, _ = _split_load_macro(tasks[0].macro)
+        macro = list(load_macro) + [_MACRO_MARKER + tokens[0]]
+        for task, token in zip(tasks, tokens[1:]):
+            macro.extend(_split_load_macro(task.macro)[1])
+            macro.append(_MACRO_MARKER + token)
+        tmp_kwargs = dict(
+            mode="a+",
+            prefix=self.logfile_prefix,
+            suffix=".log",
+            dir=folder,
+            delete=False,
+        )
+        usage = {}
+        with NamedTemporaryFile(**tmp_kwargs) as logfile:
+            self._launch_throttle.wait()
+            starttime = time.perf_counter()
+            try:
+                retcode = self._get_executor().execute(
+                    macro,
+                    logfile,
+                    self.timeout * len(tasks),
+                    folder=folder,
+                    usage=usage,
+                    trace=self._task_tracer(tasks),
+                )
+            finally:
+                # The tasks share the console, so the time and resources are
+                # split evenly. The peak memory is that of the shared console.
+                processtime = (time.perf_counter() - starttime) / len(tasks)
+                for task in tasks:
+                    task.processtime = processtime
+                    task.usage = dict(usage)
+                    for key in ("user_time", "system_time"):
+                        if key in usage:
+                            task.usage[key] = usage[key] / len(tasks)
+                    for key in ("read_bytes", "write_bytes"):
+                        if key in usage:
+                            task.usage[key] = usage[key] // len(tasks)
+            logfile.seek(0)
+            log = logfile.read()
+        silentremove(logfile.name)
+        parts, n_found = _split_fused_log(log, tokens)
+        for i, task in enumerate(tasks, 1):
+            with self._create_logfile(task) as task_logfile:
+                task_logfile.write(parts[0])
+                task_logfile.write(parts[i])
+                if i < n_found:
+                    task.retcode = 0
+                else:
+                    task.retcode = retcode
+                    task_logfile.write(_NOT_COMPLETED_MSG)
+                self._parse_logfile(task, task_logfile)
+
+    def _run_task_streaming(self, task):
+        """Run a task and parse the console output while it is produced."""
+        parser = AnyBodyConOutputParser(
+            self.ignore_errors,
+            self.warnings_to_include,
+            fatal_warnings=self.fatal_warnings,
+            lazy=self.lazy_parsing,
+        )
+        logfile = None
+        macro_filename = None
+        if self.write_logfiles:
+            logfile = self._create_logfile(task)
+        else:
+            fd, macro_filename = mkstemp(
+                prefix=self.logfile_prefix, suffix=".anymcr", dir=task.folder
+            )
+            os.close(fd)
+        if self.fail_fast:
+
+            def line_callback(line):
+                parser.feed(line)
+                # Returning True terminates the console
+                return parser.has_error
+
+        else:
+            line_callback = parser.feed
+        starttime = time.perf_counter()
+        try:
+            task.retcode = self._get_executor().execute(
+                task.macro,
+                logfile,
+                self.timeout,
+                line_callback=line_callback,
+                macro_filename=macro_filename,
+                folder=task.folder,
+                usage=task.usage,
+                trace=self._task_tracer([task]),
+            )
+        finally:
+            task.processtime = time.perf_counter() - starttime
+            if logfile is not None:
+                logfile.close()
+        task.output = parser.finish()
+        self._trace("parsed", task)
+
+    def _run_task_in_session(self, task, load_macro, task_macro):
+        """Run a task in a console which already has the model loaded."""
+        parser = AnyBodyConOutputParser(
+            self.ignore_errors,
+            self.warnings_to_include,
+            fatal_warnings=self.fatal_warnings,
+            lazy=self.lazy_parsing,
+        )
+        logfile = None
+        if self.write_logfiles:
+            logfile = self._create_logfile(task)
+        if self.fail_fast:
+
+            def line_callback(line):
+                parser.feed(line)
+                return parser.has_error
+
+        else:
+            line_callback = parser.feed
+        tee = _LineTee(line_callback, logfile)
+        pool = self._get_session_pool()
+        key = (self.anybodycon_path, task.folder, load_macro)
+        starttime = time.perf_counter()
+        session = None
+        reuse = False
+        try:
+            session = pool.acquire(key, self.timeout)
+            self._trace("spawned", task)
+            task.retcode = session.run_task(task_macro, tee, self.timeout, task.usage)
+            self._trace("exited", task)
+            tee.close()
+            task.output = parser.finish()
+            self._trace("parsed", task)
+            # Reload the model if anything went wrong
+            reuse = not task.has_error()
+        finally:
+            task.processtime = time.perf_counter() - starttime
+            if session is not None:
+                pool.release(session, reuse)
+            if logfile is not None:
+                logfile.close()
+
+    async def _async_worker(self, task, semaphore, abort):
+        """Handle processing of a task on the asyncio event loop.
+
+        The task is returned unfinished if it is cancelled after `abort` is
+        set.
+        """
+        if not self._start_task(task):
+            return task
         try:
             if not os.path.exists(task.folder):
                 task.add_error("Could not find folder: {}".format(task.folder))
                 task.logfile = ""
             else:
-                tmp_kwargs = dict(
-                    mode="a+",
-                    prefix=self.logfile_prefix,
-                    suffix=".log",
-                    dir=task.folder,
-                    delete=False,
-                )
-                with NamedTemporaryFile(**tmp_kwargs) as logfile:
-                    logfile.write("########### MACRO #############\n")
-                    logfile.write("\n".join(task.macro))
-                    logfile.write("\n\n######### OUTPUT LOG ##########")
-                    logfile.flush()
-                    task.logfile = logfile.name
-                    starttime = time.clock()
-                    exe_args = dict(
-                        macro=task.macro,
-                        logfile=logfile,
-                        anybodycon_path=self.anybodycon_path,
-                        timeout=self.timeout,
-                        keep_macrofile=self.keep_logfiles,
-                        env=self.env,
-                        priority=self.priority,
-                    )
-                    try:
-                        task.retcode = execute_anybodycon(**exe_args)
-                    finally:
-                        endtime = time.clock()
-                        logfile.seek(0)
-                        task.processtime = endtime - starttime
-                    task.output = parse_anybodycon_output(
-                        logfile.read(),
-                        self.ignore_errors,
-                        self.warnings_to_include,
-                        fatal_warnings=self.fatal_warnings,
-                    )
+                async with semaphore:
+                    await asyncio.sleep(self._launch_throttle.reserve())
+                    with self._create_logfile(task) as logfile:
+                        starttime = time.perf_counter()
+                        try:
+                            task.retcode = await execute_anybodycon_async(
+                                **self._execute_args(task, logfile)
+                            )
+                        finally:
+                            task.processtime = time.perf_counter() - starttime
+                        self._parse_logfile(task, logfile)
+        except asyncio.CancelledError:
+            if not abort.is_set():
+                raise
         except Exception as e:
-            exc_type, exc_obj, exc_tb = sys.exc_info()
-            fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
-            task.add_error(
-                str(exc_type) + "\n" + str(fname) + "\n" + str(exc_tb.tb_lineno)
-            )
-            logger.debug(str(e))
+            self._add_exception_to_task(task, e)
         finally:
-            if not self.keep_logfiles and not task.has_error():
-                try:
-                    silentremove(logfile.name)
-                    task.logfile = ""
-                except OSError as e:
-                    pass  # Ignore if AnyBody has not released the log file.
-            task_queue.put(task)
+            self._remove_task_logfile(task)
+        return task
 
     def _schedule_processes(self, tasklist, _worker):
         # Reset the global flag that allows
-        global _stop_all_processes
         _subprocess_container.stop_all = False
-        # Make a shallow copy of the task list,
-        # so we don't mess with the callers list.
-        tasklist = copy.copy(tasklist)
         number_tasks = len(tasklist)
         if number_tasks == 0:
             totaltime = 0
             return totaltime
         use_threading = number_tasks > 1 and self.num_processes > 1
-        starttime = time.clock()
-        task_queue = Queue()
+        starttime = time.perf_counter()
         pbar = _ProgressBar(number_tasks, self.silent)
         pbar.animate(0)
-        processed_tasks = []
         n_errors = 0
-        threads = []
+        estimates = None
+        if self.duration_history is not None:
+            estimates = {
+                id(task): self.duration_history.estimate(task) for task in tasklist
+            }
+        eta = _TimeLeft(tasklist, estimates, self.num_processes)
         try:
-            # run while there is still threads, tasks or stuff in the queue
-            # to process
-            while threads or tasklist or task_queue.qsize():
-                # if we aren't using all the processors AND there is still
-                # data left to compute, then spawn another thread
-                if (len(threads) < self.num_processes) and tasklist:
-                    if use_threading:
-                        t = Thread(
-                            target=_worker, args=tuple([tasklist.pop(0), task_queue])
-                        )
-                        t.daemon = True
-                        t.start()
-                        threads.append(t)
-                    else:
-                        _worker(tasklist.pop(0), task_queue)
-                else:
-                    # In the case that we have the maximum number
-                    # of running threads or we run out tasks.
-                    # Check if any of them are done
-                    for thread in threads:
-                        if not thread.isAlive():
-                            threads.remove(thread)
-                while task_queue.qsize():
-                    task = task_queue.get()
-                    if task.has_error():
-                        n_errors += 1
-                    self.summery.task_summery(task)
-                    processed_tasks.append(task)
-                    pbar.animate(len(processed_tasks), n_errors)
-
-                time.sleep(0.01)
+            finished_tasks = self._iter_processes(
+                tasklist, _worker, use_threading, estimates=estimates
+            )
+            for n_processed, task in enumerate(finished_tasks, 1):
+                if task.has_error():
+                    n_errors += 1
+                self.summery.task_summery(task)
+                eta.finished(task)
+                pbar.animate(n_processed, n_errors, eta.time_left())
         except KeyboardInterrupt:
             _display("Processing interrupted")
             _subprocess_container.stop_all = True
@@ -898,9 +2654,196 @@ class AnyPyProcess(object):
             # to escape this try-catch. This is usefull when if the code is
             # run in an outer loop which we want to excape as well.
             time.sleep(1)
-        totaltime = time.clock() - starttime
+        self._save_batch_state()
+        totaltime = time.perf_counter() - starttime
         return totaltime
 
+    def _iter_processes(
+        self, tasks, _worker, use_threading=True, ordered=False, estimates=None
+    ):
+        """Process the tasks and yield each task when it is finished.
+
+        The tasks are drawn lazily from the `tasks` iterable, so only the
+        running tasks are held by the scheduler. If `ordered` is True
+        tasks are yielded in the order they were given, otherwise in the
+        order they complete. With ``fuse_tasks`` the tasks are run in groups,
+        which are passed to ``_fused_worker`` instead of `_worker`.
+
+        If `estimates` is given, a dict from ``id(task)`` to the expected
+        duration (or None if unknown), all tasks are read up front and run
+        longest expected first. The durations of the finished tasks are
+        added to the ``duration_history``.
+
+        Tasks which fail because no license is available are retried with
+        backoff, and the number of running consoles is limited to the
+        learned license ceiling.
+        """
+        jobs = self._group_tasks(tasks)
+        if estimates is not None:
+            jobs = iter(_longest_first(list(jobs), estimates))
+        if use_threading:
+            pool = self._get_worker_pool()
+        # Consoles of this batch, which are killed if it is aborted
+        group = _ProcessGroup()
+        run_in_group = functools.partial(_subprocess_container.run_in_group, group)
+        # A new queue for every batch ensures that tasks from an
+        # interrupted batch never show up in the next one.
+        task_queue = Queue()
+        # Tasks in the order they were submitted, and the finished ones
+        # which wait for the tasks before them in ordered mode.
+        submitted = collections.deque()
+        finished = set()
+        licenses = _LicenseBackoff(self.num_processes, self.license_retries)
+        n_running = 0
+        n_errors = 0
+        aborted = False
+        next_job = next(jobs, None)
+        while next_job is not None or n_running or licenses.pending:
+            # Keep all workers busy while there are tasks left
+            while aborted or n_running < licenses.limit:
+                retry_task = licenses.pop_ready(force=aborted)
+                if retry_task is not None:
+                    job = [retry_task]
+                elif next_job is not None:
+                    job = next_job
+                    if ordered:
+                        submitted.extend(job)
+                    next_job = next(jobs, None)
+                else:
+                    break
+                if aborted:
+                    # Pass the remaining tasks straight through the queue
+                    # so they are reported like other finished tasks.
+                    for task in job:
+                        if not task.is_finished():
+                            task.add_error(_NOT_RUN_MSG.format(n_errors))
+                    task_queue.put(job)
+                    n_running += 1
+                    continue
+                if len(job) > 1:
+                    if use_threading:
+                        pool.submit(run_in_group, self._fused_worker, job, task_queue)
+                    else:
+                        run_in_group(self._fused_worker, job, task_queue)
+                elif use_threading:
+                    pool.submit(run_in_group, _worker, job[0], task_queue)
+                else:
+                    run_in_group(_worker, job[0], task_queue)
+                n_running += 1
+            finished_job = _wait_for_task(task_queue, licenses.time_to_next())
+            if finished_job is None:
+                # A task is ready to be retried
+                continue
+            n_running -= 1
+            if isinstance(finished_job, _Task):
+                finished_job = [finished_job]
+            for task in finished_job:
+                if (
+                    not aborted
+                    and task.retcode == _NO_LICENSES_AVAILABLE
+                    and licenses.retry(task, n_running)
+                ):
+                    self._trace("retried", task)
+                    self._reset_task(task)
+                    self._trace("queued", task)
+                    continue
+                if aborted and abs(task.retcode or 0) == _KILLED_BY_ANYPYTOOLS:
+                    task.add_error(_ABORTED_MSG.format(n_errors))
+                elif not aborted and task.has_error() and self.max_errors:
+                    n_errors += 1
+                    if n_errors >= self.max_errors:
+                        # Stop the queued tasks and terminate the running
+                        # consoles
+                        aborted = True
+                        _subprocess_container.stop_group(group)
+                if task.retcode != _NO_LICENSES_AVAILABLE:
+                    licenses.granted(task)
+                if task.has_error():
+                    self._trace("failed", task)
+                self._trace("finished", task)
+                self._record_finished(task)
+                if not ordered:
+                    yield task
+                    continue
+                finished.add(id(task))
+            while submitted and id(submitted[0]) in finished:
+                finished.remove(id(submitted[0]))
+                yield submitted.popleft()
+
+    def _reset_task(self, task):
+        """Clear the result of a task before it is run again."""
+        if not self.keep_logfiles:
+            silentremove(task.logfile)
+        task.logfile = ""
+        task.output = AnyPyProcessOutput()
+        task.processtime = 0
+        task.usage = {}
+        task.retcode = None
+
+    def _group_tasks(self, tasks):
+        """Group consecutive tasks which load the same model in the same folder.
+
+        Each group has at most ``fuse_tasks`` tasks. Without fusion every
+        task is a group of its own.
+        """
+        fuse_tasks = self.fuse_tasks or 1
+        if self.use_sessions or self.stream_output:
+            fuse_tasks = 1
+        group = []
+        group_key = None
+        for task in tasks:
+            key = None
+            if fuse_tasks > 1:
+                load_macro = _split_load_macro(task.macro)
+                if load_macro is not None:
+                    key = (task.folder, load_macro[0])
+            if group and (key is None or key != group_key or len(group) >= fuse_tasks):
+                yield group
+                group = []
+            group.append(task)
+            group_key = key
+        if group:
+            yield group
+
+    def _get_worker_pool(self):
+        """Return the worker pool, which is kept between batches."""
+        if self._worker_pool is None:
+            self._worker_pool = _WorkerPool(self.num_processes)
+            # The threads do not refer to the AnyPyProcess, so they are
+            # stopped when it is garbage collected
+            weakref.finalize(self, self._worker_pool.close)
+        else:
+            self._worker_pool.resize(self.num_processes)
+        return self._worker_pool
+
+    def _get_executor(self):
+        """Return the executor which launches the consoles."""
+        if self.executor is not None:
+            return self.executor
+        from .executors import LocalExecutor
+
+        return LocalExecutor(
+            self.anybodycon_path, self.env, self.priority, self.keep_logfiles
+        )
+
+    def _get_session_pool(self):
+        """Return the pool of running consoles, which is kept between batches."""
+        with _thread_lock:
+            if self._session_pool is None:
+                self._session_pool = _SessionPool(
+                    self.num_processes,
+                    self.env,
+                    self.priority,
+                    self._launch_throttle,
+                )
+            self._session_pool.max_sessions = self.num_processes
+        return self._session_pool
+
+    def close_sessions(self):
+        """Shut down the consoles kept running by ``use_sessions``."""
+        if self._session_pool is not None:
+            self._session_pool.close()
+
     def cleanup_logfiles(self, tasklist):
         for task in tasklist:
             try:
@@ -920,6 +2863,96 @@ class AnyPyProcess(object):
                     )
 
 
+def _select_tasks(tasks, task_ids=None, names=None, where=None):
+    """Return the tasks with the given ids and names, where `where` is true."""
+    if task_ids is not None:
+        task_ids = set(task_ids)
+        tasks = [task for task in tasks if task.number in task_ids]
+    if names is not None:
+        names = set(names)
+        tasks = [task for task in tasks if task.name in names]
+    if where is not None:
+        tasks = [task for task in tasks if where(task.get_output(True))]
+    return list(tasks)
+
+
+def _is_shelve(filename):
+    """Return True if `filename` is a shelve written by an older version."""
+    if ResultStore.is_store(filename):
+        return False
+    return any(os.path.exists(filename + ext) for ext in ("", ".db", ".dat"))
+
+
+def _longest_first(jobs, estimates):
+    """Sort the jobs by their expected duration, the longest first.
+
+    Tasks without an estimate are expected to take the mean of the known
+    estimates. The order is kept if nothing is known.
+    """
+    known = [d for d in estimates.values() if d is not None]
+    if not known:
+        return jobs
+    default = sum(known) / len(known)
+
+    def duration(job):
+        total = 0.0
+        for task in job:
+            estimate = estimates.get(id(task))
+            total += default if estimate is None else estimate
+        return total
+
+    return sorted(jobs, key=duration, reverse=True)
+
+
+class _TimeLeft(object):
+    """Estimate of the time left of a batch.
+
+    The estimates from the duration history are used where available. For
+    the other tasks the mean duration of the known estimates is used, or
+    the mean of the tasks finished so far.
+    """
+
+    def __init__(self, tasks, estimates, num_processes):
+        self.num_processes = max(num_processes, 1)
+        self.remaining = {}
+        self.remaining_known = 0.0
+        self.n_unknown = 0
+        known = []
+        for task in tasks:
+            estimate = estimates.get(id(task)) if estimates else None
+            self.remaining[id(task)] = estimate
+            if estimate is None:
+                self.n_unknown += 1
+            else:
+                self.remaining_known += estimate
+                known.append(estimate)
+        self.mean_estimate = sum(known) / len(known) if known else None
+        self.finished_time = 0.0
+        self.n_finished = 0
+
+    def finished(self, task):
+        estimate = self.remaining.pop(id(task), None)
+        if estimate is None:
+            self.n_unknown -= 1
+        else:
+            self.remaining_known -= estimate
+        if task.processtime > 0:
+            self.finished_time += task.processtime
+            self.n_finished += 1
+
+    def time_left(self):
+        """Return the seconds left, or None if there is nothing to go by."""
+        if not self.remaining:
+            return 0.0
+        mean = self.mean_estimate
+        if mean is None and self.n_finished:
+            mean = self.finished_time / self.n_finished
+        if mean is None:
+            return None
+        work = max(self.remaining_known, 0.0) + self.n_unknown * mean
+        return work / min(self.num_processes, len(self.remaining))
+
+
 class _ProgressBar:
     def __init__(self, iterations, silent=False):
         self.silent = silent
@@ -927,6 +2960,7 @@ class _ProgressBar:
         self.prog_bar = "[]"
         self.fill_char = "*"
         self.width = 40
+        self._line_length = 0
         if run_from_ipython() and ipywidgets and not self.silent:
             self.bar_widget = ipywidgets.IntProgress(
                 min=0, max=iterations, value=0, bar_style=""
@@ -936,31 +2970,41 @@ class _ProgressBar:
             box.layout.align_items = "center"
             display(box)
 
-    def animate(self, val, failed=0):
+    def animate(self, val, failed=0, time_left=None):
         if self.silent:
             return
         if run_from_ipython() and ipywidgets:
-            self._widget_animate(val, failed)
+            self._widget_animate(val, failed, time_left)
         else:
-            self._ascii_animate(val, failed)
+            self._ascii_animate(val, failed, time_left)
+
+    @staticmethod
+    def _format_time_left(time_left):
+        if time_left is None or time_left <= 0:
+            return ""
+        return ", {} left".format(datetime.timedelta(seconds=int(time_left)))
 
-    def _widget_animate(self, val, failed):
+    def _widget_animate(self, val, failed, time_left=None):
         self.bar_widget.value = val
         self.bar_description.value = "%d of %s" % (val, self.iterations)
+        self.bar_description.value += self._format_time_left(time_left)
         if failed > 0:
             self.bar_widget.bar_style = "danger"
         elif val == self.iterations:
             self.bar_widget.bar_style = "success"
 
-    def _ascii_animate(self, val, failed):
+    def _ascii_animate(self, val, failed, time_left=None):
         self.__update_amount((val / float(self.iterations)) * 100.0)
         self.prog_bar += "  %d of %s complete" % (val, self.iterations)
         if failed == 1:
             self.prog_bar += " ({0} Error)".format(failed)
         elif failed > 1:
             self.prog_bar += " ({0} Errors)".format(failed)
+        self.prog_bar += self._format_time_left(time_left)
         print("\r", end="")
-        print(self.prog_bar, end="")
+        # Pad with spaces to overwrite a longer previous line
+        print(self.prog_bar.ljust(self._line_length), end="")
+        self._line_length = len(self.prog_bar)
         sys.stdout.flush()
 
     def __update_amount(self, new_amount):
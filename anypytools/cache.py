@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent cache of the results from ``AnyPyProcess``.
+
+The results of tasks, which finish without errors, are stored on disk. When
+the same task is run again the stored output is returned without starting
+the console::
+
+    >>> app = AnyPyProcess(result_cache="~/.anypytools_cache")
+    >>> app.start_macro(macrolist)  # Runs the models
+    >>> app.start_macro(macrolist)  # Returns the stored results
+
+A result is stored under a key made from:
+
+* the macro commands and the folder they run in,
+* a fingerprint of the console (path, size and modification time), which
+  changes when AnyBody is updated,
+* a fingerprint of the content of the loaded model, and all files it
+  includes with ``#include`` or ``#import``,
+* the options which decide how the output is parsed (``ignore_errors``,
+  ``warnings_to_include`` and ``fatal_warnings``).
+
+Files which the model reads while it runs (e.g. with ``AnyInputFile``) and
+includes with path names that can not be resolved are not part of the
+fingerprint. Use :meth:`ResultCache.invalidate` or :meth:`ResultCache.clear`
+when such files change. Files written by the macros are not created again
+on a cache hit.
+"""
+
+import os
+import re
+import json
+import pickle
+import hashlib
+import threading
+
+__all__ = ["ResultCache"]
+
+INCLUDE_PATTERN = re.compile(
+    r'^[ \t]*#[ \t]*(?:include|import)[ \t]+(?:"([^"]*)"|<([^>]*)>)', flags=re.M
+)
+PATH_PATTERN = re.compile(r'^[ \t]*#[ \t]*path[ \t]+(\w+)[ \t]+"([^"]*)"', flags=re.M)
+LOAD_PATTERN = re.compile(r'^\s*load\s+"([^"]*)"', flags=re.IGNORECASE)
+LOAD_PATH_DEFINE_PATTERN = re.compile(r'-p\s+(\w+)=(?:---)?"((?:[^"\\]|\\.)*)"')
+
+
+def _strip_exit(macro):
+    """Return the macro as strings without a trailing ``exit`` command, so
+    macros with and without it are taken as the same task."""
+    macro = [str(cmd) for cmd in macro]
+    if macro and macro[-1].strip() == "exit":
+        macro.pop()
+    return macro
+
+
+class ResultCache(object):
+    """On-disk cache of task results with least recently used eviction.
+
+    Each result is a file in `directory`. A hit updates the modification
+    time of the file, and :meth:`trim` removes the files which were used
+    the longest time ago until the cache fits in `max_size`.
+
+    Parameters
+    ----------
+    directory : str
+        Folder for the cache. It is created if it does not exist.
+    max_size : int, optional
+        Maximum size of the cache in bytes. (Defaults to None, no limit)
+    """
+
+    suffix = ".result"
+
+    def __init__(self, directory, max_size=None):
+        self.directory = os.path.abspath(os.path.expanduser(directory))
+        os.makedirs(self.directory, exist_ok=True)
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._model_fingerprints = {}
+
+    def new_batch(self):
+        """Forget the model fingerprints, so changed files are detected."""
+        with self._lock:
+            self._model_fingerprints.clear()
+
+    def key(self, macro, folder, anybodycon_path, parse_options=None):
+        """Return the cache key of a macro run in `folder`.
+
+        `parse_options` is a dict with the options which decide how the
+        output of the console is parsed.
+        """
+        macro = _strip_exit(macro)
+        folder = os.path.abspath(folder)
+        models = [
+            self._model_fingerprint(folder, cmd)
+            for cmd in macro
+            if LOAD_PATTERN.match(cmd)
+        ]
+        content = [
+            macro,
+            folder,
+            models,
+            self._console_fingerprint(anybodycon_path),
+            parse_options,
+        ]
+        return hashlib.sha256(json.dumps(content).encode("UTF-8")).hexdigest()
+
+    def get(self, key):
+        """Return the stored entry for `key`, or None.
+
+        The entry is a dict with the ``output`` and the ``processtime`` of
+        the task which stored it.
+        """
+        filename = self._filename(key)
+        try:
+            with open(filename, "rb") as f:
+                entry = pickle.load(f)
+            os.utime(filename)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return entry
+
+    def put(self, key, output, processtime):
+        """Store the output of a task."""
+        filename = self._filename(key)
+        tmp_filename = "{}.{}.tmp".format(filename, threading.get_ident())
+        with open(tmp_filename, "wb") as f:
+            pickle.dump(
+                dict(output=output, processtime=processtime),
+                f,
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+        os.replace(tmp_filename, filename)
+
+    def invalidate(self, macro, folder=None, anybodycon_path=None, parse_options=None):
+        """Remove the stored result of a macro.
+
+        Returns
+        -------
+        bool
+            True if a result was removed.
+        """
+        if folder is None:
+            folder = os.getcwd()
+        self.new_batch()
+        try:
+            os.remove(
+                self._filename(self.key(macro, folder, anybodycon_path, parse_options))
+            )
+        except OSError:
+            return False
+        return True
+
+    def clear(self):
+        """Remove all stored results."""
+        for entry in self._entries():
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+    def size(self):
+        """Return the size of the stored results in bytes."""
+        return sum(entry.stat().st_size for entry in self._entries())
+
+    def trim(self):
+        """Remove the least recently used results until `max_size` is met."""
+        if self.max_size is None:
+            return
+        entries = [(entry.stat(), entry.path) for entry in self._entries()]
+        total = sum(stat.st_size for stat, _ in entries)
+        entries.sort(key=lambda e: e[0].st_mtime)
+        for stat, path in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= stat.st_size
+
+    def _entries(self):
+        return [
+            entry
+            for entry in os.scandir(self.directory)
+            if entry.name.endswith(self.suffix)
+        ]
+
+    def _filename(self, key):
+        return os.path.join(self.directory, key + self.suffix)
+
+    def _console_fingerprint(self, anybodycon_path):
+        if anybodycon_path is None:
+            return None
+        path = os.path.realpath(anybodycon_path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return path
+        return [path, stat.st_size, stat.st_mtime]
+
+    def _model_fingerprint(self, folder, load_command):
+        """Hash of the content of a model and all the files it includes."""
+        with self._lock:
+            fingerprint = self._model_fingerprints.get((folder, load_command))
+        if fingerprint is not None:
+            return fingerprint
+        main_file = os.path.join(folder, LOAD_PATTERN.match(load_command).group(1))
+        main_file = os.path.normpath(main_file)
+        path_names = {"ANYBODY_PATH_MAINFILEDIR": os.path.dirname(main_file)}
+        for name, value in LOAD_PATH_DEFINE_PATTERN.findall(load_command):
+            value = value.replace("\\\\", "\\")
+            path_names[name] = os.path.join(folder, value)
+        digest = hashlib.sha256()
+        seen = set()
+        # Depth first in the order of the include statements
+        stack = [main_file]
+        while stack:
+            filename = os.path.normpath(stack.pop())
+            if filename in seen:
+                continue
+            seen.add(filename)
+            digest.update(filename.encode("UTF-8"))
+            content = self._read_file(filename)
+            if content is None:
+                digest.update(b"missing")
+                continue
+            digest.update(hashlib.sha256(content).digest())
+            text = content.decode("UTF-8", errors="replace")
+            file_folder = os.path.dirname(filename)
+            for name, value in PATH_PATTERN.findall(text):
+                path_names.setdefault(name, os.path.join(file_folder, value))
+            includes = []
+            for quoted, angled in INCLUDE_PATTERN.findall(text):
+                if quoted:
+                    includes.append(os.path.join(file_folder, quoted))
+                    continue
+                name, _, rest = angled.replace("\\", "/").partition("/")
+                if name in path_names:
+                    includes.append(os.path.join(path_names[name], rest))
+                else:
+                    digest.update(("unresolved " + angled).encode("UTF-8"))
+            stack.extend(reversed(includes))
+        fingerprint = digest.hexdigest()
+        with self._lock:
+            self._model_fingerprints[(folder, load_command)] = fingerprint
+        return fingerprint
+
+    def _read_file(self, filename):
+        """Return the content of a file, or None if it can not be read."""
+        try:
+            with open(filename, "rb") as f:
+                return f.read()
+        except OSError:
+            return None
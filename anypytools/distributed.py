@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+Run AnyPyProcess batches on several computers.
+
+Each computer runs an :class:`~anypytools.executors.ExecutorServer`, which
+runs the macros it receives with the local AnyBody console::
+
+    python -m anypytools.executors 127.0.0.1:6677 --num-processes 16
+
+The :class:`DistributedAnyPyProcess` has the same interface as
+``AnyPyProcess``, but runs each task on a worker with a free slot. The output
+of the console is streamed back, and logged and parsed locally::
+
+    >>> app = DistributedAnyPyProcess([("node1", 6677), ("node2", 6677)])
+    >>> results = app.start_macro(macrolist, folderlist)
+
+The folders of the tasks must be available with the same path on all
+workers, e.g. on a shared network drive. The workers send heartbeats, and
+the tasks of a worker which stops responding are run again on the other
+workers.
+
+The workers run any macro they receive, and the connections are neither
+authenticated nor encrypted. The workers therefore listen on ``127.0.0.1``
+by default, and should only listen on other interfaces on trusted networks.
+"""
+
+import logging
+from threading import Condition, local
+
+from .abcutils import AnyPyProcess
+from .executors import RemoteExecutor
+
+logger = logging.getLogger("abt.anypytools")
+
+__all__ = ["DistributedAnyPyProcess", "Coordinator"]
+
+
+class _WorkerLost(IOError):
+    """The connection to a worker was lost while it ran a task."""
+
+
+class _WorkerExecutor(RemoteExecutor):
+    """RemoteExecutor which raises when the connection to the worker is lost,
+    so the task can be run again on another worker."""
+
+    def _connection_lost(self, message):
+        raise _WorkerLost(message)
+
+
+class _Worker(object):
+    def __init__(self, executor, capacity):
+        self.executor = executor
+        self.address = executor.address
+        self.capacity = capacity
+        self.n_running = 0
+        self.alive = True
+
+
+class Coordinator(object):
+    """Hand out the free slots of the workers.
+
+    Parameters
+    ----------
+    workers : list of tuple
+        Host name and port of the workers.
+    heartbeat_timeout : float, optional
+        A worker which has not sent anything for this many seconds while it
+        runs a task is taken as dead, and its tasks are run on other workers.
+        (Defaults to 30)
+    connect_timeout : float, optional
+        Timeout in seconds for connecting to the workers. (Defaults to 30)
+    """
+
+    def __init__(self, workers, heartbeat_timeout=30.0, connect_timeout=30):
+        self.workers = []
+        self._cond = Condition()
+        for address in workers:
+            executor = _WorkerExecutor(address, connect_timeout, heartbeat_timeout)
+            try:
+                capacity = executor.server_info()["capacity"]
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning("Could not connect to worker %s: %s", address, e)
+                continue
+            self.workers.append(_Worker(executor, capacity))
+        if not self.workers:
+            raise IOError("Could not connect to any AnyPyTools workers")
+
+    @property
+    def capacity(self):
+        """The number of tasks the live workers can run at the same time."""
+        with self._cond:
+            return sum(w.capacity for w in self.workers if w.alive)
+
+    def acquire(self):
+        """Wait for the least busy worker with a free slot and return it."""
+        with self._cond:
+            while True:
+                alive = [w for w in self.workers if w.alive]
+                if not alive:
+                    raise IOError("All AnyPyTools workers have been lost")
+                free = [w for w in alive if w.n_running < w.capacity]
+                if free:
+                    worker = min(free, key=lambda w: w.n_running / w.capacity)
+                    worker.n_running += 1
+                    return worker
+                self._cond.wait()
+
+    def release(self, worker):
+        """Give back a slot taken with :meth:`acquire`."""
+        with self._cond:
+            worker.n_running -= 1
+            self._cond.notify_all()
+
+    def worker_lost(self, worker, error):
+        """Stop sending tasks to a worker."""
+        with self._cond:
+            if not worker.alive:
+                return
+            worker.alive = False
+            self._cond.notify_all()
+        logger.warning(
+            "Worker %s:%s was lost: %s", worker.address[0], worker.address[1], error
+        )
+
+    def close(self):
+        """Stop sending tasks to the workers."""
+        with self._cond:
+            for worker in self.workers:
+                worker.alive = False
+            self._cond.notify_all()
+
+
+class DistributedAnyPyProcess(AnyPyProcess):
+    """AnyPyProcess which runs the tasks on remote workers.
+
+    The tasks are scheduled like with ``AnyPyProcess``, but each console runs
+    on an :class:`~anypytools.executors.ExecutorServer` with a free slot.
+    ``start_macro`` and ``imap_macro`` work as usual, while
+    ``start_macro_async`` still runs the tasks locally.
+
+    Parameters
+    ----------
+    workers : list of tuple
+        Host name and port of the workers.
+    heartbeat_timeout : float, optional
+        A worker which has not been heard from for this many seconds is taken
+        as dead, and its tasks are run on other workers. (Defaults to 30)
+    connect_timeout : float, optional
+        Timeout in seconds for connecting to the workers. (Defaults to 30)
+    **kwargs
+        Other arguments for ``AnyPyProcess``. ``num_processes`` defaults to
+        the total number of processes on the workers. The consoles are
+        started by the workers, so ``anybodycon_path``, ``env`` and
+        ``priority`` are set on the workers.
+    """
+
+    def __init__(self, workers, heartbeat_timeout=30.0, connect_timeout=30, **kwargs):
+        self.coordinator = Coordinator(workers, heartbeat_timeout, connect_timeout)
+        kwargs.setdefault("num_processes", self.coordinator.capacity)
+        super(DistributedAnyPyProcess, self).__init__(**kwargs)
+        # Each console runs on one worker, so tasks can not be fused or
+        # share sessions
+        self.fuse_tasks = None
+        self.use_sessions = False
+        self._local = local()
+
+    def _find_anybodycon(self, anybodycon_path):
+        # The console is only needed on the workers
+        return anybodycon_path
+
+    def _get_executor(self):
+        return self._local.worker.executor
+
+    def _run_task(self, task):
+        while True:
+            worker = self.coordinator.acquire()
+            self._local.worker = worker
+            try:
+                super(DistributedAnyPyProcess, self)._run_task(task)
+                return
+            except _WorkerLost as e:
+                self.coordinator.worker_lost(worker, e)
+                # Drop the partial output before the task is run again
+                self._reset_task(task)
+                self._trace("retried", task)
+            finally:
+                self.coordinator.release(worker)
+
+    def close(self):
+        """Stop sending tasks to the workers."""
+        self.coordinator.close()
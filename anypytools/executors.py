@@ -0,0 +1,516 @@
+# -*- coding: utf-8 -*-
+"""
+Executors which launch the AnyBody console for ``AnyPyProcess``.
+
+An executor takes a macro, writes the console output to a log stream and
+returns the return code of the console. ``AnyPyProcess`` uses a
+:class:`LocalExecutor` by default, but any executor can be given with the
+``executor`` argument::
+
+    >>> app = AnyPyProcess(executor=RemoteExecutor(("simserver", 6677)))
+
+On the remote computer the macros are then run by an :class:`ExecutorServer`::
+
+    python -m anypytools.executors 127.0.0.1:6677 --num-processes 16
+
+The server runs any macro it receives, and the connections are neither
+authenticated nor encrypted. It therefore listens on ``127.0.0.1`` by
+default. Only give the address of a network interface (e.g. ``0.0.0.0``) on
+trusted networks, or reach the server through an SSH tunnel.
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import logging
+import socketserver
+from tempfile import mkstemp
+from threading import Event, Lock, Thread, BoundedSemaphore
+
+from .abcutils import (
+    execute_anybodycon,
+    _LineTee,
+    _write_timeout_message,
+    _write_returncode_message,
+)
+from .tools import BELOW_NORMAL_PRIORITY_CLASS, silentremove, get_ncpu
+from .fake_anybodycon import FakeAnyBodyCon
+
+logger = logging.getLogger("abt.anypytools")
+
+__all__ = [
+    "Executor",
+    "LocalExecutor",
+    "FakeExecutor",
+    "RemoteExecutor",
+    "ExecutorServer",
+]
+
+
+class Executor(object):
+    """Base class for executors."""
+
+    def execute(
+        self,
+        macro,
+        logfile=None,
+        timeout=3600,
+        line_callback=None,
+        macro_filename=None,
+        folder=None,
+        usage=None,
+        trace=None,
+    ):
+        """Run a macro and write the console output to `logfile`.
+
+        Parameters
+        ----------
+        macro : list of str
+            List of macros strings to run.
+        logfile : file like object, optional
+            Stream which receives the output of the console.
+        timeout : int, optional
+            Timeout before the console is stopped. Defaults to 3600 seconds.
+        line_callback : callable, optional
+            Function which is called with each line of output. If it returns
+            True the console is stopped.
+        macro_filename : str, optional
+            Name of the temporary macro file, if the executor writes one.
+        folder : str, optional
+            Folder in which the macro is run. Defaults to the folder of
+            `macro_filename` or the current working directory.
+        usage : dict, optional
+            Dictionary which is updated with the resources used by the
+            console, if the executor can measure them. See
+            :func:`anypytools.abcutils.execute_anybodycon` for the keys.
+        trace : callable, optional
+            Function which is called with the name of each phase of the run,
+            like ``"spawned"`` and ``"exited"``. See
+            :mod:`anypytools.tracing` for the phases.
+
+        Returns
+        -------
+        int
+            The return code from the console.
+        """
+        raise NotImplementedError
+
+
+class LocalExecutor(Executor):
+    """Run the AnyBody console as a subprocess on this computer.
+
+    Parameters
+    ----------
+    anybodycon_path : str, optional
+        Path to the AnyBodyConsole application. Defaults to the installed
+        AnyBody version.
+    env : dict, optional
+        Environment variables for the console.
+    priority : int, optional
+        The priority of the subprocesses. Default is BELOW_NORMAL_PRIORITY_CLASS.
+    keep_macrofile : bool, optional
+        Set to True to keep the temporary macro files. (Defaults to False)
+    """
+
+    def __init__(
+        self,
+        anybodycon_path=None,
+        env=None,
+        priority=BELOW_NORMAL_PRIORITY_CLASS,
+        keep_macrofile=False,
+    ):
+        self.anybodycon_path = anybodycon_path
+        self.env = env
+        self.priority = priority
+        self.keep_macrofile = keep_macrofile
+
+    def execute(
+        self,
+        macro,
+        logfile=None,
+        timeout=3600,
+        line_callback=None,
+        macro_filename=None,
+        folder=None,
+        usage=None,
+        trace=None,
+    ):
+        if macro_filename is None and logfile is None and folder is not None:
+            fd, macro_filename = mkstemp(suffix=".anymcr", dir=folder)
+            os.close(fd)
+        return execute_anybodycon(
+            macro,
+            logfile=logfile,
+            anybodycon_path=self.anybodycon_path,
+            timeout=timeout,
+            keep_macrofile=self.keep_macrofile,
+            env=self.env,
+            priority=self.priority,
+            line_callback=line_callback,
+            macro_filename=macro_filename,
+            usage=usage,
+            trace=trace,
+        )
+
+
+class FakeExecutor(Executor):
+    """Run macros in the fake console inside the current process.
+
+    No subprocess is started, which makes it useful for benchmarking the
+    python side of AnyPyTools. For the same reason no resource usage is
+    recorded. See :mod:`anypytools.fake_anybodycon` for the
+    macro commands it understands.
+
+    Parameters
+    ----------
+    load_time : float, optional
+        Seconds it takes to load a model. (Defaults to 0)
+    run_time : float, optional
+        Seconds each ``run`` command takes. (Defaults to 0)
+    n_warnings : int, optional
+        Number of warnings printed by each ``run`` command. (Defaults to 0)
+    exit_code : int, optional
+        The return code of the console. (Defaults to 0)
+    """
+
+    def __init__(self, load_time=0.0, run_time=0.0, n_warnings=0, exit_code=0):
+        self.load_time = load_time
+        self.run_time = run_time
+        self.n_warnings = n_warnings
+        self.exit_code = exit_code
+
+    def execute(
+        self,
+        macro,
+        logfile=None,
+        timeout=3600,
+        line_callback=None,
+        macro_filename=None,
+        folder=None,
+        usage=None,
+        trace=None,
+    ):
+        if macro_filename is not None:
+            # Nothing is written to the macro file
+            silentremove(macro_filename)
+            if folder is None:
+                folder = os.path.dirname(os.path.abspath(macro_filename))
+        if logfile is None and line_callback is None:
+            logfile = sys.stdout
+        output = logfile
+        if line_callback is not None:
+            output = _LineTee(line_callback, logfile)
+        console = FakeAnyBodyCon(
+            output,
+            cwd=folder,
+            load_time=self.load_time,
+            run_time=self.run_time,
+            n_warnings=self.n_warnings,
+        )
+        if trace is not None:
+            trace("spawned")
+        console.banner()
+        deadline = time.monotonic() + timeout
+        returncode = self.exit_code
+        for command in macro:
+            if not console.execute(command):
+                break
+            if line_callback is not None and output.stop_requested:
+                output.write(
+                    "\nAnybodycon.exe was stopped by AnyPyTools after an error"
+                )
+                returncode = 0
+                break
+            if time.monotonic() > deadline:
+                _write_timeout_message(output, timeout)
+                returncode = 0
+                break
+        returncode = _write_returncode_message(output, returncode)
+        if line_callback is not None:
+            output.close()
+        if trace is not None:
+            trace("exited")
+        return returncode
+
+
+class RemoteExecutor(Executor):
+    """Run macros on a remote computer through an :class:`ExecutorServer`.
+
+    The folders of the tasks must be available with the same path on the
+    remote computer, e.g. on a shared network drive.
+
+    Parameters
+    ----------
+    address : tuple
+        Host name and port of the server.
+    connect_timeout : float, optional
+        Timeout in seconds for connecting to the server. (Defaults to 30)
+    heartbeat_timeout : float, optional
+        The connection is taken as lost when nothing has been received from
+        the server for this many seconds. The server sends heartbeats while
+        the macro runs. (Defaults to None, which waits forever)
+    """
+
+    def __init__(self, address, connect_timeout=30, heartbeat_timeout=None):
+        self.address = tuple(address)
+        self.connect_timeout = connect_timeout
+        self.heartbeat_timeout = heartbeat_timeout
+
+    def server_info(self):
+        """Ask the server about itself.
+
+        Returns
+        -------
+        dict
+            Information about the server. ``"capacity"`` is the number of
+            macros it runs at the same time.
+        """
+        with socket.create_connection(self.address, self.connect_timeout) as sock:
+            stream = sock.makefile("rw", encoding="UTF-8", newline="\n")
+            stream.write(json.dumps({"info": True}) + "\n")
+            stream.flush()
+            info = json.loads(stream.readline())
+            stream.close()
+        return info
+
+    def execute(
+        self,
+        macro,
+        logfile=None,
+        timeout=3600,
+        line_callback=None,
+        macro_filename=None,
+        folder=None,
+        usage=None,
+        trace=None,
+    ):
+        if macro_filename is not None:
+            # The server writes its own macro file
+            silentremove(macro_filename)
+            if folder is None:
+                folder = os.path.dirname(os.path.abspath(macro_filename))
+        if folder is None:
+            folder = os.getcwd()
+        if logfile is None and line_callback is None:
+            logfile = sys.stdout
+        output = logfile
+        if line_callback is not None:
+            output = _LineTee(line_callback, logfile)
+        request = dict(macro=list(macro), folder=folder, timeout=timeout)
+        returncode = None
+        error = None
+        try:
+            with socket.create_connection(self.address, self.connect_timeout) as sock:
+                sock.settimeout(self.heartbeat_timeout)
+                stream = sock.makefile("rw", encoding="UTF-8", newline="\n")
+                stream.write(json.dumps(request) + "\n")
+                stream.flush()
+                if trace is not None:
+                    trace("spawned")
+                first_output = True
+                for message in stream:
+                    message = json.loads(message)
+                    if "output" in message:
+                        if first_output and trace is not None:
+                            trace("first_output")
+                        first_output = False
+                        output.write(message["output"])
+                        if line_callback is not None and output.stop_requested:
+                            # Closing the connection stops the remote console
+                            output.write(
+                                "\nAnybodycon.exe was stopped by AnyPyTools "
+                                "after an error"
+                            )
+                            break
+                    elif "returncode" in message:
+                        returncode = message["returncode"]
+                        if usage is not None:
+                            usage.update(message.get("usage", {}))
+                stream.close()
+        except OSError as e:
+            error = "Connection to {}:{} failed: {}".format(
+                self.address[0], self.address[1], e
+            )
+        if returncode is None and not (
+            line_callback is not None and output.stop_requested
+        ):
+            error = error or "Lost connection to the remote worker"
+            output.write("\nERROR: AnyPyTools : " + error)
+        if line_callback is not None:
+            output.close()
+        if trace is not None:
+            trace("exited")
+        if error is not None:
+            self._connection_lost(error)
+        return returncode or 0
+
+    def _connection_lost(self, message):
+        """Called when the macro did not finish because the connection to the
+        server failed. The message is already written to the log."""
+
+
+class _ExecutorRequestHandler(socketserver.StreamRequestHandler):
+    """Run one macro for a :class:`RemoteExecutor`."""
+
+    def handle(self):
+        request = json.loads(self.rfile.readline().decode("UTF-8"))
+        send_lock = Lock()
+        stopped = Event()
+
+        def send(message):
+            with send_lock:
+                self.wfile.write((json.dumps(message) + "\n").encode("UTF-8"))
+                self.wfile.flush()
+
+        def heartbeat():
+            while not stopped.wait(self.server.heartbeat_interval):
+                try:
+                    send({"heartbeat": True})
+                except OSError:
+                    return
+
+        def line_callback(line):
+            try:
+                send({"output": line + "\n"})
+            except OSError:
+                # The client has gone. Stop the console.
+                return True
+            return False
+
+        if request.get("info"):
+            send({"capacity": self.server.num_processes})
+            return
+        if self.server.heartbeat_interval:
+            thread = Thread(target=heartbeat)
+            thread.daemon = True
+            thread.start()
+        folder = request["folder"]
+        usage = {}
+        try:
+            if not os.path.isdir(folder):
+                line_callback("ERROR: AnyPyTools : Could not find folder: " + folder)
+                returncode = 0
+            else:
+                with self.server.slots:
+                    returncode = self._execute(request, folder, line_callback, usage)
+        finally:
+            stopped.set()
+        try:
+            send({"returncode": returncode, "usage": usage})
+        except OSError:
+            pass
+
+    def _execute(self, request, folder, line_callback, usage):
+        """Run the macro with the executor of the server.
+
+        An exception from the executor is sent to the client as an error in
+        the output, with the return code 1.
+        """
+        macro_filename = None
+        try:
+            fd, macro_filename = mkstemp(suffix=".anymcr", dir=folder)
+            os.close(fd)
+            return self.server.executor.execute(
+                request["macro"],
+                timeout=request["timeout"],
+                line_callback=line_callback,
+                macro_filename=macro_filename,
+                folder=folder,
+                usage=usage,
+            )
+        except Exception as e:
+            logger.exception("The executor failed to run a macro")
+            silentremove(macro_filename)
+            line_callback("ERROR: AnyPyTools : The executor failed: {}".format(e))
+            return 1
+
+
+class ExecutorServer(socketserver.ThreadingTCPServer):
+    """Server which runs macros for :class:`RemoteExecutor` clients.
+
+    Each connection runs one macro with `executor`. The server executes any
+    macro it receives, so it should only listen on trusted networks.
+
+    Parameters
+    ----------
+    address : tuple
+        Host name and port to listen on.
+    executor : Executor, optional
+        The executor which runs the macros. Defaults to a
+        :class:`LocalExecutor`.
+    num_processes : int, optional
+        Number of macros which run at the same time. Other macros wait for a
+        free slot. Defaults to the number of CPUs.
+    heartbeat_interval : float, optional
+        Seconds between the heartbeats sent to the clients while their macro
+        waits or runs. None disables the heartbeats. (Defaults to 5)
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(
+        self, address, executor=None, num_processes=None, heartbeat_interval=5.0
+    ):
+        if executor is None:
+            executor = LocalExecutor()
+        self.executor = executor
+        self.num_processes = num_processes or get_ncpu()
+        self.slots = BoundedSemaphore(self.num_processes)
+        self.heartbeat_interval = heartbeat_interval
+        self.connections = set()
+        socketserver.ThreadingTCPServer.__init__(self, address, _ExecutorRequestHandler)
+
+    def process_request_thread(self, request, client_address):
+        self.connections.add(request)
+        try:
+            socketserver.ThreadingTCPServer.process_request_thread(
+                self, request, client_address
+            )
+        finally:
+            self.connections.discard(request)
+
+    def close(self):
+        """Stop the server and drop the connected clients."""
+        self.shutdown()
+        self.server_close()
+        for sock in list(self.connections):
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Run AnyBody macros for AnyPyTools on this computer."
+    )
+    parser.add_argument(
+        "address",
+        nargs="?",
+        default="127.0.0.1:6677",
+        help="host:port to listen on (Defaults to 127.0.0.1:6677)",
+    )
+    parser.add_argument("--anybodycon", help="Path to the AnyBody console")
+    parser.add_argument(
+        "--num-processes", type=int, default=None, help="Number of parallel consoles"
+    )
+    args = parser.parse_args(argv)
+    host, port = args.address.rsplit(":", 1)
+    server = ExecutorServer(
+        (host, int(port)), LocalExecutor(args.anybodycon), args.num_processes
+    )
+    print("Listening on {}:{}".format(host, port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+A minimal stand-in for the AnyBody Console application.
+
+The fake console understands enough of the macro language to test
+AnyPyTools without an AnyBody installation. It can be given to
+``AnyPyProcess`` as ``anybodycon_path`` since files ending with ``.py`` are
+started with the current Python interpreter::
+
+    python fake_anybodycon.py --macro= macro.anymcr /ni
+    python fake_anybodycon.py /ni
+
+Without the ``--macro=`` argument the macro commands are read from stdin.
+
+The behaviour can be adjusted with environment variables:
+
+``FAKE_ANYBODYCON_LOAD_TIME``
+    Seconds it takes to load a model.
+``FAKE_ANYBODYCON_RUN_TIME``
+    Seconds each ``run`` command takes.
+``FAKE_ANYBODYCON_WARNINGS``
+    Number of warnings printed by each ``run`` command.
+``FAKE_ANYBODYCON_EXIT_CODE``
+    Return code of the console.
+``FAKE_ANYBODYCON_LICENSES`` and ``FAKE_ANYBODYCON_LICENSE_DIR``
+    Number of licenses and a folder where the licenses in use are recorded.
+    A console which can not get a license exits with return code -22.
+
+A loaded model is a plain text file where variables are defined as
+``AnyVar a = 1.0;``. The variables can be dumped and changed with the
+``"Dump"`` and ``"Set Value"`` class operations. Dumping or setting a variable
+which does not exist gives an error. A variable defined as
+``AnyFloat Out = fake_array(100, 3);`` is dumped as a 100 by 3 array, which
+is written over several lines like large dumps from AnyBody. All other
+operations are accepted without doing anything.
+"""
+
+import os
+import re
+import sys
+import time
+
+LOAD_PATTERN = re.compile(r'^load\s+"([^"]*)"', flags=re.IGNORECASE)
+CLASSOPERATION_PATTERN = re.compile(
+    r'^classoperation\s+(\S+)\s+"([^"]*)"(?:\s+--value="(.*)")?\s*$',
+    flags=re.IGNORECASE,
+)
+VARIABLE_PATTERN = re.compile(r"Any\w*\s+(\w+)\s*=\s*([^;]*);")
+FAKE_ARRAY_PATTERN = re.compile(r"^fake_array\((\d+)(?:\s*,\s*(\d+))?\)$")
+NO_LICENSE = -22
+
+
+def _env(name, default):
+    return type(default)(os.environ.get("FAKE_ANYBODYCON_" + name, default))
+
+
+def _format(value):
+    return "{:.6g}".format(value)
+
+
+def fake_array(rows, columns=None):
+    """Return the dump of a `rows` by `columns` array as AnyBody writes it."""
+    if columns is None:
+        return "{" + ", ".join(_format(0.001 * i) for i in range(rows)) + "}"
+    row_strings = []
+    for i in range(rows):
+        values = (0.001 * (i * columns + j) for j in range(columns))
+        row_strings.append("{" + ", ".join(_format(v) for v in values) + "}")
+    return "{" + ",\n  ".join(row_strings) + "}"
+
+
+def checkout_license():
+    """Take a free license. Returns the license file, or None if all are taken.
+
+    Returns an empty string when no license limit is configured.
+    """
+    n_licenses = os.environ.get("FAKE_ANYBODYCON_LICENSES")
+    if n_licenses is None:
+        return ""
+    license_dir = os.environ["FAKE_ANYBODYCON_LICENSE_DIR"]
+    for i in range(int(n_licenses)):
+        license_file = os.path.join(license_dir, "license{}.lock".format(i))
+        try:
+            os.close(os.open(license_file, os.O_CREAT | os.O_EXCL))
+        except OSError:
+            continue
+        return license_file
+    return None
+
+
+class FakeAnyBodyCon(object):
+    """Interpreter for the macro commands understood by the fake console.
+
+    Parameters
+    ----------
+    stdout : file like object, optional
+        Stream which receives the output. (Defaults to sys.stdout)
+    cwd : str, optional
+        Folder which model files are loaded relative to. (Defaults to the
+        current working directory)
+    load_time, run_time : float, optional
+        Seconds it takes to load a model, and to run an operation.
+    n_warnings : int, optional
+        Number of warnings printed by each ``run`` command.
+
+    The options, which are not given, are read from the environment
+    variables described in the module documentation.
+    """
+
+    def __init__(
+        self,
+        stdout=sys.stdout,
+        cwd=None,
+        load_time=None,
+        run_time=None,
+        n_warnings=None,
+    ):
+        self.stdout = stdout
+        self.cwd = cwd if cwd is not None else os.getcwd()
+        self.load_time = load_time if load_time is not None else _env("LOAD_TIME", 0.0)
+        self.run_time = run_time if run_time is not None else _env("RUN_TIME", 0.0)
+        if n_warnings is None:
+            n_warnings = _env("WARNINGS", 0)
+        self.n_warnings = n_warnings
+        self.operation = None
+        self.values = None
+
+    def print(self, text=""):
+        self.stdout.write(text + "\n")
+        self.stdout.flush()
+
+    def banner(self):
+        self.print()
+        self.print("AnyBody Console Application")
+        self.print("AnyBodyCon.exe version : 0. 0. 0. 0 (fake version)")
+        self.print()
+        self.print("Current path: {}".format(self.cwd))
+        self.print()
+
+    def execute(self, command):
+        """Execute a macro command. Returns False for the exit command."""
+        command = command.strip()
+        if not command:
+            return True
+        self.print("#### Macro command > {}".format(command))
+        if command.startswith("//"):
+            return True
+        if command.lower() == "exit":
+            return False
+        load_match = LOAD_PATTERN.match(command)
+        classop_match = CLASSOPERATION_PATTERN.match(command)
+        if load_match:
+            self.load(load_match.group(1))
+        elif self.values is None:
+            self.print("Model loading skipped")
+        elif classop_match:
+            self.classoperation(*classop_match.groups())
+        elif command.lower().startswith("operation "):
+            self.operation = command.split(None, 1)[1].strip()
+        elif command.lower() == "run":
+            self.run()
+        self.print()
+        return True
+
+    def load(self, filename):
+        self.values = None
+        path = os.path.abspath(os.path.join(self.cwd, filename))
+        self.print('Loading  Main  :  "{}"'.format(path))
+        try:
+            with open(path) as model:
+                variables = VARIABLE_PATTERN.findall(model.read())
+        except IOError:
+            self.print("ERROR(SCR.SCN6) : {} : Could not open file".format(path))
+            return
+        time.sleep(self.load_time)
+        self.values = {}
+        for name, value in variables:
+            array_match = FAKE_ARRAY_PATTERN.match(value.strip())
+            if array_match:
+                rows, columns = array_match.groups()
+                value = fake_array(int(rows), columns and int(columns))
+            self.values["Main." + name] = value.strip()
+        self.print("Loaded successfully.")
+        self.print("Elapsed Time : 0.000000")
+
+    def run(self):
+        if self.operation is None:
+            self.print("ERROR(OBJ.MCR) : No operation selected")
+            return
+        self.print("0.0) {}...".format(self.operation))
+        time.sleep(self.run_time)
+        for i in range(self.n_warnings):
+            self.print(
+                "WARNING(OBJ.MCH.KIN6) : {} : Close to singular position : "
+                "step {}".format(self.operation, i)
+            )
+        self.print("1.0) ...{} completed".format(self.operation))
+
+    def classoperation(self, name, operation, value):
+        if name not in self.values:
+            self.print("ERROR(OBJ1) : {} : Unresolved object".format(name))
+        elif operation == "Dump":
+            self.print("{} = {};".format(name, self.values[name]))
+        elif operation == "Set Value":
+            self.values[name] = value
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if "--macro=" in argv:
+        macro_filename = argv[argv.index("--macro=") + 1]
+        # Relative paths in macro files are relative to the macro file
+        os.chdir(os.path.dirname(os.path.abspath(macro_filename)))
+        with open(macro_filename, encoding="UTF-8") as macro_file:
+            commands = macro_file.read().splitlines()
+    else:
+        commands = sys.stdin
+    console = FakeAnyBodyCon()
+    license_file = checkout_license()
+    if license_file is None:
+        console.print("ERROR : No license available")
+        return NO_LICENSE
+    console.banner()
+    try:
+        for command in commands:
+            if not console.execute(command):
+                break
+    finally:
+        if license_file:
+            os.remove(license_file)
+    return _env("EXIT_CODE", 0)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
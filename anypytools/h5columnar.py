@@ -0,0 +1,365 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar HDF5 layout for the results of many tasks.
+
+``AnyPyProcess.save_to_hdf5(..., layout="columnar")`` stores each output
+variable as one chunked and compressed dataset, where the first axis is the
+task. Later batches are appended to the same datasets, and a variable is read
+for all tasks at once::
+
+    >>> app.start_macro(macrolist)
+    >>> app.save_to_hdf5("results.h5", layout="columnar")
+    >>> app.start_macro(more_macros)
+    >>> app.save_to_hdf5("results.h5", layout="columnar")
+    >>> t = read_variable("results.h5", "Abscissa.t")
+
+The layout of the group (``results`` unless another name is given) is:
+
+``variables/<name>``
+    Numeric outputs. Outputs with the same shape in all tasks are stacked
+    into one dataset with shape ``(n_tasks, ...)``. A task where the output
+    is missing is filled with NaN.
+``variables/<name>/values`` and ``variables/<name>/offsets``
+    Numeric outputs where the length differs between the tasks (e.g. time
+    series with different number of steps). The arrays of all tasks are
+    concatenated along the first axis in ``values``. The rows of task ``i``
+    are ``values[offsets[i]:offsets[i + 1]]``.
+``tasks/<name>``
+    The table of the outputs which are not numeric, like the task names,
+    macros and errors, with one JSON encoded string per task. An empty
+    string marks a missing value.
+
+Names with ``/`` are stored with ``|`` instead.
+"""
+
+import json
+import functools
+import collections
+
+import numpy as np
+
+from .tools import (
+    AnyPyProcessOutput,
+    AnyPyProcessOutputList,
+    RaggedArray,
+    _get_first_key_match,
+)
+
+__all__ = ["save_columnar", "read_variable", "read_table", "load_columnar"]
+
+# Approximate size of the chunks in bytes
+CHUNK_BYTES = 256 * 1024
+
+
+def _h5name(key):
+    return key.replace("/", "|")
+
+
+def _key(h5name):
+    return h5name.replace("|", "/")
+
+
+def _is_numeric(value):
+    if isinstance(value, (bool, int, float, np.number, np.bool_)):
+        return True
+    return isinstance(value, np.ndarray) and value.dtype.kind in "biuf"
+
+
+def _chunks(row_shape, dtype):
+    row_bytes = max(1, int(np.prod(row_shape, dtype=np.int64)) * dtype.itemsize)
+    return (max(1, CHUNK_BYTES // row_bytes),) + tuple(max(1, n) for n in row_shape)
+
+
+def _create(group, name, data, compression):
+    return group.create_dataset(
+        name,
+        data=data,
+        maxshape=(None,) + data.shape[1:],
+        chunks=_chunks(data.shape[1:], data.dtype),
+        compression=compression,
+        shuffle=compression is not None,
+    )
+
+
+def _append(dataset, data):
+    n = dataset.shape[0]
+    dataset.resize(n + data.shape[0], axis=0)
+    dataset[n:] = data
+
+
+class _Variable(object):
+    """Numeric output of the tasks which are saved. Missing values are None."""
+
+    def __init__(self, values):
+        self.values = values
+        present = [np.asarray(v) for v in values if v is not None]
+        self.missing = len(present) < len(values)
+        dtypes = set(v.dtype for v in present)
+        self.dtype = functools.reduce(np.promote_types, dtypes) if dtypes else None
+        self.shapes = set(v.shape for v in present)
+
+    def uniform_dtype(self, dtype=None):
+        """Return the dtype for stacking. It can hold NaN for missing values."""
+        if self.dtype is not None:
+            dtype = self.dtype if dtype is None else np.promote_types(dtype, self.dtype)
+        if self.missing and dtype.kind in "biu":
+            dtype = np.promote_types(dtype, float)
+        return dtype
+
+    def uniform_shape(self, default=None):
+        """Return the shape shared by all values, or None."""
+        if not self.shapes:
+            return default
+        if len(self.shapes) == 1:
+            return next(iter(self.shapes))
+        return None
+
+    def row_shape(self, default=()):
+        """Shape of the rows if the values are stored as ragged."""
+        row_shapes = set(shape[1:] for shape in self.shapes if len(shape))
+        if len(row_shapes) > 1:
+            raise ValueError("Values can only differ in the length of the first axis")
+        return row_shapes.pop() if row_shapes else default
+
+    def stacked(self, shape, dtype):
+        data = np.zeros((len(self.values),) + shape, dtype=dtype)
+        for i, value in enumerate(self.values):
+            data[i] = np.nan if value is None else value
+        return data
+
+    def ragged(self, row_shape, dtype):
+        """Return the concatenated values and the number of rows of each task."""
+        arrays = [np.zeros((0,) + row_shape, dtype=dtype)]
+        for value in self.values:
+            if value is not None:
+                value = np.asarray(value, dtype=dtype)
+                arrays.append(value.reshape((-1,) + row_shape))
+            else:
+                arrays.append(arrays[0])
+        return np.concatenate(arrays), [len(a) for a in arrays[1:]]
+
+
+def _read_dataset(node):
+    """Return (uniform data, None) or (values, offsets) of a stored variable."""
+    if hasattr(node, "shape"):
+        return node[()], None
+    return node["values"][()], node["offsets"][()]
+
+
+def _check_variable(node, key, variable):
+    """Raise ValueError if the values can not be stored with the stored values."""
+    shapes = set(variable.shapes)
+    if node is not None and hasattr(node, "shape"):
+        shapes.add(node.shape[1:])
+    elif node is not None:
+        shapes.add((0,) + node["values"].shape[1:])
+    row_shapes = set(shape[1:] for shape in shapes if len(shape))
+    if len(shapes) > 1 and len(row_shapes) > 1:
+        raise ValueError(
+            "{} can only differ in the length of the first axis".format(key)
+        )
+
+
+def _write_variable(group, name, variable, n_old, compression):
+    """Add the values of a variable to the stored tasks."""
+    node = group.get(name)
+    if node is not None and hasattr(node, "shape"):
+        shape = variable.uniform_shape(default=node.shape[1:])
+        dtype = variable.uniform_dtype(node.dtype)
+        if shape == node.shape[1:] and dtype == node.dtype:
+            _append(node, variable.stacked(shape, dtype))
+            return
+    elif node is not None:
+        stored = node["values"]
+        dtype = stored.dtype
+        if variable.dtype is not None:
+            dtype = np.promote_types(dtype, variable.dtype)
+        row_shape = variable.row_shape(default=stored.shape[1:])
+        if row_shape == stored.shape[1:] and dtype == stored.dtype:
+            values, lengths = variable.ragged(row_shape, dtype)
+            offsets = node["offsets"][-1] + np.cumsum(lengths, dtype=np.int64)
+            _append(stored, values)
+            _append(node["offsets"], offsets)
+            return
+    # Rewrite the variable with the old and the new values
+    old_values = [None] * n_old
+    if node is not None:
+        data, offsets = _read_dataset(node)
+        if offsets is None:
+            old_values = list(data)
+        else:
+            old_values = [
+                data[start:end] if end > start else None
+                for start, end in zip(offsets[:-1], offsets[1:])
+            ]
+        del group[name]
+    combined = _Variable(old_values + variable.values)
+    shape = combined.uniform_shape()
+    if shape is not None:
+        dtype = combined.uniform_dtype()
+        _create(group, name, combined.stacked(shape, dtype), compression)
+        return
+    values, lengths = combined.ragged(combined.row_shape(), combined.dtype)
+    offsets = np.cumsum([0] + lengths, dtype=np.int64)
+    ragged = group.create_group(name)
+    _create(ragged, "values", values, compression)
+    _create(ragged, "offsets", offsets, compression)
+
+
+def _encode(value):
+    if isinstance(value, np.ndarray):
+        value = value.tolist()
+    elif isinstance(value, np.generic):
+        value = value.item()
+    return json.dumps(value, default=str)
+
+
+def _decode(text):
+    if isinstance(text, bytes):
+        text = text.decode("UTF-8")
+    if not text:
+        return None
+    return json.loads(text)
+
+
+def save_columnar(filename, outputs, group="results", compression="gzip"):
+    """Save or append a list of outputs in the columnar layout.
+
+    Parameters
+    ----------
+    filename : str
+        The HDF5 file. It is created if it does not exist.
+    outputs : list of dict
+        The outputs, e.g. from ``AnyPyProcess.start_macro``.
+    group : str, optional
+        Group in the file where the results are stored. New outputs are
+        appended to the results already in the group. (Defaults to "results")
+    compression : str, optional
+        Compression filter of the datasets. (Defaults to "gzip")
+    """
+    import h5py
+
+    outputs = [collections.OrderedDict(out.items()) for out in outputs]
+    if not outputs:
+        raise ValueError("No data available for saving")
+    keys = collections.OrderedDict()
+    for out in outputs:
+        keys.update((_h5name(key), key) for key in out)
+    with h5py.File(filename, "a") as h5file:
+        h5group = h5file.require_group(group)
+        variables = h5group.require_group("variables")
+        table = h5group.require_group("tasks")
+        n_old = int(h5group.attrs.get("n_tasks", 0))
+        for name in list(variables) + list(table):
+            keys.setdefault(name, _key(name))
+        # Check all outputs before anything is written, so a failed append
+        # leaves the stored tasks as they were
+        columns = []
+        for name, key in keys.items():
+            values = [out.get(key) for out in outputs]
+            numeric = all(v is None or _is_numeric(v) for v in values)
+            if name in table or not numeric:
+                if name in variables:
+                    raise ValueError("{} is not numeric in all tasks".format(key))
+                columns.append((name, values, None))
+            else:
+                variable = _Variable(values)
+                _check_variable(variables.get(name), key, variable)
+                columns.append((name, values, variable))
+        for name, values, variable in columns:
+            if variable is None:
+                if name not in table:
+                    table.create_dataset(
+                        name,
+                        shape=(n_old,),
+                        maxshape=(None,),
+                        dtype=h5py.special_dtype(vlen=str),
+                        chunks=(1024,),
+                        compression=compression,
+                    )
+                encoded = ["" if v is None else _encode(v) for v in values]
+                _append(table[name], np.array(encoded, dtype=object))
+            else:
+                _write_variable(variables, name, variable, n_old, compression)
+        h5group.attrs["n_tasks"] = n_old + len(outputs)
+
+
+def _variable_names(h5group):
+    return [_key(name) for name in h5group["variables"]]
+
+
+def read_variable(filename, key, group="results"):
+    """Read one numeric output of all tasks.
+
+    Parameters
+    ----------
+    filename : str
+        The HDF5 file.
+    key : str
+        Name of the output. A part of the name is enough if it is unique.
+    group : str, optional
+        The group with the results. (Defaults to "results")
+
+    Returns
+    -------
+    np.ndarray or RaggedArray
+        An array with the tasks along the first axis, or a
+        :class:`~anypytools.tools.RaggedArray` if the length differs between
+        the tasks.
+    """
+    import h5py
+
+    with h5py.File(filename, "r") as h5file:
+        h5group = h5file[group]
+        key = _get_first_key_match(key, _variable_names(h5group))
+        name = _h5name(key)
+        if name not in h5group["variables"]:
+            raise KeyError("The key {} could not be found in the data".format(key))
+        data, offsets = _read_dataset(h5group["variables"][name])
+    if offsets is None:
+        return data
+    return RaggedArray(data, offsets)
+
+
+def read_table(filename, group="results"):
+    """Read the task information and the other outputs which are not numeric.
+
+    Returns
+    -------
+    OrderedDict
+        A list of values for each column. Missing values are None.
+    """
+    import h5py
+
+    with h5py.File(filename, "r") as h5file:
+        table = h5file[group]["tasks"]
+        return collections.OrderedDict(
+            (_key(name), [_decode(text) for text in table[name][()]]) for name in table
+        )
+
+
+def load_columnar(filename, group="results"):
+    """Load all outputs from the columnar layout.
+
+    Returns
+    -------
+    AnyPyProcessOutputList
+        The outputs of all tasks in the group.
+    """
+    import h5py
+
+    with h5py.File(filename, "r") as h5file:
+        n_tasks = int(h5file[group].attrs["n_tasks"])
+        names = _variable_names(h5file[group])
+    outputs = [AnyPyProcessOutput() for _ in range(n_tasks)]
+    for key, column in read_table(filename, group).items():
+        for out, value in zip(outputs, column):
+            if value is not None:
+                out[key] = value
+    for key in names:
+        column = read_variable(filename, key, group)
+        for out, value in zip(outputs, column):
+            if isinstance(value, np.ndarray) and value.ndim == 0:
+                value = value.item()
+            out[key] = value
+    return AnyPyProcessOutputList(outputs)
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+Append-only journal of finished tasks for resuming interrupted batches.
+
+Each task is written to the journal as soon as it finishes, and the file is
+flushed to disk before the next task is handled. The cost of a write only
+depends on the size of the task, not on the size of the batch. If the batch
+is interrupted by a crash, a reboot or Ctrl-C, starting the same batch again
+with the same journal only runs the tasks which are missing::
+
+    >>> app = AnyPyProcess(journal="batch.journal")
+    >>> app.start_macro(macrolist)  # Interrupted after 9000 tasks
+    >>> app.start_macro(macrolist)  # Runs the remaining 1000 tasks
+
+The journal can also be read with ``AnyPyProcess.load_results``.
+
+A record is the pickled result of a task with its length and checksum in
+front. A record which was only partly written when the process stopped is
+detected by the checksum, and is cut off before new records are appended.
+"""
+
+import os
+import json
+import zlib
+import pickle
+import struct
+import threading
+
+from .cache import _strip_exit
+
+__all__ = ["TaskJournal"]
+
+MAGIC = b"AnyPyTools journal 1\n"
+HEADER = struct.Struct("<II")
+
+
+class TaskJournal(object):
+    """Journal where finished tasks are appended one record at a time.
+
+    Parameters
+    ----------
+    filename : str
+        The journal file. It is created when the first task is written.
+    fsync : bool, optional
+        Force each record to the disk with ``os.fsync``. Without it the
+        records survive a crash of Python, but not of the operating system.
+        (Defaults to True)
+    """
+
+    def __init__(self, filename, fsync=True):
+        self.filename = os.path.abspath(os.path.expanduser(filename))
+        self.fsync = fsync
+        self._file = None
+        self._finished_keys = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(task):
+        """Return the key which identifies a task within its batch."""
+        return json.dumps([task.number, task.folder, _strip_exit(task.macro)])
+
+    @classmethod
+    def is_journal(cls, filename):
+        """Return True if `filename` is a journal file."""
+        try:
+            with open(filename, "rb") as f:
+                return f.read(len(MAGIC)) == MAGIC
+        except OSError:
+            return False
+
+    def read(self):
+        """Return the records in the journal.
+
+        Returns
+        -------
+        list of dict
+            The records in the order they were written. A task which was
+            written several times has a record for each time.
+        """
+        records, _ = self._read()
+        return records
+
+    def resume(self, tasklist):
+        """Restore the finished tasks in `tasklist` from the journal.
+
+        Tasks with errors in the journal are not restored, so they run again.
+
+        Returns
+        -------
+        int
+            The number of tasks which were restored.
+        """
+        finished = {}
+        for record in self.read():
+            if record["output"].get("ERROR") or record["processtime"] <= 0:
+                continue
+            finished[record["key"]] = record
+        n_restored = 0
+        for task in tasklist:
+            record = finished.get(self.key(task))
+            if record is None or task.is_finished():
+                continue
+            task.output = record["output"]
+            task.processtime = record["processtime"]
+            task.usage = record["usage"]
+            task.retcode = record["retcode"]
+            task.logfile = ""
+            n_restored += 1
+        with self._lock:
+            self._finished_keys.update(finished)
+        return n_restored
+
+    def append(self, task):
+        """Write a finished task to the journal.
+
+        Tasks which are already in the journal without errors are skipped.
+        """
+        key = self.key(task)
+        is_finished = task.is_finished()
+        with self._lock:
+            if key in self._finished_keys:
+                return
+            record = dict(
+                key=key,
+                number=task.number,
+                folder=task.folder,
+                macro=_strip_exit(task.macro),
+                name=task.name,
+                output=task.output,
+                processtime=task.processtime,
+                usage=task.usage,
+                retcode=task.retcode,
+            )
+            data = pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+            f = self._open()
+            f.write(HEADER.pack(len(data), zlib.crc32(data)) + data)
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+            if is_finished:
+                self._finished_keys.add(key)
+
+    def close(self):
+        """Close the journal file. It is opened again by the next append."""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _open(self):
+        if self._file is not None:
+            return self._file
+        records, end = self._read()
+        f = open(self.filename, "r+b" if end else "wb")
+        if end:
+            # Cut off a record which was only partly written
+            f.truncate(end)
+            f.seek(end)
+        else:
+            f.write(MAGIC)
+        self._finished_keys.update(
+            r["key"]
+            for r in records
+            if not r["output"].get("ERROR") and r["processtime"] > 0
+        )
+        self._file = f
+        return f
+
+    def _read(self):
+        """Return the complete records, and the offset after the last one."""
+        records = []
+        try:
+            f = open(self.filename, "rb")
+        except OSError:
+            return records, 0
+        with f:
+            magic = f.read(len(MAGIC))
+            if magic != MAGIC:
+                if MAGIC.startswith(magic):
+                    # Empty, or stopped while the header was written
+                    return records, 0
+                raise ValueError("{} is not a journal file".format(self.filename))
+            end = f.tell()
+            while True:
+                header = f.read(HEADER.size)
+                if len(header) < HEADER.size:
+                    break
+                length, checksum = HEADER.unpack(header)
+                data = f.read(length)
+                if len(data) < length or zlib.crc32(data) != checksum:
+                    break
+                try:
+                    records.append(pickle.loads(data))
+                except Exception:
+                    break
+                end = f.tell()
+        return records, end
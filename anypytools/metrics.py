@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+"""
+Live metrics of running batches in the Prometheus text format.
+
+:class:`BatchMetrics` is a tracer (see :mod:`anypytools.tracing`), which
+keeps counters and gauges for the tasks of ``AnyPyProcess``. The metrics can
+be served over HTTP for Prometheus to scrape, or written periodically to a
+file for the textfile collector of the node exporter::
+
+    >>> metrics = BatchMetrics()
+    >>> metrics.serve(9108)
+    >>> metrics.write_textfile("/var/lib/node_exporter/anypytools.prom")
+    >>> app = AnyPyProcess(tracers=[metrics])
+    >>> app.start_macro(macrolist)
+
+The exported metrics are:
+
+``anypytools_tasks_queued``
+    Tasks waiting for a worker.
+``anypytools_tasks_running``
+    Tasks being processed.
+``anypytools_tasks_completed_total``
+    Finished tasks, including the failed ones.
+``anypytools_tasks_failed_total``
+    Finished tasks with errors.
+``anypytools_license_retries_total``
+    Tasks which were queued again because no license was available.
+``anypytools_tasks_per_second``
+    Tasks completed per second over the last minute.
+``anypytools_task_duration_seconds``
+    Summary of the time from a worker starts a task until it is finished,
+    with the median and 95th percentile of the recent tasks.
+``anypytools_task_duration_mean_seconds``
+    Mean duration of the recent tasks.
+``anypytools_last_completion_timestamp_seconds``
+    Unix time when the last task was completed. Useful to detect stalls.
+"""
+
+import os
+import math
+import time
+import threading
+import collections
+import socketserver
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+__all__ = ["BatchMetrics"]
+
+
+def _percentile(values, q):
+    """Return the `q` percentile of sorted `values` (nearest rank)."""
+    if not values:
+        return float("nan")
+    rank = int(round(q * (len(values) - 1)))
+    return values[rank]
+
+
+def _format_value(value):
+    value = float(value)
+    if math.isnan(value):
+        return "NaN"
+    return repr(value)
+
+
+class BatchMetrics(object):
+    """Tracer which keeps live metrics of the tasks.
+
+    Parameters
+    ----------
+    window : int, optional
+        Number of recent tasks the duration quantiles and mean are computed
+        from. (Defaults to 1000)
+    rate_interval : float, optional
+        Seconds over which the completion rate is measured. (Defaults to 60)
+    """
+
+    def __init__(self, window=1000, rate_interval=60.0):
+        self.rate_interval = rate_interval
+        self.completed = 0
+        self.failed = 0
+        self.license_retries = 0
+        self.duration_sum = 0.0
+        self.duration_count = 0
+        self.last_completion = None
+        self._queued = set()
+        self._running = {}
+        self._durations = collections.deque(maxlen=window)
+        self._completion_times = collections.deque()
+        self._batch = 0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._servers = []
+
+    def __call__(self, event):
+        with self._lock:
+            if event.name == "batch_started":
+                # Task numbers start over in each batch
+                self._batch += 1
+                self._queued.clear()
+                self._running.clear()
+                return
+            if event.task_id is None:
+                return
+            key = (self._batch, event.task_id)
+            if event.name == "queued":
+                self._queued.add(key)
+            elif event.name == "started":
+                self._queued.discard(key)
+                self._running[key] = event.time
+            elif event.name == "retried":
+                self._running.pop(key, None)
+                self.license_retries += 1
+            elif event.name == "failed":
+                self.failed += 1
+            elif event.name == "finished":
+                self._queued.discard(key)
+                starttime = self._running.pop(key, None)
+                if starttime is not None:
+                    duration = event.time - starttime
+                    self._durations.append(duration)
+                    self.duration_sum += duration
+                    self.duration_count += 1
+                self.completed += 1
+                self.last_completion = time.time()
+                self._completion_times.append(event.time)
+
+    @property
+    def queued(self):
+        return len(self._queued)
+
+    @property
+    def running(self):
+        return len(self._running)
+
+    def rate(self, now=None):
+        """Tasks completed per second over the last `rate_interval` seconds."""
+        if now is None:
+            now = time.perf_counter()
+        with self._lock:
+            times = self._completion_times
+            while times and times[0] < now - self.rate_interval:
+                times.popleft()
+            return len(times) / self.rate_interval
+
+    def to_prometheus(self):
+        """Return the metrics in the Prometheus text format."""
+        rate = self.rate()
+        with self._lock:
+            durations = sorted(self._durations)
+            if durations:
+                mean = sum(durations) / len(durations)
+            else:
+                mean = float("nan")
+            metrics = [
+                ("tasks_queued", "gauge", "Tasks waiting for a worker.", self.queued),
+                ("tasks_running", "gauge", "Tasks being processed.", self.running),
+                (
+                    "tasks_completed_total",
+                    "counter",
+                    "Finished tasks, including the failed ones.",
+                    self.completed,
+                ),
+                (
+                    "tasks_failed_total",
+                    "counter",
+                    "Finished tasks with errors.",
+                    self.failed,
+                ),
+                (
+                    "license_retries_total",
+                    "counter",
+                    "Tasks queued again because no license was available.",
+                    self.license_retries,
+                ),
+                (
+                    "tasks_per_second",
+                    "gauge",
+                    "Tasks completed per second over the last "
+                    "{:g} seconds.".format(self.rate_interval),
+                    rate,
+                ),
+                (
+                    "task_duration_mean_seconds",
+                    "gauge",
+                    "Mean duration of the recent tasks.",
+                    mean,
+                ),
+            ]
+            if self.last_completion is not None:
+                metrics.append(
+                    (
+                        "last_completion_timestamp_seconds",
+                        "gauge",
+                        "Unix time when the last task was completed.",
+                        self.last_completion,
+                    )
+                )
+            lines = []
+            for name, kind, help_text, value in metrics:
+                name = "anypytools_" + name
+                lines.append("# HELP {} {}".format(name, help_text))
+                lines.append("# TYPE {} {}".format(name, kind))
+                lines.append("{} {}".format(name, _format_value(value)))
+            name = "anypytools_task_duration_seconds"
+            lines.append("# HELP {} Duration of the tasks.".format(name))
+            lines.append("# TYPE {} summary".format(name))
+            for q in (0.5, 0.95):
+                lines.append(
+                    '{}{{quantile="{}"}} {}'.format(
+                        name, q, _format_value(_percentile(durations, q))
+                    )
+                )
+            lines.append("{}_sum {}".format(name, _format_value(self.duration_sum)))
+            lines.append("{}_count {}".format(name, self.duration_count))
+        return "\n".join(lines) + "\n"
+
+    def save(self, filename):
+        """Write the metrics to a file.
+
+        The file is replaced in one step, so a reader never sees a partly
+        written file.
+        """
+        tmp_filename = filename + ".tmp"
+        with open(tmp_filename, "w") as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp_filename, filename)
+
+    def write_textfile(self, filename, interval=15.0):
+        """Rewrite the metrics to `filename` every `interval` seconds.
+
+        The file is written from a background thread until :meth:`close`
+        is called.
+        """
+
+        def write():
+            while True:
+                try:
+                    self.save(filename)
+                except OSError:
+                    pass
+                if self._stopped.wait(interval):
+                    return
+
+        thread = threading.Thread(target=write)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def serve(self, port=9108, host="127.0.0.1"):
+        """Serve the metrics over HTTP from a background thread.
+
+        Returns
+        -------
+        HTTPServer
+            The server. ``server.server_address`` gives the port if `port`
+            was 0.
+        """
+        server = _MetricsServer((host, port), _MetricsRequestHandler)
+        server.metrics = self
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self._servers.append(server)
+        return server
+
+    def close(self):
+        """Stop the textfile writer and the HTTP servers."""
+        self._stopped.set()
+        for server in self._servers:
+            server.shutdown()
+            server.server_close()
+        self._servers = []
+
+
+class _MetricsServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = self.server.metrics.to_prometheus().encode("UTF-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes are not logged
+        pass
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+SQLite storage of processed tasks for ``save_results`` and ``load_results``.
+
+Each task is a row in an SQLite database with the pickled task and the
+columns it can be selected by. Appending a batch only writes the new tasks,
+and tasks can be loaded one at a time, or selected by task id, name or a
+predicate on the output, without reading the rest of the file::
+
+    >>> app.save_results("results.sqlite", append=True)
+    >>> store = ResultStore("results.sqlite")
+    >>> len(store)
+    >>> failed = store.load(where=lambda output: "ERROR" in output)
+    >>> for task in store.iter_tasks(names=["model1"]):
+    ...     process(task.get_output())
+"""
+
+import os
+import pickle
+import sqlite3
+import contextlib
+
+__all__ = ["ResultStore"]
+
+SQLITE_MAGIC = b"SQLite format 3\x00"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    row INTEGER PRIMARY KEY,
+    task_id INTEGER,
+    name TEXT,
+    folder TEXT,
+    error INTEGER,
+    processtime REAL,
+    task BLOB
+);
+CREATE INDEX IF NOT EXISTS tasks_task_id ON tasks (task_id);
+CREATE INDEX IF NOT EXISTS tasks_name ON tasks (name);
+"""
+
+# Stay below the default limit on the number of SQL variables
+MAX_VARIABLES = 500
+
+
+def _chunks(values, size):
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i : i + size]
+
+
+class ResultStore(object):
+    """Tasks stored in an SQLite database.
+
+    Parameters
+    ----------
+    filename : str
+        The database file. It is created when tasks are first saved.
+    """
+
+    def __init__(self, filename):
+        self.filename = os.path.abspath(os.path.expanduser(filename))
+
+    @classmethod
+    def is_store(cls, filename):
+        """Return True if `filename` is an SQLite database."""
+        try:
+            with open(filename, "rb") as f:
+                return f.read(len(SQLITE_MAGIC)) == SQLITE_MAGIC
+        except OSError:
+            return False
+
+    def save(self, tasks, append=False):
+        """Write tasks to the database in one transaction.
+
+        Parameters
+        ----------
+        tasks : list of tasks
+            The processed tasks.
+        append : bool, optional
+            If False the tasks already in the database are replaced.
+            (Defaults to False)
+        """
+        rows = (
+            (
+                task.number,
+                str(task.name),
+                str(task.folder),
+                int(task.has_error()),
+                task.processtime,
+                sqlite3.Binary(pickle.dumps(task, protocol=pickle.HIGHEST_PROTOCOL)),
+            )
+            for task in tasks
+        )
+        with self._connect() as con:
+            with con:
+                con.executescript(SCHEMA)
+                if not append:
+                    con.execute("DELETE FROM tasks")
+                con.executemany(
+                    "INSERT INTO tasks "
+                    "(task_id, name, folder, error, processtime, task) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+
+    def iter_tasks(self, task_ids=None, names=None, where=None):
+        """Yield the stored tasks one at a time in the order they were saved.
+
+        Parameters
+        ----------
+        task_ids : list of int, optional
+            Only the tasks with these task ids.
+        names : list of str, optional
+            Only the tasks with these names.
+        where : callable, optional
+            Only the tasks where ``where(task.output)`` is true. The output
+            includes the task information.
+        """
+        if not os.path.isfile(self.filename):
+            raise IOError("No such file: " + self.filename)
+        with self._connect() as con:
+            for data in self._select(con, task_ids, names):
+                task = pickle.loads(data)
+                if where is None or where(task.get_output(True)):
+                    yield task
+
+    def load(self, task_ids=None, names=None, where=None):
+        """Return a list of the stored tasks. See :meth:`iter_tasks`."""
+        return list(self.iter_tasks(task_ids, names, where))
+
+    def __len__(self):
+        if not os.path.isfile(self.filename):
+            return 0
+        with self._connect() as con:
+            return con.execute("SELECT COUNT(*) FROM tasks").fetchone()[0]
+
+    def _select(self, con, task_ids, names):
+        """Yield the pickled tasks, which match the filters."""
+        if task_ids is None and names is None:
+            query = con.execute("SELECT task FROM tasks ORDER BY row")
+            for (data,) in iter(query.fetchone, None):
+                yield data
+            return
+        # Find the matching rows with the indices, then read the tasks
+        rows = None
+        for column, values in (("task_id", task_ids), ("name", names)):
+            if values is None:
+                continue
+            matches = set()
+            for chunk in _chunks(values, MAX_VARIABLES):
+                query = "SELECT row FROM tasks WHERE {} IN ({})".format(
+                    column, ", ".join("?" * len(chunk))
+                )
+                matches.update(row for (row,) in con.execute(query, chunk))
+            rows = matches if rows is None else rows & matches
+        for chunk in _chunks(sorted(rows), MAX_VARIABLES):
+            query = "SELECT task FROM tasks WHERE row IN ({}) ORDER BY row".format(
+                ", ".join("?" * len(chunk))
+            )
+            for (data,) in con.execute(query, chunk):
+                yield data
+
+    @contextlib.contextmanager
+    def _connect(self):
+        con = sqlite3.connect(self.filename)
+        try:
+            yield con
+        finally:
+            con.close()
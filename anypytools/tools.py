@@ -13,11 +13,14 @@ import errno
 import shutil
 import logging
 import textwrap
+import bisect
 import datetime
 import warnings
+import functools
 import platform
 import subprocess
 import collections
+import collections.abc
 import pprint
 from ast import literal_eval
 from _thread import get_ident as _get_ident
@@ -208,19 +211,78 @@ def get_git_commit_info(project_name=None):
     return dict(id=commit, dirty=dirty, project=project_name, branch=branch)
 
 
-def _get_first_key_match(key, names):
-    """Find the first partial match key match.
+class _KeyIndex(object):
+    """Index for finding the first key which contains a partial key.
 
-    If No match if found then key is returned unmodified.
+    All keys are joined in one string, so a partial key is found with one
+    ``str.find`` and a bisection, instead of a scan over the keys. The
+    results are memoized. Indices are shared between all outputs with the
+    same keys, and an ambiguous partial key is only reported once.
     """
-    if key in names:
-        return key
-    matching = [v for v in names if key in v]
-    if not matching:
-        # No match return original key.
-        return key
 
-    if len(matching) > 1:
+    _cache = {}
+    _reported = set()
+    max_cached = 256
+
+    def __init__(self, keys):
+        self.keys = keys
+        self.keyset = frozenset(keys)
+        self.text = "\n".join(keys)
+        self.multiline = any("\n" in key for key in keys)
+        self.starts = []
+        position = 0
+        for key in keys:
+            self.starts.append(position)
+            position += len(key) + 1
+        self.matches = {}
+
+    @classmethod
+    def get(cls, keys):
+        """Return the shared index of a tuple of keys."""
+        index = cls._cache.get(keys)
+        if index is None:
+            if len(cls._cache) >= cls.max_cached:
+                cls._cache.clear()
+            index = cls._cache[keys] = cls(keys)
+        return index
+
+    def lookup(self, key):
+        """Return the first key which contains `key`, or `key` if none does."""
+        try:
+            return self.matches[key]
+        except KeyError:
+            pass
+        if len(self.matches) >= 10000:
+            self.matches.clear()
+        match = self.matches[key] = self._find(key)
+        return match
+
+    def _find(self, key):
+        if key in self.keyset:
+            return key
+        if not key or "\n" in key or self.multiline:
+            matching = [k for k in self.keys if key in k]
+        else:
+            position = self.text.find(key)
+            if position < 0:
+                return key
+            i = bisect.bisect_right(self.starts, position) - 1
+            end = self.starts[i] + len(self.keys[i])
+            if self.text.find(key, end) < 0:
+                return self.keys[i]
+            matching = [k for k in self.keys[i:] if key in k]
+        if not matching:
+            # No match return original key.
+            return key
+        if len(matching) > 1:
+            self._report_ambiguous(key, matching)
+        return matching[0]
+
+    @classmethod
+    def _report_ambiguous(cls, key, matching):
+        if (key, matching[0]) in cls._reported:
+            return
+        cls._reported.add((key, matching[0]))
         print(
             'WARNING: "{}" key is not unique.' " Using the first match".format(key),
             file=sys.stderr,
@@ -229,23 +291,270 @@ def _get_first_key_match(key, names):
         for match in matching[1:]:
             print(" * " + match, file=sys.stderr)
 
-    return matching[0]
 
+def _get_first_key_match(key, names):
+    """Find the first partial match key match.
+
+    If No match if found then key is returned unmodified.
+    """
+    if key in names:
+        return key
+    return _KeyIndex.get(tuple(names)).lookup(key)
+
+
+def _is_numeric(value):
+    if isinstance(value, np.ndarray):
+        return value.dtype.kind in "biufc"
+    return isinstance(value, (int, float, complex, np.number)) and not isinstance(
+        value, bool
+    )
+
+
+def _is_ragged(values):
+    """Return True for arrays which only differ in the length of the first axis."""
+    if not all(isinstance(v, np.ndarray) and v.ndim > 0 for v in values):
+        return False
+    if len(set(v.shape[1:] + (v.ndim,) for v in values)) != 1:
+        return False
+    return len(set(len(v) for v in values)) > 1
+
+
+class RaggedArray(np.lib.mixins.NDArrayOperatorsMixin):
+    """Arrays of different length stored in one flat buffer.
+
+    The arrays are concatenated along their first axis in `values`, and
+    array ``i`` is ``values[offsets[i]:offsets[i + 1]]``. This is how
+    :class:`AnyPyProcessOutputList` returns a variable, where the length of
+    the time series differs between the macros.
+
+    Element wise NumPy operations work on all the values at once, e.g.
+    ``np.sqrt(r)`` or ``r * 2``, and return a new RaggedArray. The
+    reductions (``sum``, ``mean``, ``min``, ``max``) take ``axis=None`` for
+    all values, or ``axis=1`` for one result for each array.
+
+    Parameters
+    ----------
+    values : array_like
+        The concatenated arrays.
+    offsets : array_like
+        The start of each array in `values`, followed by the end of the last.
+
+    Examples
+    --------
+    >>> r = RaggedArray.from_arrays([np.arange(3), np.arange(5)])
+    >>> r[1]
+    array([0, 1, 2, 3, 4])
+    >>> r.mean(axis=1)
+    array([1., 2.])
+    """
+
+    def __init__(self, values, offsets):
+        self.values = np.asarray(values)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        if self.offsets.ndim != 1 or not len(self.offsets):
+            raise ValueError("offsets must be a 1-D array with at least one element")
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """Create a RaggedArray from a list of arrays."""
+        arrays = [np.asarray(a) for a in arrays]
+        offsets = np.zeros(len(arrays) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(a) for a in arrays])
+        if arrays:
+            values = np.concatenate(arrays)
+        else:
+            values = np.zeros(0)
+        return cls(values, offsets)
+
+    @property
+    def lengths(self):
+        """The length of each array."""
+        return np.diff(self.offsets)
 
-class AnyPyProcessOutputList(collections.MutableSequence):
+    @property
+    def dtype(self):
+        return self.values.dtype
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __iter__(self):
+        for start, end in zip(self.offsets[:-1], self.offsets[1:]):
+            yield self.values[start:end]
+
+    def __getitem__(self, i):
+        if isinstance(i, (int, np.integer)):
+            if i < 0:
+                i += len(self)
+            if not 0 <= i < len(self):
+                raise IndexError("index {} is out of range".format(i))
+            return self.values[self.offsets[i] : self.offsets[i + 1]]
+        if isinstance(i, slice) and i.step in (None, 1):
+            start, stop, _ = i.indices(len(self))
+            stop = max(start, stop)
+            offsets = self.offsets[start : stop + 1]
+            values = self.values[offsets[0] : offsets[-1]]
+            return type(self)(values, offsets - offsets[0])
+        return self.from_arrays([self[j] for j in np.arange(len(self))[i]])
+
+    def to_arrays(self):
+        """Return a list with the arrays. The arrays are views of `values`."""
+        return list(self)
+
+    def tolist(self):
+        """Return the arrays as nested lists."""
+        return [a.tolist() for a in self]
+
+    def to_masked(self, fill_value=0):
+        """Return a masked array where the shorter arrays are padded.
+
+        Returns
+        -------
+        np.ma.MaskedArray
+            Array with the shape ``(len(self), max(lengths), ...)``, where the
+            padding is masked.
+        """
+        lengths = self.lengths
+        width = int(lengths.max()) if len(lengths) else 0
+        shape = (len(self), width) + self.values.shape[1:]
+        data = np.full(shape, fill_value, dtype=self.dtype)
+        mask = np.ones(shape, dtype=bool)
+        rows = np.repeat(np.arange(len(self)), lengths)
+        columns = np.arange(len(self.values)) - np.repeat(self.offsets[:-1], lengths)
+        data[rows, columns] = self.values
+        mask[rows, columns] = False
+        return np.ma.MaskedArray(data, mask=mask)
+
+    def _reduce(self, ufunc, axis, empty):
+        if axis is None:
+            return ufunc.reduce(self.values, axis=None)
+        if axis != 1:
+            raise ValueError("Only axis=None and axis=1 are supported")
+        lengths = self.lengths
+        nonempty = lengths > 0
+        result = np.full(
+            (len(self),) + self.values.shape[1:],
+            empty,
+            dtype=np.result_type(self.dtype, np.asarray(empty).dtype),
+        )
+        if nonempty.any():
+            starts = self.offsets[:-1][nonempty]
+            result[nonempty] = ufunc.reduceat(self.values, starts, axis=0)
+        return result
+
+    def sum(self, axis=None):
+        return self._reduce(np.add, axis, 0)
+
+    def min(self, axis=None):
+        return self._reduce(np.minimum, axis, np.nan)
+
+    def max(self, axis=None):
+        return self._reduce(np.maximum, axis, np.nan)
+
+    def mean(self, axis=None):
+        if axis is None:
+            return self.values.mean()
+        total = self.sum(axis).astype(float)
+        lengths = self.lengths.reshape((-1,) + (1,) * (total.ndim - 1))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return total / lengths
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        if method != "__call__" or "out" in kwargs:
+            return NotImplemented
+        offsets = None
+        args = []
+        for x in inputs:
+            if isinstance(x, RaggedArray):
+                if offsets is not None and not np.array_equal(offsets, x.offsets):
+                    raise ValueError("The RaggedArrays have different lengths")
+                offsets = x.offsets
+                args.append(x.values)
+            elif np.ndim(x) == 0:
+                args.append(x)
+            else:
+                return NotImplemented
+        result = getattr(ufunc, method)(*args, **kwargs)
+        if isinstance(result, tuple):
+            return tuple(type(self)(r, offsets) for r in result)
+        return type(self)(result, offsets)
+
+    def __repr__(self):
+        return "RaggedArray({})".format(
+            pprint.pformat(self.to_arrays()).replace("\n", "\n" + " " * 12)
+        )
+
+
+class AnyPyProcessOutputList(collections.abc.MutableSequence):
     """List like class to wrap the output of model simulations.
 
     The class behaves as a normal list but provide
     extra function to easily access data.
+
+    Parameters
+    ----------
+    columnar : bool, optional
+        Keep the numeric variables accessed with a string key stacked in one
+        array per variable. The first access of a variable stacks it, and
+        later accesses return the same array without copying. The arrays in
+        the individual outputs are replaced by views into the stacked
+        array, so the data is stored once in one contiguous block. The
+        stacked arrays are dropped when the list is changed. Assigning new
+        values to the individual outputs is not detected; call
+        :meth:`clear_columns` after doing so. (Defaults to False)
     """
 
-    def __init__(self, *args):
+    columnar = False
+    _columns = None
+
+    def __init__(self, *args, columnar=False):
         self.list = list()
         for elem in args:
             self.extend(list(elem))
+        self.columnar = columnar
+
+    def clear_columns(self):
+        """Drop the stacked arrays of the columnar mode."""
+        self._columns = None
+
+    def _get_column(self, key):
+        """Return the stacked array of a numeric variable, or None."""
+        if self._columns is None:
+            self._columns = {}
+        elif key in self._columns:
+            return self._columns[key]
+        values = []
+        for e in self.list:
+            try:
+                value = _get_value(e, key)
+            except KeyError:
+                return None
+            if not _is_numeric(value):
+                return None
+            values.append(value)
+        dtypes = set(np.asarray(v).dtype for v in values)
+        dtype = functools.reduce(np.promote_types, dtypes)
+        shape = np.shape(values[0])
+        if any(np.shape(v) != shape for v in values):
+            if not _is_ragged(values):
+                return None
+            data = RaggedArray.from_arrays(values)
+            for e, value, view in zip(self.list, values, data):
+                if value.dtype == dtype:
+                    super(AnyPyProcessOutput, e).__setitem__(key, view)
+            self._columns[key] = data
+            return data
+        data = np.empty((len(values),) + shape, dtype=dtype)
+        for i, (e, value) in enumerate(zip(self.list, values)):
+            data[i] = value
+            if isinstance(value, np.ndarray) and value.dtype == dtype:
+                # Share the memory of the stacked array
+                super(AnyPyProcessOutput, e).__setitem__(key, data[i])
+        self._columns[key] = data
+        return data
 
     def check(self, v):
-        if not isinstance(v, collections.MutableSequence):
+        if not isinstance(v, collections.abc.MutableSequence):
             v = [v]
         for e in v:
             if not isinstance(e, collections.OrderedDict):
@@ -257,17 +566,23 @@ class AnyPyProcessOutputList(collections.MutableSequence):
     def __getitem__(self, i):
         if isinstance(i, str):
             # Find the entries where i matches the keys
-            key = _get_first_key_match(i, self.list[0])
+            first = self.list[0]
+            if isinstance(first, AnyPyProcessOutput):
+                key = first._match_key(i)
+            else:
+                key = _get_first_key_match(i, first)
+            if self.columnar:
+                data = self._get_column(key)
+                if data is not None:
+                    return data
             try:
-                data = np.array(
-                    [
-                        super(AnyPyProcessOutput, e).__getitem__(key)
-                        for e in self.list
-                    ]
-                )
+                values = [_get_value(e, key) for e in self.list]
             except KeyError:
                 msg = " The key: '{}' is not present in all elements of the output."
                 raise KeyError(msg.format(key)) from None
+            if _is_ragged(values):
+                return RaggedArray.from_arrays(values)
+            data = np.array(values)
             if data.dtype == np.dtype("O"):
                 # Data will be stacked as an array of objects, if the length of the
                 # time dimension is not consistant across simulations. Warn that some numpy
@@ -279,13 +594,17 @@ class AnyPyProcessOutputList(collections.MutableSequence):
                 )
             return data
         else:
-            return type(self)(self.list[i]) if isinstance(i, slice) else self.list[i]
+            if isinstance(i, slice):
+                return type(self)(self.list[i], columnar=self.columnar)
+            return self.list[i]
 
     def __delitem__(self, i):
+        self._columns = None
         del self.list[i]
 
     def __setitem__(self, i, v):
         self.check(v)
+        self._columns = None
         if isinstance(i, slice):
             self.list[i] = v
         else:
@@ -293,8 +612,14 @@ class AnyPyProcessOutputList(collections.MutableSequence):
 
     def insert(self, i, v):
         self.check(v)
+        self._columns = None
         self.list.insert(i, v)
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop("_columns", None)
+        return state
+
     def __str__(self):
         return str(self.list)
 
@@ -467,21 +792,144 @@ def array2anyscript(arr):
         return str(arr)
 
 
+class _LazyDump(object):
+    """Dumped value which is decoded when it is first accessed."""
+
+    __slots__ = ("name", "raw")
+
+    def __init__(self, name, raw):
+        self.name = name
+        self.raw = raw
+
+    def decode(self):
+        try:
+            return _parse_data(self.raw)
+        except (SyntaxError, ValueError):
+            warnings.warn("\n\nCould not parse console output:\n" + self.name)
+            return self.raw
+
+    def __repr__(self):
+        return "<not decoded: {}>".format(self.name)
+
+
+def _get_value(output, key):
+    """Return the value of an exact key, decoding it if necessary."""
+    value = collections.OrderedDict.__getitem__(output, key)
+    if isinstance(value, _LazyDump):
+        value = value.decode()
+        collections.OrderedDict.__setitem__(output, key, value)
+    return value
+
+
 class AnyPyProcessOutput(collections.OrderedDict):
-    """Subclassed OrderedDict which supports partial key access."""
+    """Subclassed OrderedDict which supports partial key access.
+
+    Dumped values parsed with ``lazy=True`` are decoded the first time they
+    are accessed, and the decoded value replaces the raw text.
+    """
+
+    _key_index = None
+    _has_lazy = False
+
+    def _match_key(self, key):
+        """Return the first key which contains `key`."""
+        if key in self:
+            return key
+        if self._key_index is None:
+            self._key_index = _KeyIndex.get(tuple(self))
+        return self._key_index.lookup(key)
 
     def __getitem__(self, key):
         try:
-            return super(AnyPyProcessOutput, self).__getitem__(key)
+            return _get_value(self, key)
         except KeyError:
-            key = _get_first_key_match(key, super(AnyPyProcessOutput, self).keys())
+            key = self._match_key(key)
 
         try:
-            return super(AnyPyProcessOutput, self).__getitem__(key)
+            return _get_value(self, key)
         except KeyError:
             msg = "The key {} could not be found in the data".format(key)
             raise KeyError(msg) from None
 
+    def __setitem__(self, key, value):
+        if self._key_index is not None and key not in self:
+            self._key_index = None
+        if isinstance(value, _LazyDump):
+            self._has_lazy = True
+        super(AnyPyProcessOutput, self).__setitem__(key, value)
+
+    def _decode_all(self):
+        """Decode the values which are not decoded yet."""
+        if not self._has_lazy:
+            return
+        for key, value in super(AnyPyProcessOutput, self).items():
+            if isinstance(value, _LazyDump):
+                # Replacing the values of existing keys is safe while iterating
+                super(AnyPyProcessOutput, self).__setitem__(key, value.decode())
+        self._has_lazy = False
+
+    def get(self, key, default=None):
+        if key in self:
+            return _get_value(self, key)
+        return default
+
+    def values(self):
+        self._decode_all()
+        return super(AnyPyProcessOutput, self).values()
+
+    def items(self):
+        self._decode_all()
+        return super(AnyPyProcessOutput, self).items()
+
+    def __eq__(self, other):
+        self._decode_all()
+        if isinstance(other, AnyPyProcessOutput):
+            other._decode_all()
+        return super(AnyPyProcessOutput, self).__eq__(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __delitem__(self, key):
+        self._key_index = None
+        super(AnyPyProcessOutput, self).__delitem__(key)
+
+    def pop(self, *args):
+        self._key_index = None
+        value = super(AnyPyProcessOutput, self).pop(*args)
+        if isinstance(value, _LazyDump):
+            value = value.decode()
+        return value
+
+    def popitem(self, *args, **kwargs):
+        self._key_index = None
+        return super(AnyPyProcessOutput, self).popitem(*args, **kwargs)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self._key_index = None
+        return super(AnyPyProcessOutput, self).setdefault(key, default)
+
+    def move_to_end(self, *args, **kwargs):
+        self._key_index = None
+        super(AnyPyProcessOutput, self).move_to_end(*args, **kwargs)
+
+    def clear(self):
+        self._key_index = None
+        super(AnyPyProcessOutput, self).clear()
+
+    def __reduce__(self):
+        # The key index is not pickled or copied
+        self._decode_all()
+        reduced = list(super(AnyPyProcessOutput, self).__reduce__())
+        if reduced[2]:
+            reduced[2] = {
+                k: v
+                for k, v in reduced[2].items()
+                if k not in ("_key_index", "_has_lazy")
+            }
+        return tuple(reduced)
+
     def _repr_gen(self, prefix):
         items = self.items()
         if not items:
@@ -523,9 +971,89 @@ class AnyPyProcessOutput(collections.OrderedDict):
 TRIPEL_QUOTE_WRAP = re.compile(r'([^\[\]",\s]+)')
 
 
+# Kind of each character in a numeric dump
+OTHER, NUMBER, OPEN, CLOSE, COMMA = range(5)
+CHAR_KINDS = np.full(256, OTHER, dtype=np.uint8)
+CHAR_KINDS[np.frombuffer(b"-+0123456789.eE", dtype=np.uint8)] = NUMBER
+CHAR_KINDS[ord("{")] = OPEN
+CHAR_KINDS[ord("}")] = CLOSE
+CHAR_KINDS[ord(",")] = COMMA
+IS_DIGIT = np.zeros(256, dtype=bool)
+IS_DIGIT[np.frombuffer(b"0123456789", dtype=np.uint8)] = True
+DELETE_SPACE = str.maketrans("", "", " \t\r\n")
+DELETE_BRACES = str.maketrans("", "", "{}")
+
+
+def _skeleton(shape):
+    """Return the braces and commas of an array with `shape` in AnyBody format."""
+    skeleton = "{" + "," * (shape[-1] - 1) + "}"
+    for n in reversed(shape[:-1]):
+        skeleton = "{" + ",".join([skeleton] * n) + "}"
+    return skeleton
+
+
+def _parse_numeric(val):
+    """Convert a dump of a numeric array without a detour over Python lists.
+
+    The characters are checked and the shape is found from the braces with
+    array operations, and the numbers are converted in one NumPy call.
+    Returns None for anything but a regular array of numbers, which is then
+    left to ``literal_eval``.
+    """
+    try:
+        chars = val.translate(DELETE_SPACE).encode("ascii")
+    except UnicodeEncodeError:
+        return None
+    chars = np.frombuffer(chars, dtype=np.uint8)
+    kinds = CHAR_KINDS[chars]
+    number, opening, closing = kinds == NUMBER, kinds == OPEN, kinds == CLOSE
+    comma = kinds == COMMA
+    # Look for other characters, empty groups and missing or misplaced numbers
+    before, after = opening | comma, closing | comma
+    misplaced = before[:-1] & after[1:]
+    misplaced |= closing[:-1] & number[1:]
+    misplaced |= number[:-1] & opening[1:]
+    if (kinds == OTHER).any() or misplaced.any():
+        return None
+    skeleton = chars[~number].tobytes().decode("ascii")
+    ndim = len(skeleton) - len(skeleton.lstrip("{"))
+    # Length of the first group at each depth, from the innermost out
+    shape = []
+    inner_length = None
+    for depth in reversed(range(ndim)):
+        end = skeleton.find("}" * (ndim - depth))
+        if end < 0:
+            return None
+        length = end + (ndim - depth) - depth
+        if inner_length is None:
+            shape.append(skeleton.count(",", depth, end) + 1)
+        else:
+            shape.append((length - 1) // (inner_length + 1))
+        inner_length = length
+    shape.reverse()
+    if _skeleton(shape) != skeleton:
+        return None
+    # Integers with leading zeros are not valid Python literals
+    starts = np.flatnonzero(number[1:] & ~number[:-1]) + 1
+    signed = (chars[starts] == ord("-")) | (chars[starts] == ord("+"))
+    starts += signed & number[starts + 1]
+    if ((chars[starts] == ord("0")) & IS_DIGIT[chars[starts + 1]]).any():
+        return None
+    numbers = val.translate(DELETE_BRACES).split(",")
+    is_float = "." in val or "e" in val or "E" in val
+    try:
+        data = np.array(numbers, dtype=float if is_float else int)
+    except (ValueError, OverflowError):
+        return None
+    return data.reshape(shape)
+
+
 def _parse_data(val):
     """Convert a str AnyBody data repr into Numpy array."""
     if val.startswith("{") and val.endswith("}"):
+        data = _parse_numeric(val)
+        if data is not None:
+            return data
         val = val.replace("{", "[").replace("}", "]")
     try:
         out = literal_eval(val)
@@ -557,6 +1085,10 @@ def correct_dump_prefix(raw, idx):
     # The -1000 hack is to avoid coping large strings in memory,
     # since we really only need to access the previous line.
     dumpline = raw[max(0, idx - 1000) : idx].strip().rsplit("\n", 1)[-1]
+    return _macro_command_prefix(dumpline)
+
+
+def _macro_command_prefix(dumpline):
     if dumpline.startswith("#### Macro command"):
         m = NAME_PATTERN.search(dumpline)
         if m:
@@ -570,55 +1102,166 @@ WARNING_PATTERN = re.compile(r"^(WARNING).*$", flags=re.IGNORECASE | re.M)
 DUMP_PATTERN = re.compile(r"^(Main.*?)\s=\s(.*?(?:\n\s\s.*?)*);", flags=re.M)
 
 
+class AnyBodyConOutputParser(object):
+    """Incremental parser for the output of the AnyBody console application.
+
+    Lines are fed to the parser while the console produces them, and the
+    result is the same as :func:`parse_anybodycon_output` gives for the complete
+    log. Only the lines of the dump being read are held in memory.
+
+    Parameters
+    ----------
+    errors_to_ignore : list of str, optional
+        Errors which contain any of these substrings are ignored.
+    warnings_to_include : list of str, optional
+        Warnings which contain any of these substrings are included in the
+        output.
+    fatal_warnings : bool, optional
+        Also add the included warnings to the list of errors.
+    lazy : bool, optional
+        Keep the text of the dumped values, and only decode a value when it
+        is first accessed in the output. (Defaults to False)
+
+    Examples
+    --------
+    >>> parser = AnyBodyConOutputParser()
+    >>> for line in logfile:
+    ...     parser.feed(line)
+    >>> output = parser.finish()
+
+    """
+
+    def __init__(
+        self,
+        errors_to_ignore=None,
+        warnings_to_include=None,
+        fatal_warnings=False,
+        lazy=False,
+    ):
+        self.errors_to_ignore = errors_to_ignore or []
+        self.warnings_to_include = warnings_to_include or []
+        self.fatal_warnings = fatal_warnings
+        self.lazy = lazy
+        self.output = AnyPyProcessOutput()
+        self.errors = []
+        self.warnings = []
+        self._warning_errors = []
+        self._prefix_replacement = ("", "")
+        self._last_line = ""
+        self._dump_lines = None
+
+    def feed(self, line):
+        """Parse the next line of console output."""
+        line = line.rstrip("\r\n")
+        if self._dump_lines is not None:
+            if line[:2].isspace() and len(line) > 1:
+                # Values which span several lines are indented
+                self._dump_lines.append(line)
+                if ";" in line:
+                    self._end_dump()
+                return
+            self._end_dump()
+        if line.startswith("Main"):
+            self._dump_lines = [line]
+            if ";" in line:
+                self._end_dump()
+            return
+        if ERROR_PATTERN.match(line):
+            self.add_error(line)
+        elif WARNING_PATTERN.match(line):
+            self.add_warning(line)
+        if line.strip():
+            self._last_line = line.rstrip()
+
+    def _end_dump(self):
+        lines, self._dump_lines = self._dump_lines, None
+        dump = DUMP_PATTERN.match("\n".join(lines))
+        if dump:
+            prefix = _macro_command_prefix(self._last_line)
+            self.add_dump(dump.group(1), dump.group(2), prefix)
+        for line in reversed(lines):
+            if line.strip():
+                self._last_line = line.rstrip()
+                break
+
+    def add_dump(self, name, value, new_prefix=None):
+        """Add a dumped variable to the output.
+
+        `new_prefix` is the name given in the macro command which made the
+        dump. It replaces the name the console reports for the variable.
+        """
+        if new_prefix:
+            self._prefix_replacement = (name, new_prefix)
+        name = name.replace(*self._prefix_replacement)
+        value = _LazyDump(name, value)
+        if not self.lazy:
+            value = value.decode()
+        self.output[name] = value
+
+    def _is_ignored(self, error_line):
+        return any(ignored_err in error_line for ignored_err in self.errors_to_ignore)
+
+    def add_error(self, error_line):
+        """Add an error unless it matches one of the errors to ignore."""
+        if not self._is_ignored(error_line):
+            self.errors.append(error_line)
+
+    def add_warning(self, warning_line):
+        """Add a warning if it matches one of the warnings to include."""
+        for case in self.warnings_to_include:
+            if case in warning_line:
+                if self.fatal_warnings and not self._is_ignored(warning_line):
+                    # Fatal warnings are listed after the errors
+                    self._warning_errors.append(warning_line)
+                self.warnings.append(warning_line)
+                break
+
+    @property
+    def has_error(self):
+        """True if the output parsed so far contains an error."""
+        return bool(self.errors or self._warning_errors)
+
+    def finish(self):
+        """Return the parsed output when all lines are fed to the parser."""
+        if self._dump_lines is not None:
+            self._end_dump()
+        self.errors.extend(self._warning_errors)
+        self._warning_errors = []
+        if self.errors:
+            self.output["ERROR"] = self.errors
+        if self.warnings:
+            self.output["WARNING"] = self.warnings
+        return self.output
+
+
 def parse_anybodycon_output(
-    raw, errors_to_ignore=None, warnings_to_include=None, fatal_warnings=False
+    raw,
+    errors_to_ignore=None,
+    warnings_to_include=None,
+    fatal_warnings=False,
+    lazy=False,
 ):
     """ Parse the output log file from AnyBodyConsole to
         for data, errors and warnings. If fatal_warnins is
         True, then warnings are also added to the error list.
+        With lazy the dumped values are only decoded when
+        they are accessed. Then only the text of each value
+        is kept, so `raw` is not referenced by the output.
     """
-    warnings_to_include = warnings_to_include or []
-    errors_to_ignore = errors_to_ignore or []
-    output = AnyPyProcessOutput()
+    parser = AnyBodyConOutputParser(
+        errors_to_ignore, warnings_to_include, fatal_warnings, lazy
+    )
     # Find all data in logfile
-    prefix_replacement = ("", "")
     for dump in DUMP_PATTERN.finditer(raw):
-        name, val = dump.group(1), dump.group(2)
         new_prefix = correct_dump_prefix(raw, dump.start())
-        if new_prefix:
-            prefix_replacement = (name, new_prefix)
-        name = name.replace(*prefix_replacement)
-        try:
-            val = _parse_data(dump.group(2))
-        except (SyntaxError, ValueError):
-            warnings.warn("\n\nCould not parse console output:\n" + name)
-        output[name] = val
-    error_list = []
-
-    def _add_non_ignored_errors(error_line):
-        for ignored_err in errors_to_ignore:
-            if ignored_err in error_line:
-                break
-        else:
-            error_list.append(error_line)
-
+        parser.add_dump(dump.group(1), dump.group(2), new_prefix)
     # Find all errors in logfile
     for match in ERROR_PATTERN.finditer(raw):
-        _add_non_ignored_errors(match.group(0))
+        parser.add_error(match.group(0))
     # Find all warnings in logfile
-    warning_list = []
     for match in WARNING_PATTERN.finditer(raw):
-        for case in warnings_to_include:
-            if case in match.group(0):
-                if fatal_warnings:
-                    _add_non_ignored_errors(match.group(0))
-                warning_list.append(match.group(0))
-                break
-    if error_list:
-        output["ERROR"] = error_list
-    if warning_list:
-        output["WARNING"] = warning_list
-    return output
+        parser.add_warning(match.group(0))
+    return parser.finish()
 
 
 def get_ncpu():
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""
+Trace events for following the tasks of ``AnyPyProcess`` through a batch.
+
+``AnyPyProcess`` calls its ``tracers`` with a :class:`TraceEvent` at each
+phase of a task. A tracer is any callable which takes the event. The
+:class:`ChromeTraceWriter` collects the events and saves them in the Chrome
+trace format, which can be opened in ``chrome://tracing`` or
+https://ui.perfetto.dev::
+
+    >>> app = AnyPyProcess(tracers=[ChromeTraceWriter("trace.json")])
+    >>> app.start_macro(macrolist)
+
+The events of a task are:
+
+``queued``
+    The batch was started and the task waits for a worker. Sent again when
+    the task is queued for a retry.
+``started``
+    A worker thread started the task.
+``macro_written``
+    The macro file was written.
+``spawned``
+    The console was started. With ``use_sessions`` this is when a console
+    with the model loaded is ready.
+``first_output``
+    The first line of output was received. Only when the output is read
+    through a pipe (``stream_output``).
+``exited``
+    The console exited. With ``use_sessions`` this is when the commands of
+    the task are done.
+``parsed``
+    The output was parsed.
+``cleaned``
+    The log file was removed, if it is not kept.
+``retried``
+    The console could not get a license. The task is queued again later.
+``failed``
+    The finished task has errors. Sent just before ``finished``.
+``finished``
+    The scheduler received the finished task.
+
+Events which are not tied to a task have ``task_id`` None:
+``batch_started``, ``cleanup_logfiles_started``,
+``cleanup_logfiles_finished`` and ``batch_finished``.
+"""
+
+import os
+import json
+import threading
+import collections
+
+__all__ = ["TraceEvent", "ChromeTraceWriter"]
+
+
+TraceEvent = collections.namedtuple(
+    "TraceEvent", ["name", "time", "task_id", "task_name", "thread"]
+)
+TraceEvent.__doc__ = """A phase of a task or a batch.
+
+The `time` is from ``time.perf_counter()`` and `thread` is the identifier of
+the thread which emitted the event.
+"""
+
+# Names of the spans which end with an event
+SPAN_NAMES = {
+    "started": "queue",
+    "macro_written": "write macro",
+    "spawned": "spawn",
+    "first_output": "startup",
+    "exited": "run",
+    "parsed": "parse",
+    "cleaned": "cleanup",
+    "finished": "handoff",
+}
+
+
+class ChromeTraceWriter(object):
+    """Tracer which saves the events in the Chrome trace format.
+
+    Each task is shown as a span on the thread which ran it, divided into
+    spans for each phase. Phases which cross threads, like the wait in the
+    queue, are shown as async spans.
+
+    Parameters
+    ----------
+    filename : str, optional
+        File which the trace is saved to when a batch finishes. If not given
+        the trace is only saved by calling :meth:`save`.
+    """
+
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.events = []
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        with self._lock:
+            self.events.append(event)
+        if event.name == "batch_finished" and self.filename is not None:
+            self.save()
+
+    def save(self, filename=None):
+        """Save the trace as JSON."""
+        if filename is None:
+            filename = self.filename
+        with open(filename, "w") as f:
+            json.dump(self.to_chrome_trace(), f)
+
+    def to_chrome_trace(self):
+        """Return the collected events as a Chrome trace dictionary."""
+        with self._lock:
+            events = sorted(self.events, key=lambda e: e.time)
+        if not events:
+            return {"traceEvents": [], "displayTimeUnit": "ms"}
+        pid = os.getpid()
+        start = events[0].time
+
+        def timestamp(t):
+            return 1e6 * (t - start)
+
+        trace = []
+        thread_ids = {}
+
+        def tid(thread):
+            if thread not in thread_ids:
+                thread_ids[thread] = len(thread_ids)
+            return thread_ids[thread]
+
+        # Task numbers start over in each batch
+        by_task = collections.OrderedDict()
+        batch_open = {}
+        n_batches = 0
+        for event in events:
+            if event.task_id is not None:
+                by_task.setdefault((n_batches, event.task_id), []).append(event)
+                continue
+            if event.name == "batch_started":
+                n_batches += 1
+            span, _, state = event.name.rpartition("_")
+            if state == "started":
+                batch_open[span] = event
+            elif state == "finished" and span in batch_open:
+                begin = batch_open.pop(span)
+                trace.append(
+                    dict(
+                        name=span,
+                        cat="batch",
+                        ph="X",
+                        ts=timestamp(begin.time),
+                        dur=timestamp(event.time) - timestamp(begin.time),
+                        pid=pid,
+                        tid=tid(event.thread),
+                    )
+                )
+        async_id = 0
+        for task_events in by_task.values():
+            args = dict(task=task_events[0].task_name, id=task_events[0].task_id)
+            # The whole task on the thread that ran it
+            worker = [e for e in task_events if e.name == "started"]
+            if worker:
+                on_worker = [e for e in task_events if e.thread == worker[-1].thread]
+                begin = worker[-1]
+                trace.append(
+                    dict(
+                        name=str(begin.task_name),
+                        cat="task",
+                        ph="X",
+                        ts=timestamp(begin.time),
+                        dur=timestamp(on_worker[-1].time) - timestamp(begin.time),
+                        pid=pid,
+                        tid=tid(begin.thread),
+                        args=args,
+                    )
+                )
+            for previous, event in zip(task_events, task_events[1:]):
+                name = SPAN_NAMES.get(event.name, event.name)
+                if previous.thread == event.thread:
+                    trace.append(
+                        dict(
+                            name=name,
+                            cat="phase",
+                            ph="X",
+                            ts=timestamp(previous.time),
+                            dur=timestamp(event.time) - timestamp(previous.time),
+                            pid=pid,
+                            tid=tid(event.thread),
+                            args=args,
+                        )
+                    )
+                    continue
+                async_id += 1
+                for phase, e in (("b", previous), ("e", event)):
+                    trace.append(
+                        dict(
+                            name=name,
+                            cat="phase",
+                            ph=phase,
+                            id=async_id,
+                            ts=timestamp(e.time),
+                            pid=pid,
+                            tid=tid(e.thread),
+                            args=args,
+                        )
+                    )
+        for thread, number in thread_ids.items():
+            if thread == threading.main_thread().ident:
+                thread_name = "scheduler"
+            else:
+                thread_name = "worker {}".format(number)
+            trace.append(
+                dict(
+                    name="thread_name",
+                    ph="M",
+                    pid=pid,
+                    tid=number,
+                    args=dict(name=thread_name),
+                )
+            )
+        return {"traceEvents": trace, "displayTimeUnit": "ms"}
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+End-to-end benchmarks of the AnyPyTools scheduler and output parser.
+
+The benchmarks use the fake console in ``anypytools.fake_anybodycon``, so
+they run without an AnyBody installation. The results are compared with the
+stored baseline in ``baseline.json``::
+
+    python benchmarks/bench_anypytools.py
+    python benchmarks/bench_anypytools.py --quick
+    python benchmarks/bench_anypytools.py --save-baseline
+
+Measured for different ``num_processes``, batch sizes and dump sizes:
+
+throughput
+    Finished tasks per second.
+overhead
+    Wall time per task in milliseconds. The in-process fake console has no
+    run time, so this is the cost of the Python side of AnyPyTools.
+memory
+    Peak memory allocated by Python per task in kB.
+parse
+    Time in milliseconds to parse the log of one task.
+
+The script exits with code 1 if a metric is worse than the baseline by more
+than the tolerance.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import tracemalloc
+
+import anypytools
+from anypytools import AnyPyProcess, fake_anybodycon
+from anypytools.executors import FakeExecutor
+from anypytools.tools import parse_anybodycon_output
+
+BASELINE_FILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "baseline.json"
+)
+
+# Metrics where a higher value is better. For all others lower is better.
+HIGHER_IS_BETTER = ("throughput",)
+
+
+def write_model(folder, dump_rows):
+    with open(os.path.join(folder, "model.main.any"), "w") as model:
+        model.write("Main = {\n")
+        model.write("  AnyVar a = 1;\n")
+        model.write("  AnyFloat Out = fake_array({}, 3);\n".format(dump_rows))
+        model.write("};\n")
+
+
+def create_macros(n_tasks):
+    return [
+        [
+            'load "model.main.any"',
+            'classoperation Main.a "Set Value" --value="{}"'.format(i),
+            "operation Main.Study.InverseDynamics",
+            "run",
+            'classoperation Main.a "Dump"',
+            'classoperation Main.Out "Dump"',
+        ]
+        for i in range(n_tasks)
+    ]
+
+
+def run_batch(folder, n_tasks, num_processes, executor, trace_memory=False):
+    app = AnyPyProcess(
+        num_processes=num_processes,
+        anybodycon_path=fake_anybodycon.__file__,
+        executor=executor,
+        silent=True,
+        launch_interval=0,
+    )
+    macros = create_macros(n_tasks)
+    if trace_memory:
+        tracemalloc.start()
+    starttime = time.perf_counter()
+    output = app.start_macro(macros, folderlist=[folder])
+    elapsed = time.perf_counter() - starttime
+    peak = None
+    if trace_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    n_errors = sum("ERROR" in result for result in output)
+    if n_errors:
+        raise RuntimeError("{} tasks failed in the benchmark".format(n_errors))
+    return elapsed, peak
+
+
+def bench_scheduler(folder, configs, results):
+    for num_processes, n_tasks, dump_rows in configs:
+        write_model(folder, dump_rows)
+        name = "scheduler/np={}/n={}/rows={}".format(num_processes, n_tasks, dump_rows)
+        elapsed, _ = run_batch(folder, n_tasks, num_processes, FakeExecutor())
+        results[name + "/throughput"] = n_tasks / elapsed
+        results[name + "/overhead"] = 1000.0 * elapsed / n_tasks
+        _, peak = run_batch(
+            folder, n_tasks, num_processes, FakeExecutor(), trace_memory=True
+        )
+        results[name + "/memory"] = peak / 1024.0 / n_tasks
+
+
+def bench_subprocess(folder, configs, results):
+    for num_processes, n_tasks in configs:
+        write_model(folder, 10)
+        name = "subprocess/np={}/n={}".format(num_processes, n_tasks)
+        elapsed, _ = run_batch(folder, n_tasks, num_processes, None)
+        results[name + "/throughput"] = n_tasks / elapsed
+        results[name + "/overhead"] = 1000.0 * elapsed * num_processes / n_tasks
+
+
+def bench_parse(folder, dump_sizes, results):
+    for dump_rows in dump_sizes:
+        write_model(folder, dump_rows)
+        log = os.path.join(folder, "parse.log")
+        with open(log, "w") as logfile:
+            FakeExecutor(n_warnings=5).execute(
+                create_macros(1)[0], logfile, folder=folder
+            )
+        with open(log) as logfile:
+            text = logfile.read()
+        n_repeat = max(1, int(2000 / dump_rows))
+        starttime = time.perf_counter()
+        for _ in range(n_repeat):
+            parse_anybodycon_output(text)
+        elapsed = (time.perf_counter() - starttime) / n_repeat
+        results["parse/rows={}".format(dump_rows)] = 1000.0 * elapsed
+
+
+def run_benchmarks(quick=False, use_subprocess=True):
+    if quick:
+        scheduler_configs = [(1, 100, 10), (4, 100, 10), (4, 100, 1000)]
+        subprocess_configs = [(4, 8)]
+        dump_sizes = [10, 1000]
+    else:
+        scheduler_configs = [
+            (num_processes, n_tasks, dump_rows)
+            for num_processes in (1, 4, 8)
+            for n_tasks in (100, 400)
+            for dump_rows in (10, 500)
+        ]
+        subprocess_configs = [(1, 10), (4, 40), (8, 80)]
+        dump_sizes = [10, 1000, 10000]
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        bench_scheduler(folder, scheduler_configs, results)
+        if use_subprocess:
+            bench_subprocess(folder, subprocess_configs, results)
+        bench_parse(folder, dump_sizes, results)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Print the results next to the baseline. Returns the regressions."""
+    regressions = []
+    print(
+        "{:50s} {:>12s} {:>12s} {:>8s}".format(
+            "benchmark", "result", "baseline", "ratio"
+        )
+    )
+    for name, value in sorted(results.items()):
+        reference = baseline.get(name)
+        if reference is None:
+            print("{:50s} {:12.4g} {:>12s}".format(name, value, "-"))
+            continue
+        ratio = value / reference if reference else float("inf")
+        if name.endswith(HIGHER_IS_BETTER):
+            worse = ratio < 1.0 / (1.0 + tolerance)
+        else:
+            worse = ratio > 1.0 + tolerance
+        flag = "  <-- regression" if worse else ""
+        print(
+            "{:50s} {:12.4g} {:12.4g} {:8.2f}{}".format(
+                name, value, reference, ratio, flag
+            )
+        )
+        if worse:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--quick", action="store_true", help="Run a smaller set")
+    parser.add_argument(
+        "--no-subprocess",
+        action="store_true",
+        help="Skip the benchmarks which start the fake console as a subprocess",
+    )
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="Baseline file")
+    parser.add_argument(
+        "--save-baseline", action="store_true", help="Store the results as baseline"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.3,
+        help="Allowed relative change before a result is a regression",
+    )
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.quick, not args.no_subprocess)
+
+    stored = {}
+    if os.path.isfile(args.baseline):
+        with open(args.baseline) as baseline_file:
+            stored = json.load(baseline_file)
+    regressions = compare(results, stored.get("results", {}), args.tolerance)
+    if args.save_baseline:
+        stored_results = stored.get("results", {})
+        stored_results.update(results)
+        stored = dict(
+            anypytools=anypytools.__version__,
+            python=platform.python_version(),
+            platform=platform.platform(),
+            processor=platform.processor() or platform.machine(),
+            cpu_count=os.cpu_count(),
+            results=stored_results,
+        )
+        with open(args.baseline, "w") as baseline_file:
+            json.dump(stored, baseline_file, indent=2, sort_keys=True)
+        print("Baseline saved to " + args.baseline)
+    elif regressions:
+        print("{} benchmarks are slower than the baseline".format(len(regressions)))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
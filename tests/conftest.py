@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+"""Fixtures for the tests, which run models with the fake console."""
+import pytest
+
+
+@pytest.fixture()
+def init_fake_model(tmpdir):
+    """Change to a folder with a model for the fake console."""
+    tmpdir.join("model.main.any").write("Main = {\n  AnyVar a = 1;\n};\n")
+    with tmpdir.as_cwd():
+        yield tmpdir
+
+
+def _create_macros(values, *commands):
+    return [
+        [
+            'load "model.main.any"',
+            'classoperation Main.a "Set Value" --value="{}"'.format(i),
+            'classoperation Main.a "Dump"',
+        ]
+        + list(commands)
+        for i in values
+    ]
+
+
+@pytest.fixture()
+def create_macros():
+    """Function which returns a macro for each value, which sets and dumps
+    ``Main.a``. Extra macro commands are added to all macros."""
+    return _create_macros
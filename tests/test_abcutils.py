@@ -4,13 +4,24 @@ Created on Sun Jul 06 19:09:58 2014
 
 @author: Morten
 """
+import gc
+import io
 import os
+import sys
+import time
+import asyncio
 import shutil
+import threading
+import subprocess
 import pytest
 
 
-from anypytools.abcutils import AnyPyProcess
+from anypytools.abcutils import AnyPyProcess, _Task, _Summery, _wait_for_process
+from anypytools.abcutils import execute_anybodycon, _write_returncode_message
+from anypytools.abcutils import execute_anybodycon_async, _subprocess_container
+from anypytools.abcutils import _split_fused_log
 from anypytools.abcutils import AnyPyProcessOutputList
+from anypytools import fake_anybodycon
 
 demo_model_path = os.path.join(os.path.dirname(__file__), "Demo.Arm2D.any")
 
@@ -77,6 +88,29 @@ class TestAnyPyProcess:
         assert "Main.ArmModel.GlobalRef.t" in output[0]
         assert "ERROR" not in output[0]
 
+    def test_start_macro_stream_output(self, init_simple_model, default_macro):
+        app = AnyPyProcess(silent=True, stream_output=True, write_logfiles=False)
+
+        default_macro[0].append('classoperation Main.ArmModel.GlobalRef.t "Dump"')
+        default_macro.append(['load "not_a_model.any"'])
+        output = app.start_macro(default_macro)
+
+        assert "Main.ArmModel.GlobalRef.t" in output[0]
+        assert "ERROR" not in output[0]
+        assert "ERROR" in output[1]
+        assert not any(fn.endswith((".log", ".anymcr")) for fn in os.listdir())
+
+    def test_start_macro_max_errors(self, init_simple_model, default_macro):
+        app = AnyPyProcess(silent=True, num_processes=1, max_errors=1)
+
+        macro = [['load "not_a_model.any"']] + default_macro * 4
+        output = app.start_macro(macro)
+
+        assert len(output) == 5
+        for result in output:
+            assert "ERROR" in result
+        assert "Not run" in output[-1]["ERROR"][0]
+
     def test_start_macro_with_task_info(self, init_simple_model, default_macro):
         app = AnyPyProcess(silent=True, return_task_info=True)
 
@@ -98,6 +132,30 @@ class TestAnyPyProcess:
         assert "task_macro" in output[0]
         assert "task_logfile" in output[0]
 
+    def test_start_macro_async(self, init_simple_model, default_macro):
+        app = AnyPyProcess(silent=True, num_processes=2)
+        loop = asyncio.new_event_loop()
+        try:
+            output = loop.run_until_complete(app.start_macro_async(default_macro * 3))
+        finally:
+            loop.close()
+
+        assert isinstance(output, AnyPyProcessOutputList)
+        assert len(output) == 3
+        for result in output:
+            assert "ERROR" not in result
+
+    def test_imap_macro(self, init_simple_model, default_macro):
+        app = AnyPyProcess(silent=True, num_processes=2, return_task_info=True)
+
+        results = list(app.imap_macro(default_macro * 4))
+        assert [r["task_id"] for r in results] == [0, 1, 2, 3]
+
+        results = list(app.imap_macro(default_macro * 4, ordered=False))
+        assert sorted(r["task_id"] for r in results) == [0, 1, 2, 3]
+        for result in results:
+            assert "ERROR" not in result
+
     def test_start_macro_subdirs(self, tmpdir, default_macro):
         number_of_models = 5
         setup_models_in_subdirs(tmpdir, number_of_models)
@@ -226,5 +284,300 @@ class TestAnyPyProcess:
             assert "ERROR" not in result
 
 
+def test_wait_for_process():
+    proc = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)"])
+    starttime = time.monotonic()
+    assert not _wait_for_process(proc, 0.2)
+    assert time.monotonic() - starttime < 5
+    proc.terminate()
+    proc.wait()
+
+    proc = subprocess.Popen([sys.executable, "-c", "import sys; sys.exit(3)"])
+    assert _wait_for_process(proc, 30)
+    assert proc.returncode == 3
+
+
+def test_scheduler_overhead():
+    n_tasks = 5000
+
+    def worker(task, task_queue):
+        task_queue.put(task)
+
+    app = AnyPyProcess(silent=True, num_processes=4)
+    app.summery = _Summery(silent=True)
+    tasklist = [_Task(os.getcwd(), number=i) for i in range(n_tasks)]
+    process_time = app._schedule_processes(tasklist, worker)
+    pool = app._worker_pool
+    # The scheduling overhead should be micro seconds per task
+    assert process_time / n_tasks < 1e-3
+
+    app._schedule_processes(tasklist, worker)
+    assert app._worker_pool is pool
+    assert pool.num_workers == 4
+
+
+def test_worker_threads_stop_with_app(init_fake_model, create_macros):
+    n_threads = threading.active_count()
+    for _ in range(10):
+        app = AnyPyProcess(
+            silent=True, num_processes=4, anybodycon_path=fake_anybodycon.__file__
+        )
+        app.start_macro(create_macros(range(4)))
+        del app
+    gc.collect()
+    deadline = time.monotonic() + 5
+    while threading.active_count() > n_threads and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert threading.active_count() == n_threads
+
+
+def test_use_sessions(init_fake_model, create_macros):
+    app = AnyPyProcess(
+        silent=True,
+        num_processes=2,
+        anybodycon_path=fake_anybodycon.__file__,
+        use_sessions=True,
+    )
+    macro = create_macros(range(10))
+    macro[4].append('classoperation Main.NonExistent "Dump"')
+
+    output = app.start_macro(macro)
+
+    assert [result["Main.a"] for result in output] == list(range(10))
+    assert ["ERROR" in result for result in output] == [i == 4 for i in range(10)]
+    pool = app._session_pool
+    # The model is only reloaded after the task with an error
+    assert pool.n_loads <= app.num_processes + 1
+    app.close_sessions()
+    assert pool.n_sessions == 0
+
+
+def test_imap_macro_does_not_cache(init_fake_model, create_macros):
+    app = AnyPyProcess(silent=True, anybodycon_path=fake_anybodycon.__file__)
+    app.start_macro(create_macros([1, 2]))
+    results = list(app.imap_macro(create_macros([7, 8])))
+    assert [result["Main.a"] for result in results] == [7, 8]
+    output = app.start_macro(create_macros([7, 8]))
+    assert [result["Main.a"] for result in output] == [7, 8]
+
+
+@pytest.mark.skipif(sys.platform.startswith("win"), reason="8 bit exit codes")
+def test_write_returncode_message():
+    log = io.StringIO()
+    assert _write_returncode_message(log, 234) == -22
+    assert "No license available" in log.getvalue()
+    log = io.StringIO()
+    assert _write_returncode_message(log, 200) == 200
+    assert "Return code: 200" in log.getvalue()
+    assert _write_returncode_message(io.StringIO(), 0) == 0
+
+
+def test_max_errors_only_stops_own_consoles(init_fake_model, monkeypatch):
+    monkeypatch.setenv("FAKE_ANYBODYCON_LOAD_TIME", "0.5")
+    macro = [['load "model.main.any"', 'classoperation Main.a "Dump"']]
+    other = AnyPyProcess(silent=True, anybodycon_path=fake_anybodycon.__file__)
+    other_output = []
+    thread = threading.Thread(
+        target=lambda: other_output.extend(other.start_macro(macro * 2))
+    )
+    thread.start()
+    app = AnyPyProcess(
+        silent=True,
+        num_processes=2,
+        anybodycon_path=fake_anybodycon.__file__,
+        max_errors=1,
+    )
+    failing = [['load "model.main.any"', 'classoperation Main.b "Dump"']]
+    output = app.start_macro(failing + macro * 3)
+    thread.join()
+
+    # The second task runs at the same time, and may finish before the abort
+    assert "ERROR" in output[0] and "ERROR" in output[-1]
+    assert [result["Main.a"] for result in other_output] == [1, 1]
+    # Consoles started after the aborted batch are not killed
+    with open("single.log", "w") as logfile:
+        retcode = execute_anybodycon(
+            macro[0], logfile, anybodycon_path=fake_anybodycon.__file__
+        )
+    assert retcode == 0
+
+
+def run_async(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+@pytest.mark.skipif(sys.platform.startswith("win"), reason="Uses os.kill")
+def test_execute_anybodycon_async_cancel(init_fake_model, monkeypatch):
+    monkeypatch.setenv("FAKE_ANYBODYCON_LOAD_TIME", "10")
+    pids_before = set(_subprocess_container._pids)
+
+    async def cancel_console():
+        with open("cancel.log", "w") as logfile:
+            job = asyncio.ensure_future(
+                execute_anybodycon_async(
+                    ['load "model.main.any"'],
+                    logfile,
+                    anybodycon_path=fake_anybodycon.__file__,
+                )
+            )
+            await asyncio.sleep(0.5)
+            pids = _subprocess_container._pids - pids_before
+            job.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await job
+        return pids
+
+    pids = run_async(cancel_console())
+
+    assert len(pids) == 1
+    assert not pids & _subprocess_container._pids
+    with pytest.raises(ProcessLookupError):
+        os.kill(pids.pop(), 0)
+
+
+def test_start_macro_async_max_errors(init_fake_model, create_macros):
+    app = AnyPyProcess(
+        silent=True,
+        num_processes=1,
+        anybodycon_path=fake_anybodycon.__file__,
+        max_errors=1,
+    )
+    failing = [['load "model.main.any"', 'classoperation Main.b "Dump"']]
+
+    output = run_async(app.start_macro_async(failing + create_macros(range(3))))
+
+    assert "Main.b" in output[0]["ERROR"][0]
+    # The next task may get the free slot before the batch is stopped
+    assert "The batch was stopped" in output[1]["ERROR"][0]
+    for result in output[2:]:
+        assert result["ERROR"] == [
+            "ERROR: AnyPyTools : Not run. The batch was stopped after 1 failed tasks"
+        ]
+
+    app = AnyPyProcess(silent=True, license_retries=3)
+    with pytest.raises(ValueError):
+        run_async(app.start_macro_async(failing))
+
+
+def test_fuse_tasks(init_fake_model, create_macros):
+    app = AnyPyProcess(
+        silent=True,
+        num_processes=2,
+        anybodycon_path=fake_anybodycon.__file__,
+        fuse_tasks=4,
+    )
+    macro = create_macros(range(10))
+    macro[4].append('classoperation Main.NonExistent "Dump"')
+
+    groups = list(app._group_tasks(_Task(os.getcwd(), m) for m in macro))
+    assert [len(group) for group in groups] == [4, 4, 2]
+
+    output = app.start_macro(macro)
+
+    assert [result["Main.a"] for result in output] == list(range(10))
+    assert ["ERROR" in result for result in output] == [i == 4 for i in range(10)]
+
+
+def test_license_retry(init_fake_model, monkeypatch):
+    license_dir = init_fake_model.mkdir("licenses")
+    monkeypatch.setenv("FAKE_ANYBODYCON_LICENSES", "2")
+    monkeypatch.setenv("FAKE_ANYBODYCON_LICENSE_DIR", str(license_dir))
+    monkeypatch.setenv("FAKE_ANYBODYCON_LOAD_TIME", "0.3")
+    app = AnyPyProcess(
+        silent=True,
+        num_processes=4,
+        anybodycon_path=fake_anybodycon.__file__,
+        return_task_info=True,
+        license_retries=10,
+        launch_interval=0.1,
+    )
+    macro = [['load "model.main.any"', 'classoperation Main.a "Dump"']] * 6
+
+    output = app.start_macro(macro)
+
+    for result in output:
+        assert "ERROR" not in result
+        assert result["Main.a"] == 1
+
+    app = AnyPyProcess(
+        silent=True,
+        num_processes=4,
+        anybodycon_path=fake_anybodycon.__file__,
+    )
+    output = app.start_macro(macro)
+    assert any("No license available" in str(result.get("ERROR")) for result in output)
+
+
+@pytest.mark.skipif(
+    not sys.platform.startswith("linux"), reason="Resource usage is read from /proc"
+)
+@pytest.mark.parametrize(
+    "options", [{}, {"stream_output": True}, {"use_sessions": True}]
+)
+def test_resource_usage(init_fake_model, options):
+    app = AnyPyProcess(
+        silent=True,
+        anybodycon_path=fake_anybodycon.__file__,
+        return_task_info=True,
+        **options
+    )
+    macro = [['load "model.main.any"', 'classoperation Main.a "Dump"']] * 2
+
+    output = app.start_macro(macro)
+
+    for result in output:
+        assert result["task_processtime"] > 0
+        assert result["task_user_time"] >= 0
+        assert result["task_system_time"] >= 0
+        assert result["task_peak_memory"] > 0
+        assert result["task_read_bytes"] >= 0
+        assert result["task_write_bytes"] >= 0
+    task = _Task.from_output_data(output[0])
+    assert task.usage["peak_memory"] == output[0]["task_peak_memory"]
+    app.close_sessions()
+
+
+def test_duration_history(init_fake_model, monkeypatch):
+    monkeypatch.setenv("FAKE_ANYBODYCON_RUN_TIME", "0.1")
+    macro = [
+        [
+            'load "model.main.any"',
+            'classoperation Main.a "Set Value" --value="{}"'.format(i),
+            "operation Main.Study.InverseDynamics",
+        ]
+        + ["run"] * (5 if i == 3 else 1)
+        + ['classoperation Main.a "Dump"']
+        for i in range(4)
+    ]
+    for _ in range(2):
+        started = []
+        app = AnyPyProcess(
+            silent=True,
+            num_processes=2,
+            anybodycon_path=fake_anybodycon.__file__,
+            duration_history="history",
+            tracers=[lambda e: e.name == "started" and started.append(e.task_id)],
+        )
+        output = app.start_macro(macro)
+        assert [result["Main.a"] for result in output] == list(range(4))
+
+    # The longest task runs first once its duration is known
+    assert started[0] == 3
+    # A new macro for the same model is estimated from the others
+    new_task = _Task(os.getcwd(), macro[0][:1] + ['classoperation Main.a "Dump"'])
+    assert app.duration_history.estimate(new_task) > 0
+
+
+def test_split_fused_log():
+    log = "load\n#> marker0\ntask1\n#> marker1\ntask2\ncrashed\n"
+    parts, n_found = _split_fused_log(log, ["marker0", "marker1", "marker2"])
+    assert n_found == 2
+    assert parts == ["load\n", "task1\n", "task2\ncrashed\n"]
+
+
 if __name__ == "__main__":
     pytest.main(str("test_abcutils.py"))
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from anypytools import AnyPyProcess, fake_anybodycon
+from anypytools.cache import ResultCache
+
+
+@pytest.fixture()
+def init_fake_model(init_fake_model):
+    init_fake_model.join("model.main.any").write('#include "part.any"\n', mode="a")
+    init_fake_model.join("part.any").write("// Included by the main file\n")
+    return init_fake_model
+
+
+def run_batch(cache, macro, **kwargs):
+    started = []
+    app = AnyPyProcess(
+        silent=True,
+        anybodycon_path=fake_anybodycon.__file__,
+        result_cache=cache,
+        tracers=[lambda e: e.name == "started" and started.append(e.task_id)],
+        **kwargs
+    )
+    return app, app.start_macro(macro), started
+
+
+def test_result_cache(init_fake_model, create_macros):
+    cache = ResultCache(str(init_fake_model.join("cache")))
+    macro = create_macros(range(3))
+    macro.append(['load "model.main.any"', 'classoperation Main.b "Dump"'])
+
+    _, output, started = run_batch(cache, macro)
+    assert started == [0, 1, 2, 3]
+
+    # Only the task with an error runs again
+    app, cached_output, started = run_batch(cache, macro)
+    assert started == [3]
+    assert [result["Main.a"] for result in cached_output[:3]] == [0, 1, 2]
+    assert cache.hits == 3
+
+    # A change in an included file changes the key
+    init_fake_model.join("part.any").write("// Changed\n")
+    _, _, started = run_batch(cache, macro)
+    assert started == [0, 1, 2, 3]
+
+    assert app.invalidate_cache(macro[0]) == 1
+    _, _, started = run_batch(cache, macro)
+    assert started == [0, 3]
+
+
+def test_result_cache_parse_options(init_fake_model):
+    cache = ResultCache(str(init_fake_model.join("cache")))
+    macro = [['load "model.main.any"', 'classoperation Main.b "Dump"']]
+
+    _, output, started = run_batch(cache, macro, ignore_errors=["Main.b"])
+    assert started == [0]
+    assert "ERROR" not in output[0]
+    _, output, started = run_batch(cache, macro, ignore_errors=["Main.b"])
+    assert started == []
+
+    # The ignored error is found when it is no longer ignored
+    _, output, started = run_batch(cache, macro)
+    assert started == [0]
+    assert "Main.b" in output[0]["ERROR"][0]
+
+
+def test_result_cache_eviction(tmpdir):
+    cache = ResultCache(str(tmpdir), max_size=2000)
+    for i in range(5):
+        cache.put("key{}".format(i), {"Main.a": "x" * 500}, 1.0)
+        tmpdir.join("key{}.result".format(i)).setmtime(1000 + i)
+    # Using an entry makes it the most recently used
+    assert cache.get("key0") is not None
+
+    cache.trim()
+
+    assert cache.size() <= 2000
+    assert cache.get("key0") is not None
+    assert cache.get("key1") is None
+    assert cache.get("key4") is not None
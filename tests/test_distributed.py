@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+import threading
+
+from anypytools import fake_anybodycon
+from anypytools.executors import ExecutorServer, FakeExecutor, LocalExecutor
+from anypytools.distributed import DistributedAnyPyProcess
+
+
+def start_worker(executor=None, num_processes=2, heartbeat_interval=0.2):
+    if executor is None:
+        executor = LocalExecutor(fake_anybodycon.__file__)
+    server = ExecutorServer(
+        ("127.0.0.1", 0), executor, num_processes, heartbeat_interval
+    )
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def test_distributed_start_macro(init_fake_model, create_macros):
+    workers = [start_worker() for _ in range(3)]
+    app = DistributedAnyPyProcess(
+        [w.server_address for w in workers], silent=True, return_task_info=True
+    )
+    assert app.num_processes == 6
+
+    output = app.start_macro(create_macros(range(12)))
+
+    assert [result["Main.a"] for result in output] == list(range(12))
+    assert all("ERROR" not in result for result in output)
+    app.close()
+    for worker in workers:
+        worker.close()
+
+
+def test_distributed_lost_worker(init_fake_model, create_macros):
+    slow_worker = start_worker(executor=FakeExecutor(load_time=2))
+    worker = start_worker(executor=FakeExecutor(load_time=0.05))
+    app = DistributedAnyPyProcess(
+        [slow_worker.server_address, worker.server_address], silent=True
+    )
+    # The slow worker is dropped while it runs its first tasks
+    threading.Timer(0.5, slow_worker.close).start()
+
+    output = app.start_macro(create_macros(range(8)))
+
+    assert [result["Main.a"] for result in output] == list(range(8))
+    assert all("ERROR" not in result for result in output)
+    assert not app.coordinator.workers[0].alive
+    app.close()
+    worker.close()
+
+
+def test_distributed_heartbeat_timeout(init_fake_model, create_macros):
+    silent_worker = start_worker(FakeExecutor(load_time=3), heartbeat_interval=100)
+    worker = start_worker(executor=FakeExecutor(load_time=0.05))
+    app = DistributedAnyPyProcess(
+        [silent_worker.server_address, worker.server_address],
+        heartbeat_timeout=0.5,
+        silent=True,
+    )
+
+    output = app.start_macro(create_macros(range(8)))
+
+    assert [result["Main.a"] for result in output] == list(range(8))
+    assert not app.coordinator.workers[0].alive
+    app.close()
+    worker.close()
+    silent_worker.close()
+
+
+def test_distributed_heartbeats_keep_slow_worker(init_fake_model, create_macros):
+    worker = start_worker(FakeExecutor(load_time=1), heartbeat_interval=0.1)
+    app = DistributedAnyPyProcess(
+        [worker.server_address], heartbeat_timeout=0.5, silent=True
+    )
+
+    output = app.start_macro(create_macros(range(2)))
+
+    assert [result["Main.a"] for result in output] == [0, 1]
+    assert app.coordinator.workers[0].alive
+    app.close()
+    worker.close()
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+import io
+import threading
+
+import pytest
+
+from anypytools import AnyPyProcess, fake_anybodycon
+from anypytools.executors import (
+    Executor,
+    FakeExecutor,
+    LocalExecutor,
+    RemoteExecutor,
+    ExecutorServer,
+)
+
+
+@pytest.fixture()
+def executor_server():
+    server = ExecutorServer(
+        ("127.0.0.1", 0), LocalExecutor(anybodycon_path=fake_anybodycon.__file__)
+    )
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture()
+def fake_macro(create_macros):
+    macro = create_macros(range(4))
+    macro[2].append('classoperation Main.NonExistent "Dump"')
+    return macro
+
+
+@pytest.mark.parametrize("stream_output", [False, True])
+def test_fake_executor(init_fake_model, fake_macro, stream_output):
+    app = AnyPyProcess(
+        silent=True,
+        anybodycon_path=fake_anybodycon.__file__,
+        executor=FakeExecutor(),
+        stream_output=stream_output,
+    )
+
+    output = app.start_macro(fake_macro)
+
+    assert [result["Main.a"] for result in output] == [0, 1, 2, 3]
+    assert ["ERROR" in result for result in output] == [False, False, True, False]
+
+
+@pytest.mark.parametrize("stream_output", [False, True])
+def test_remote_executor(init_fake_model, fake_macro, executor_server, stream_output):
+    app = AnyPyProcess(
+        silent=True,
+        num_processes=2,
+        anybodycon_path=fake_anybodycon.__file__,
+        executor=RemoteExecutor(executor_server.server_address),
+        stream_output=stream_output,
+    )
+
+    output = app.start_macro(fake_macro)
+
+    assert [result["Main.a"] for result in output] == [0, 1, 2, 3]
+    assert ["ERROR" in result for result in output] == [False, False, True, False]
+
+
+def test_remote_executor_connection_error(init_fake_model, fake_macro):
+    server = ExecutorServer(("127.0.0.1", 0))
+    address = server.server_address
+    server.server_close()
+    app = AnyPyProcess(
+        silent=True,
+        anybodycon_path=fake_anybodycon.__file__,
+        executor=RemoteExecutor(address, connect_timeout=1),
+    )
+
+    output = app.start_macro(fake_macro[0])
+
+    assert "Connection to" in output[0]["ERROR"][0]
+
+
+class BrokenExecutor(Executor):
+    def execute(self, macro, **kwargs):
+        raise RuntimeError("No console here")
+
+
+def test_executor_server_executor_error(tmpdir):
+    server = ExecutorServer(("127.0.0.1", 0), BrokenExecutor())
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    logfile = io.StringIO()
+    try:
+        returncode = RemoteExecutor(server.server_address).execute(
+            ['load "model.main.any"'], logfile, folder=str(tmpdir)
+        )
+    finally:
+        server.close()
+
+    assert returncode == 1
+    assert "The executor failed: No console here" in logfile.getvalue()
+    assert "Lost connection" not in logfile.getvalue()
+    assert not tmpdir.listdir()
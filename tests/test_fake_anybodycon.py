@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+import io
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+from anypytools import fake_anybodycon
+from anypytools.tools import parse_anybodycon_output
+
+
+def run_fake_console(tmpdir, macro, **kwargs):
+    tmpdir.join("model.main.any").write(
+        "Main = {\n"
+        "  AnyVar a = 1;\n"
+        "  AnyFloat Out = fake_array(100, 3);\n"
+        "  AnyFloat v = fake_array(5);\n"
+        "};\n"
+    )
+    stdout = io.StringIO()
+    console = fake_anybodycon.FakeAnyBodyCon(stdout, cwd=str(tmpdir), **kwargs)
+    console.banner()
+    for command in macro:
+        console.execute(command)
+    return stdout.getvalue()
+
+
+def test_fake_console_output(tmpdir):
+    macro = [
+        'load "model.main.any"',
+        "operation Main.Study.InverseDynamics",
+        "run",
+        'classoperation Main.Out "Dump"',
+        'classoperation Main.v "Dump"',
+        'classoperation Main.NonExistent "Dump"',
+    ]
+    log = run_fake_console(tmpdir, macro, n_warnings=3)
+
+    output = parse_anybodycon_output(log, warnings_to_include=["KIN6"])
+
+    assert output["Main.Out"].shape == (100, 3)
+    np.testing.assert_allclose(output["Main.v"], [0, 0.001, 0.002, 0.003, 0.004])
+    assert len(output["WARNING"]) == 3
+    assert "Unresolved object" in output["ERROR"][0]
+
+
+def test_fake_console_macro_file(tmpdir):
+    tmpdir.join("model.main.any").write("Main = {\n  AnyVar a = 2;\n};\n")
+    macro_file = tmpdir.join("macro.anymcr")
+    macro_file.write('load "model.main.any"\nclassoperation Main.a "Dump"\nexit\n')
+    env = dict(os.environ, FAKE_ANYBODYCON_EXIT_CODE="3")
+    proc = subprocess.run(
+        [sys.executable, fake_anybodycon.__file__, "--macro=", str(macro_file), "/ni"],
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+        env=env,
+    )
+    assert proc.returncode == 3
+    assert parse_anybodycon_output(proc.stdout)["Main.a"] == 2
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from anypytools import AnyPyProcess, fake_anybodycon
+from anypytools.h5columnar import (
+    save_columnar,
+    read_variable,
+    read_table,
+    load_columnar,
+)
+
+pytest.importorskip("h5py")
+
+MODEL = "Main = {{\n  AnyVar a = 1;\n  AnyFloat Out = fake_array({}, 3);\n}};\n"
+DUMP_OUT = 'classoperation Main.Out "Dump"'
+
+
+def test_columnar_hdf5(init_fake_model, create_macros):
+    init_fake_model.join("model.main.any").write(MODEL.format(4))
+    app = AnyPyProcess(silent=True, anybodycon_path=fake_anybodycon.__file__)
+    output = app.start_macro(create_macros(range(3), DUMP_OUT))
+    app.save_to_hdf5("results.h5", layout="columnar")
+    assert read_variable("results.h5", "Main.a").tolist() == [0, 1, 2]
+    out = read_variable("results.h5", "Out")
+    assert out.shape == (3, 4, 3)
+    np.testing.assert_array_equal(out[1], output[1]["Main.Out"])
+
+    # Append a batch with longer arrays and a task with an error
+    init_fake_model.join("model.main.any").write(MODEL.format(6))
+    macros = create_macros([3, 4], DUMP_OUT)
+    macros.append(['load "model.main.any"', 'classoperation Main.b "Dump"'])
+    app.start_macro(macros)
+    app.save_to_hdf5("results.h5", layout="columnar")
+
+    a = read_variable("results.h5", "Main.a")
+    np.testing.assert_array_equal(a, [0, 1, 2, 3, 4, np.nan])
+    out = read_variable("results.h5", "Out")
+    assert [elem.shape for elem in out] == [(4, 3)] * 3 + [(6, 3)] * 2 + [(0, 3)]
+
+    table = read_table("results.h5")
+    assert table["ERROR"][:5] == [None] * 5
+    assert "Main.b" in table["ERROR"][5][0]
+    assert table["task_name"][0] == output[0]["task_name"]
+
+    loaded = load_columnar("results.h5")
+    assert len(loaded) == 6
+    assert loaded[3]["Main.a"] == 3
+    assert loaded[0]["task_macro"][:4] == create_macros([0], DUMP_OUT)[0]
+
+
+@pytest.mark.parametrize(
+    "bad_output",
+    [
+        {"a": np.arange(3), "b": "text"},
+        {"a": np.zeros((2, 3)), "b": 2.0},
+    ],
+)
+def test_columnar_failed_append(tmpdir, bad_output):
+    filename = str(tmpdir.join("results.h5"))
+    save_columnar(filename, [{"a": np.zeros((2, 2)), "b": 1.0}])
+
+    with pytest.raises(ValueError):
+        save_columnar(filename, [bad_output])
+
+    # Nothing was written by the failed append
+    loaded = load_columnar(filename)
+    assert len(loaded) == 1
+    assert read_variable(filename, "a").shape == (1, 2, 2)
+    assert read_variable(filename, "b").tolist() == [1.0]
+
+    save_columnar(filename, [{"a": np.ones((2, 2)), "b": 2.0}])
+    assert read_variable(filename, "a").shape == (2, 2, 2)
+    assert read_variable(filename, "b").tolist() == [1.0, 2.0]
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+import os
+
+import pytest
+
+from anypytools import AnyPyProcess, fake_anybodycon
+from anypytools.journal import TaskJournal
+
+
+def run_batch(journal, macro):
+    started = []
+    app = AnyPyProcess(
+        silent=True,
+        anybodycon_path=fake_anybodycon.__file__,
+        journal=journal,
+        tracers=[lambda e: e.name == "started" and started.append(e.task_id)],
+    )
+    return app.start_macro(macro), started
+
+
+def test_journal_resume(init_fake_model, create_macros):
+    journal = str(init_fake_model.join("batch.journal"))
+    macro = create_macros(range(4))
+    macro.append(['load "model.main.any"', 'classoperation Main.b "Dump"'])
+
+    # An interrupted batch, which only finished the first tasks
+    _, started = run_batch(journal, macro[:2])
+    assert started == [0, 1]
+    assert len(TaskJournal(journal).read()) == 2
+
+    # A record which was only partly written is ignored and cut off
+    with open(journal, "ab") as f:
+        f.write(b"\x40\x00\x00\x00partial")
+
+    output, started = run_batch(journal, macro)
+    assert sorted(started) == [2, 3, 4]
+    assert [result["Main.a"] for result in output[:4]] == [0, 1, 2, 3]
+    assert "ERROR" in output[4]
+    assert len(TaskJournal(journal).read()) == 5
+
+    # Only the task with an error runs again
+    _, started = run_batch(journal, macro)
+    assert started == [4]
+
+    results = AnyPyProcess(anybodycon_path=fake_anybodycon.__file__).load_results(
+        journal
+    )
+    assert [result["task_id"] for result in results] == [0, 1, 2, 3, 4]
+    assert results[2]["Main.a"] == 2
+
+
+def test_journal_bad_header(init_fake_model, create_macros, caplog):
+    journal = str(init_fake_model.join("batch.journal"))
+    with open(journal, "w") as f:
+        f.write("Not a journal\n")
+    # The journal is checked before the batch starts
+    with pytest.raises(ValueError):
+        run_batch(journal, create_macros(range(2)))
+
+    def break_journal(event):
+        if event.name == "started":
+            with open(journal, "w") as f:
+                f.write("Not a journal\n")
+
+    os.remove(journal)
+    app = AnyPyProcess(
+        silent=True,
+        anybodycon_path=fake_anybodycon.__file__,
+        journal=journal,
+        tracers=[break_journal],
+    )
+    output = app.start_macro(create_macros(range(2)))
+
+    # A journal which breaks during the batch does not stop it
+    assert [result["Main.a"] for result in output] == [0, 1]
+    assert "Could not write" in caplog.text
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+from urllib.request import urlopen
+
+from anypytools import AnyPyProcess, fake_anybodycon
+from anypytools.metrics import BatchMetrics
+
+
+def test_batch_metrics(init_fake_model):
+    metrics = BatchMetrics()
+    server = metrics.serve(0)
+    app = AnyPyProcess(
+        silent=True,
+        num_processes=2,
+        anybodycon_path=fake_anybodycon.__file__,
+        tracers=[metrics],
+    )
+    macro = [['load "model.main.any"', 'classoperation Main.a "Dump"']] * 4
+    macro.append(['load "model.main.any"', 'classoperation Main.b "Dump"'])
+
+    try:
+        app.start_macro(macro)
+        assert metrics.completed == 5
+        assert metrics.failed == 1
+        assert metrics.queued == 0
+        assert metrics.running == 0
+
+        url = "http://{}:{}/metrics".format(*server.server_address)
+        text = urlopen(url).read().decode("UTF-8")
+        metrics.save("metrics.prom")
+    finally:
+        metrics.close()
+
+    assert "anypytools_tasks_completed_total 5.0" in text
+    assert "anypytools_tasks_failed_total 1.0" in text
+    assert 'anypytools_task_duration_seconds{quantile="0.95"}' in text
+    assert "anypytools_task_duration_seconds_count 5" in text
+    assert init_fake_model.join("metrics.prom").read().startswith("# HELP")
+
+
+def test_batch_metrics_queued(init_fake_model):
+    metrics = BatchMetrics()
+    queued = []
+
+    def record(event):
+        if event.name == "started":
+            queued.append(metrics.queued)
+
+    app = AnyPyProcess(
+        silent=True,
+        num_processes=2,
+        anybodycon_path=fake_anybodycon.__file__,
+        tracers=[metrics, record],
+    )
+    macro = [['load "model.main.any"', 'classoperation Main.a "Dump"']] * 20
+
+    app.start_macro(macro)
+
+    # All tasks which have not started are counted as queued
+    assert len(queued) == 20
+    assert queued[0] >= 18
+    assert queued[-1] == 0
+    assert metrics.queued == 0
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+import shelve
+
+from anypytools import AnyPyProcess, fake_anybodycon
+from anypytools.storage import ResultStore
+
+
+def test_save_load_results(init_fake_model, create_macros):
+    app = AnyPyProcess(silent=True, anybodycon_path=fake_anybodycon.__file__)
+    app.start_macro(create_macros(range(3)))
+    app.save_results("results.db")
+    assert ResultStore.is_store("results.db")
+    app.start_macro(create_macros(range(3, 5)))
+    app.save_results("results.db", append=True)
+    assert len(ResultStore("results.db")) == 5
+
+    results = app.load_results("results.db")
+    assert [result["Main.a"] for result in results] == [0, 1, 2, 3, 4]
+    assert [result["task_id"] for result in results] == [0, 1, 2, 0, 1]
+
+    results = app.load_results("results.db", task_ids=[1])
+    assert [result["Main.a"] for result in results] == [1, 4]
+    results = app.load_results("results.db", where=lambda out: out["Main.a"] > 2)
+    assert [result["Main.a"] for result in results] == [3, 4]
+    assert len(app.cached_tasklist) == 2
+
+    app.save_results("results.db")
+    assert len(ResultStore("results.db")) == 2
+
+
+def test_save_results_legacy_shelve(init_fake_model, create_macros):
+    app = AnyPyProcess(silent=True, anybodycon_path=fake_anybodycon.__file__)
+    app.start_macro(create_macros(range(2)))
+    db = shelve.open("legacy")
+    db["processed_tasks"] = app.cached_tasklist
+    db.close()
+
+    app.save_results("legacy", append=True)
+    assert not ResultStore.is_store("legacy")
+    results = app.load_results("legacy", names=[app.cached_tasklist[0].name])
+    assert [result["Main.a"] for result in results] == [0, 1, 0, 1]
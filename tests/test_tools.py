@@ -5,6 +5,9 @@ Created on Sun Jul 06 19:09:58 2014
 @author: Morten
 """
 import os
+import re
+from ast import literal_eval
+
 import pytest
 import numpy as np
 
@@ -15,7 +18,13 @@ from anypytools.tools import (
     path2str,
     AnyPyProcessOutput,
     AnyPyProcessOutputList,
+    RaggedArray,
+    AnyBodyConOutputParser,
+    parse_anybodycon_output,
+    _parse_data,
+    _parse_numeric,
 )
+from anypytools.fake_anybodycon import fake_array
 
 
 @pytest.yield_fixture(scope="module")
@@ -82,6 +91,142 @@ def test_AnyPyProcessOutput():
     assert out["A"].shape == (5,)
 
 
+def test_AnyPyProcessOutputList_columnar():
+    out = AnyPyProcessOutputList(
+        [
+            AnyPyProcessOutput({"Main.t": np.arange(3.0) + i, "Main.n": i})
+            for i in range(4)
+        ],
+        columnar=True,
+    )
+    t = out["t"]
+    assert t.shape == (4, 3)
+    assert out["t"] is t
+    # The outputs share the memory of the stacked array
+    assert np.shares_memory(out[2]["Main.t"], t)
+    np.testing.assert_array_equal(out[2]["Main.t"], [2, 3, 4])
+    assert out["Main.n"].tolist() == [0, 1, 2, 3]
+
+    out.append(AnyPyProcessOutput({"Main.t": np.zeros(3), "Main.n": 4}))
+    assert out["t"].shape == (5, 3)
+    assert out[1:3].columnar
+
+
+def test_partial_key_lookup(capsys):
+    keys = [
+        "Main.Study.Output.Abscissa.t",
+        "Main.Model.Mus{}.Fm",
+        "Main.Model.Mus{}.Ft",
+    ]
+    out = AnyPyProcessOutputList(
+        [
+            AnyPyProcessOutput((key.format(i), float(i)) for key in keys)
+            for i in range(3)
+        ]
+    )
+    assert out[1]["Abscissa.t"] == 1
+    assert out["Abscissa.t"].tolist() == [0, 1, 2]
+    # Ambiguous keys use the first match and are only reported once
+    assert out[0]["Mus0"] == 0
+    assert out[1]["Mus1"] == 1
+    assert out[2]["Mus2"] == 2
+    assert out[2]["Mus2"] == 2
+    assert capsys.readouterr().err.count("WARNING") == 3
+
+    # The index is updated when keys are added
+    out[0]["Main.Model.Extra"] = 5.0
+    assert out[0]["Extra"] == 5
+    with pytest.raises(KeyError):
+        out[1]["Extra"]
+
+
+def test_RaggedArray():
+    arrays = [np.arange(3.0), np.arange(5.0), np.zeros(0), np.ones(2)]
+    r = RaggedArray.from_arrays(arrays)
+    assert len(r) == 4
+    assert r.lengths.tolist() == [3, 5, 0, 2]
+    np.testing.assert_array_equal(r[1], arrays[1])
+    assert r[1:3].lengths.tolist() == [5, 0]
+    assert all(np.array_equal(a, b) for a, b in zip(r.to_arrays(), arrays))
+
+    assert r.sum() == 15
+    np.testing.assert_array_equal(r.sum(axis=1), [3, 10, 0, 2])
+    np.testing.assert_array_equal(r.mean(axis=1), [1, 2, np.nan, 1])
+    np.testing.assert_array_equal(r.max(axis=1), [2, 4, np.nan, 1])
+    np.testing.assert_array_equal((2 * r + 1)[3], [3, 3])
+    masked = r.to_masked()
+    assert masked.shape == (4, 5)
+    assert masked.count(axis=1).tolist() == [3, 5, 0, 2]
+
+    out = AnyPyProcessOutputList(
+        [AnyPyProcessOutput({"Main.t": np.arange(n)}) for n in (3, 5)]
+    )
+    assert isinstance(out["t"], RaggedArray)
+    assert out["t"].tolist() == [[0, 1, 2], [0, 1, 2, 3, 4]]
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        {},
+        {"errors_to_ignore": ["Unresolved object"]},
+        {"warnings_to_include": ["OBJ1", "KIN6"], "fatal_warnings": True},
+    ],
+)
+def test_AnyBodyConOutputParser(request, kwargs):
+    logfile = str(request.fspath.new(basename="anybodycon_output.log"))
+    with open(logfile) as fh:
+        raw = fh.read()
+    expected = parse_anybodycon_output(raw, **kwargs)
+
+    parser = AnyBodyConOutputParser(**kwargs)
+    with open(logfile) as fh:
+        for line in fh:
+            parser.feed(line)
+    output = parser.finish()
+
+    assert list(output.keys()) == list(expected.keys())
+    for key, value in expected.items():
+        np.testing.assert_array_equal(output[key], value)
+    assert output["Main.ArmModelStudy.Output.Model.Jnt.Elbow.Pos"].shape == (10, 1)
+
+
+def test_lazy_parsing(request):
+    logfile = str(request.fspath.new(basename="anybodycon_output.log"))
+    with open(logfile) as fh:
+        raw = fh.read()
+    expected = parse_anybodycon_output(raw)
+    output = parse_anybodycon_output(raw, lazy=True)
+
+    key = "Main.ArmModelStudy.Output.Model.Jnt.Elbow.Pos"
+    raw_value = super(AnyPyProcessOutput, output).__getitem__(key)
+    assert not isinstance(raw_value, np.ndarray)
+    assert output["Elbow.Pos"].shape == (10, 1)
+    assert isinstance(super(AnyPyProcessOutput, output).__getitem__(key), np.ndarray)
+
+    assert list(output.keys()) == list(expected.keys())
+    for key, value in expected.items():
+        np.testing.assert_array_equal(output.get(key), value)
+
+
+def test_parse_numeric_dump(request):
+    logfile = str(request.fspath.new(basename="anybodycon_output.log"))
+    with open(logfile) as fh:
+        dumps = re.findall(r"= (\{[^;]*\});", fh.read())
+    dumps += [fake_array(5), fake_array(4, 3), fake_array(1, 1)]
+    dumps += ["{{{1, -2}}, {{+3, 0}}}", "{1.5, 2, -3e-05, .5, 5.}", "{0, 10, 100}"]
+    for dump in dumps:
+        expected = np.array(literal_eval(dump.replace("{", "[").replace("}", "]")))
+        value = _parse_data(dump)
+        assert value.dtype == expected.dtype
+        assert value.shape == expected.shape
+        np.testing.assert_array_equal(value, expected)
+
+    # Dumps which are left to literal_eval
+    for dump in ["{{1, 2}, {3}}", "{}", "{01, 2}", "{1 2}", "{-{1}}", '{"a", 1}']:
+        assert _parse_numeric(dump) is None
+
+
 def test_get_anybodycon_path():
     abc = get_anybodycon_path()
 
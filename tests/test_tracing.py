@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+import json
+
+import pytest
+
+from anypytools import AnyPyProcess, fake_anybodycon
+from anypytools.tracing import ChromeTraceWriter
+
+
+@pytest.mark.parametrize("stream_output", [False, True])
+def test_chrome_trace(init_fake_model, stream_output):
+    writer = ChromeTraceWriter("trace.json")
+    app = AnyPyProcess(
+        silent=True,
+        num_processes=2,
+        anybodycon_path=fake_anybodycon.__file__,
+        stream_output=stream_output,
+        tracers=[writer],
+    )
+    macro = [['load "model.main.any"', 'classoperation Main.a "Dump"']] * 3
+
+    app.start_macro(macro)
+
+    phases = ["queued", "started", "macro_written", "spawned"]
+    if stream_output:
+        phases.append("first_output")
+    phases += ["exited", "parsed", "cleaned", "finished"]
+    for task_id in range(3):
+        events = [e.name for e in writer.events if e.task_id == task_id]
+        assert events == phases
+    names = [e.name for e in writer.events if e.task_id is None]
+    assert names[0] == "batch_started"
+    assert names[-1] == "batch_finished"
+
+    with open("trace.json") as f:
+        trace = json.load(f)["traceEvents"]
+    spans = {e["name"] for e in trace if e["ph"] == "X"}
+    assert {"batch", "cleanup_logfiles", "run", "parse"} <= spans